@@ -0,0 +1,163 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures the throughput of the Vix driver operations, using the fake Vix
+backend in place of VMware. e.g.:
+
+    python tools/vix_benchmark.py --instances 50 --concurrency 10 \
+    --latency 0.1 --op-latency VixVM_PowerOn=2
+"""
+import eventlet
+eventlet.monkey_patch(os=False)
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from oslo.config import cfg
+
+from vix.compute import driver
+from vix import fakevix
+
+CONF = cfg.CONF
+
+
+class _LocalImageCache(object):
+    def __init__(self, base_vmdk_path, properties=None):
+        self._base_vmdk_path = base_vmdk_path
+        self._properties = properties or {}
+
+    def get_image_info(self, context, image_id):
+        return {"disk_format": "vmdk", "properties": self._properties}
+
+    def get_cached_image_info(self, context, image_id):
+        return self.get_image_info(context, image_id)
+
+    def get_cached_image(self, context, image_id, user_id, project_id):
+        return self._base_vmdk_path
+
+    def get_vmdk_image(self, image_path, subformat=None):
+        return image_path
+
+    def add_image_instance(self, image_id, instance_name):
+        pass
+
+    def remove_image_instance(self, image_id, instance_name):
+        pass
+
+
+def _get_instance(index):
+    return {'name': 'instance-%08x' % index,
+            'uuid': 'fake-uuid-%d' % index,
+            'display_name': 'bench%d' % index,
+            'image_ref': 'fake-image',
+            'user_id': 'fake-user',
+            'project_id': 'fake-project',
+            'vcpus': 1,
+            'memory_mb': 512}
+
+
+def _measure(pool, op_name, func, items):
+    start = time.time()
+    for _ in pool.imap(func, items):
+        pass
+    elapsed = time.time() - start
+    print "%-14s %6d ops %9.3f s %9.2f ops/s" % (
+        op_name, len(items), elapsed, len(items) / max(elapsed, 1e-9))
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Vix driver benchmark")
+    parser.add_argument("--instances", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Default Vix job latency in seconds")
+    parser.add_argument("--op-latency", action="append", default=[],
+                        metavar="FUNCTION=SECONDS",
+                        help="Latency of a specific Vix function")
+    parser.add_argument("--no-cow", action="store_true",
+                        help="Use full copies instead of linked clones")
+    parser.add_argument("--batch-destroy", action="store_true",
+                        help="Destroy all the instances in a single batch")
+    parser.add_argument("--instant-boot", action="store_true",
+                        help="Spawn from the memory snapshot of a booted "
+                             "template VM")
+    parser.add_argument("--clone-pool", type=int, default=0, metavar="SIZE",
+                        help="Spawn from a pool of linked clones filled "
+                             "before the measurements")
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+
+    latencies = {}
+    for s in args.op_latency:
+        name, latency = s.split("=")
+        latencies[name] = float(latency)
+    fakevix.install(fakevix.FakeVixLibrary(latencies=latencies,
+                                           default_latency=args.latency))
+
+    instances_path = tempfile.mkdtemp()
+    try:
+        CONF.set_override('instances_path', instances_path)
+        CONF.set_override('use_cow_images', not args.no_cow)
+        CONF.set_override('vnc_enabled', False)
+        CONF.set_override('job_threads', args.concurrency, 'vix')
+        CONF.set_override('clone_pool_size', args.clone_pool, 'vix')
+
+        base_dir = os.path.join(instances_path, '_base')
+        os.makedirs(base_dir)
+        base_vmdk_path = os.path.join(base_dir, 'fake-image.vmdk')
+        with open(base_vmdk_path, 'wb') as f:
+            f.write('# Disk DescriptorFile' + os.linesep)
+
+        drv = driver.VixDriver(None)
+        properties = {}
+        if args.instant_boot:
+            properties["vix_instant_boot"] = "true"
+        drv._image_cache = _LocalImageCache(base_vmdk_path, properties)
+        if args.clone_pool:
+            drv._clone_pool.fill(base_vmdk_path)
+
+        pool = eventlet.GreenPool(args.concurrency)
+        instances = [_get_instance(i) for i in range(args.instances)]
+
+        _measure(pool, "spawn",
+                 lambda i: drv.spawn(None, i, None, [], None, []), instances)
+        _measure(pool, "get_info", drv.get_info, instances)
+        _measure(pool, "list_instances", lambda i: drv.list_instances(),
+                 instances)
+        if args.batch_destroy:
+            start = time.time()
+            drv.destroy_instances(instances)
+            elapsed = time.time() - start
+            print "%-14s %6d ops %9.3f s %9.2f ops/s" % (
+                "destroy_batch", len(instances), elapsed,
+                len(instances) / max(elapsed, 1e-9))
+        else:
+            _measure(pool, "destroy", lambda i: drv.destroy(i, []),
+                     instances)
+    finally:
+        shutil.rmtree(instances_path, True)
+
+
+if __name__ == '__main__':
+    main()
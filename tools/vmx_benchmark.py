@@ -0,0 +1,86 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures the VMX file generation throughput, e.g.:
+
+    python tools/vmx_benchmark.py --instances 5000 --profiles 4
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from vix import vixutils
+
+
+def _measure(op_name, func, items):
+    start = time.time()
+    for item in items:
+        func(item)
+    elapsed = time.time() - start
+    print "%-14s %6d ops %9.3f s %9.2f ops/s" % (
+        op_name, len(items), elapsed, len(items) / max(elapsed, 1e-9))
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="VMX generation benchmark")
+    parser.add_argument("--instances", type=int, default=5000)
+    parser.add_argument("--profiles", type=int, default=4,
+                        help="Number of distinct guest OS / device profiles")
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+
+    conn = vixutils.VixConnection()
+    instances_path = tempfile.mkdtemp()
+    try:
+        def _get_args(i):
+            return {
+                'vmx_path': os.path.join(instances_path, 'instance-%08x' % i,
+                                         'instance-%08x.vmx' % i),
+                'display_name': 'instance-%08x' % i,
+                'guest_os': 'guest-os-%d' % (i % args.profiles),
+                'nested_hypervisor': bool(i % 2),
+                'num_vcpus': 2,
+                'mem_size_mb': 2048,
+                'disk_paths': [os.path.join(instances_path, 'disk.vmdk')],
+                'networks': [(vixutils.NETWORK_NAT,
+                              '00:50:56:00:%02x:%02x' % (i / 256 % 256,
+                                                         i % 256))]}
+
+        instances = [_get_args(i) for i in range(args.instances)]
+
+        def _render(kwargs):
+            template = conn._get_vmx_template(10, kwargs['guest_os'],
+                                              kwargs['nested_hypervisor'],
+                                              False)
+            template.render({'displayName': kwargs['display_name'],
+                             'memsize': str(kwargs['mem_size_mb'])})
+
+        _measure("render", _render, instances)
+        _measure("create_vm", lambda kwargs: conn.create_vm(**kwargs),
+                 instances)
+    finally:
+        shutil.rmtree(instances_path, True)
+
+
+if __name__ == '__main__':
+    main()
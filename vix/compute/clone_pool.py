@@ -0,0 +1,176 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Pool of powered off linked clones, created in advance for the most used
+images.
+"""
+import os
+import uuid
+
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova import utils
+
+from vix import vmx
+
+LOG = logging.getLogger(__name__)
+
+# Base name of the files of the pooled VMs, renamed after the instance
+# when claimed
+POOL_VM_NAME = 'pool'
+
+# Suffix of the directories of the clones being created
+_TMP_SUFFIX = '.tmp'
+
+
+class ClonePool(object):
+    """Linked clones of the cached base disks, kept in
+    "<instances path>/_pool/<base disk name>/<slot>" directories.
+
+    clone_func(base_vmdk_path, root_vmdk_path, vmx_path, guest_os) creates
+    a linked clone of the given base disk.
+    """
+    def __init__(self, pathutils, clone_func, size):
+        self._pathutils = pathutils
+        self._clone_func = clone_func
+        self._size = size
+        # Guest OS of the base disks whose pool is refilled when a clone is
+        # claimed
+        self._base_vmdk_paths = {}
+
+    def _get_pool_dir(self, base_vmdk_path):
+        base_name = os.path.basename(base_vmdk_path).rsplit('.', 1)[0]
+        return os.path.join(self._pathutils.get_clone_pool_dir(), base_name)
+
+    def _get_slots(self, pool_dir):
+        if not self._pathutils.exists(pool_dir):
+            return []
+        return sorted([slot for slot in self._pathutils.listdir(pool_dir)
+                       if not slot.endswith(_TMP_SUFFIX)])
+
+    def add_image(self, base_vmdk_path, guest_os=None):
+        """Keeps a pool of clones of the given base disk, filling it in the
+        background.
+        """
+        if self._size <= 0:
+            return
+        self._base_vmdk_paths[base_vmdk_path] = guest_os
+        utils.spawn_n(self.fill, base_vmdk_path)
+
+    def fill(self, base_vmdk_path):
+        pool_dir = self._get_pool_dir(base_vmdk_path)
+
+        @utils.synchronized('clone-pool-fill-' + pool_dir)
+        def fill_pool():
+            if not self._pathutils.exists(pool_dir):
+                self._pathutils.makedirs(pool_dir)
+
+            # Leftovers of interrupted clones
+            for slot in self._pathutils.listdir(pool_dir):
+                if slot.endswith(_TMP_SUFFIX):
+                    self._pathutils.rmtree(os.path.join(pool_dir, slot))
+
+            missing = self._size - len(self._get_slots(pool_dir))
+            for i in range(missing):
+                self._create_clone(base_vmdk_path, pool_dir)
+            if missing > 0:
+                LOG.info(_("Added %(count)d clones to the pool of "
+                           "%(base_vmdk_path)s") %
+                         {'count': missing, 'base_vmdk_path': base_vmdk_path})
+
+        try:
+            fill_pool()
+        except Exception:
+            LOG.exception(_("Filling the clone pool of %s failed") %
+                          base_vmdk_path)
+
+    def _create_clone(self, base_vmdk_path, pool_dir):
+        slot = uuid.uuid4().hex
+        tmp_dir = os.path.join(pool_dir, slot + _TMP_SUFFIX)
+        try:
+            self._pathutils.makedirs(tmp_dir)
+            self._clone_func(base_vmdk_path,
+                             os.path.join(tmp_dir, 'root.vmdk'),
+                             os.path.join(tmp_dir, POOL_VM_NAME + '.vmx'),
+                             self._base_vmdk_paths.get(base_vmdk_path))
+            # Only complete clones are visible to claim()
+            self._pathutils.rename(tmp_dir, os.path.join(pool_dir, slot))
+        except Exception:
+            if self._pathutils.exists(tmp_dir):
+                self._pathutils.rmtree(tmp_dir)
+            raise
+
+    def claim(self, base_vmdk_path, instance_name):
+        """Moves a pooled clone of the given base disk to the directory of
+        the instance, returning False if the pool is empty.
+        """
+        pool_dir = self._get_pool_dir(base_vmdk_path)
+        instance_dir = self._pathutils.get_instance_dir(instance_name)
+
+        @utils.synchronized(pool_dir)
+        def claim_slot():
+            for slot in self._get_slots(pool_dir):
+                if self._pathutils.exists(instance_dir):
+                    self._pathutils.rmtree(instance_dir)
+                self._pathutils.rename(os.path.join(pool_dir, slot),
+                                       instance_dir)
+                return True
+            return False
+
+        claimed = claim_slot()
+        if claimed:
+            self._rename_vm_files(instance_dir, instance_name)
+        if base_vmdk_path in self._base_vmdk_paths:
+            utils.spawn_n(self.fill, base_vmdk_path)
+        return claimed
+
+    def _rename_vm_files(self, instance_dir, instance_name):
+        for file_name in self._pathutils.listdir(instance_dir):
+            new_file_name = self._get_instance_file_name(file_name,
+                                                         instance_name)
+            if new_file_name:
+                self._pathutils.rename(
+                    os.path.join(instance_dir, file_name),
+                    os.path.join(instance_dir, new_file_name))
+
+        # e.g. extendedConfigFile = "pool.vmxf"
+        vmx_file = vmx.VmxFile.load(self._pathutils.get_vmx_path(
+            instance_name))
+        for (key, value) in vmx_file.items():
+            new_value = self._get_instance_file_name(value, instance_name)
+            if new_value:
+                vmx_file.set(key, new_value)
+        vmx_file.save()
+
+    def _get_instance_file_name(self, file_name, instance_name):
+        (name, ext) = os.path.splitext(file_name)
+        if name == POOL_VM_NAME and ext:
+            return instance_name + ext
+
+    def remove_unused(self):
+        """Removes the pools of the base disks not added with add_image."""
+        pool_root_dir = self._pathutils.get_clone_pool_dir()
+        if not self._pathutils.exists(pool_root_dir):
+            return
+
+        pool_dirs = set([self._get_pool_dir(base_vmdk_path)
+                         for base_vmdk_path in self._base_vmdk_paths])
+        for pool_name in self._pathutils.listdir(pool_root_dir):
+            pool_dir = os.path.join(pool_root_dir, pool_name)
+            if pool_dir not in pool_dirs:
+                LOG.info(_("Removing the unused clone pool %s") % pool_dir)
+                utils.synchronized(pool_dir)(self._pathutils.rmtree)(pool_dir)
@@ -0,0 +1,196 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Promotion of long-lived linked clones to full clones, removing their
+dependency on the base disks in the image cache.
+"""
+import os
+
+from nova.openstack.common import excutils
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import log as logging
+from nova.openstack.common import timeutils
+from nova import utils
+
+from vix import disk_manager
+from vix import vixlib
+from vix import vmx
+
+LOG = logging.getLogger(__name__)
+
+# Set in the vmx file of the promoted instances
+PROMOTED_VMX_KEY = 'nova.promotedClone'
+
+# Power states in which the root disk is not in use
+_PROMOTABLE_POWER_STATES = (vixlib.VIX_POWERSTATE_POWERED_OFF |
+                            vixlib.VIX_POWERSTATE_SUSPENDED)
+
+# Suffix of the consolidated root disk being created
+_FULL_DISK_SUFFIX = '-full.vmdk'
+
+# Suffix of the linked clone root disk while being replaced
+_LINKED_DISK_SUFFIX = '.linked'
+
+
+class ClonePromoter(object):
+    """Consolidates the root disks of the linked clones older than min_age
+    seconds, or grown beyond min_disk_size_mb, into standalone disks. A
+    value of 0 disables the respective criteria.
+
+    Only powered off or suspended instances are promoted. The snapshot
+    named baseline_snapshot_name is removed when it is the only snapshot
+    of the instance, other snapshots prevent the promotion.
+    """
+    def __init__(self, pathutils, conn, min_age, min_disk_size_mb,
+                 baseline_snapshot_name=None):
+        self._pathutils = pathutils
+        self._conn = conn
+        self._min_age = min_age
+        self._min_disk_size_mb = min_disk_size_mb
+        self._baseline_snapshot_name = baseline_snapshot_name
+        self._disk_manager = disk_manager.DiskManager()
+        self._running = False
+
+    def promote_instances(self, instances):
+        """Promotes the eligible instances in the background, unless the
+        previous run is still in progress.
+        """
+        if self._running or (self._min_age <= 0 and
+                             self._min_disk_size_mb <= 0):
+            return
+        self._running = True
+        utils.spawn_n(self._promote_instances, instances)
+
+    def _promote_instances(self, instances):
+        try:
+            for instance in instances:
+                try:
+                    if self._is_promotion_due(instance):
+                        self.promote(instance['name'])
+                except Exception:
+                    LOG.exception(_("Promoting the linked clone of instance "
+                                    "%s failed") % instance['name'])
+        finally:
+            self._running = False
+
+    def _is_older_than(self, created_at, seconds):
+        if isinstance(created_at, basestring):
+            created_at = timeutils.parse_isotime(created_at)
+        return timeutils.is_older_than(timeutils.normalize_time(created_at),
+                                       seconds)
+
+    def _is_promotion_due(self, instance):
+        root_vmdk_path = self._pathutils.get_root_vmdk_path(instance['name'])
+        # Instances on other hosts sharing the instances path are skipped
+        if (not self._pathutils.exists(root_vmdk_path) or
+                not self._disk_manager.get_parent_disk_path(root_vmdk_path)):
+            return False
+
+        # The delta disk holds the data written by the instance
+        if (self._min_disk_size_mb > 0 and
+                os.path.getsize(root_vmdk_path) >=
+                self._min_disk_size_mb * 1024 * 1024):
+            return True
+        return (self._min_age > 0 and instance.get('created_at') and
+                self._is_older_than(instance['created_at'], self._min_age))
+
+    def _is_stopped(self, vmx_path):
+        with self._conn.open_vm(vmx_path) as vm:
+            return bool(vm.get_power_state() & _PROMOTABLE_POWER_STATES)
+
+    def _remove_baseline_snapshot(self, vmx_path):
+        with self._conn.open_vm(vmx_path) as vm:
+            snapshot_tree = vm.get_snapshot_tree()
+            if (not self._baseline_snapshot_name or
+                    [(snapshot_info.name, snapshot_info.children)
+                     for snapshot_info in snapshot_tree] !=
+                    [(self._baseline_snapshot_name, [])]):
+                return False
+            # Merges the snapshot delta disk into the root disk
+            vm.remove_snapshot(vm.get_named_snapshot(
+                self._baseline_snapshot_name))
+        return True
+
+    def _get_disk_stamp(self, path):
+        st = os.stat(path)
+        return (st.st_mtime, st.st_size)
+
+    def is_promoted(self, instance_name):
+        vmx_path = self._pathutils.get_vmx_path(instance_name)
+        if not self._pathutils.exists(vmx_path):
+            return False
+        return vmx.load_cached(vmx_path).get(PROMOTED_VMX_KEY) == 'TRUE'
+
+    def promote(self, instance_name):
+        """Replaces the root disk of a linked clone with a standalone copy,
+        returning False if the instance is running or changed during the
+        copy.
+        """
+        vmx_path = self._pathutils.get_vmx_path(instance_name)
+        root_vmdk_path = self._pathutils.get_root_vmdk_path(instance_name)
+
+        if not self._is_stopped(vmx_path):
+            return False
+
+        # With snapshots the root disk is the parent of the current disk,
+        # which would not match the new disk
+        vmx_file = vmx.VmxFile.load(vmx_path)
+        if (vmx_file.get('scsi0:0.fileName') !=
+                os.path.basename(root_vmdk_path)):
+            if not self._remove_baseline_snapshot(vmx_path):
+                LOG.debug(_("Instance %s has snapshots, not promoting its "
+                            "linked clone") % instance_name)
+                return False
+            # Later rebuilds destroy and spawn the instance
+            LOG.info(_("Removed the baseline snapshot of instance %s") %
+                     instance_name)
+            vmx_file = vmx.VmxFile.load(vmx_path)
+
+        LOG.info(_("Promoting the linked clone of instance %s to a full "
+                   "clone") % instance_name)
+        full_vmdk_path = root_vmdk_path.rsplit('.', 1)[0] + _FULL_DISK_SUFFIX
+        linked_vmdk_path = root_vmdk_path + _LINKED_DISK_SUFFIX
+        disk_stamp = self._get_disk_stamp(root_vmdk_path)
+        try:
+            if self._pathutils.exists(full_vmdk_path):
+                self._pathutils.remove(full_vmdk_path)
+            self._disk_manager.consolidate_disk(root_vmdk_path,
+                                                full_vmdk_path)
+
+            # The instance might have been started during the copy
+            if (self._get_disk_stamp(root_vmdk_path) != disk_stamp or
+                    not self._is_stopped(vmx_path)):
+                LOG.info(_("Instance %s changed while being promoted, "
+                           "retrying later") % instance_name)
+                return False
+
+            self._pathutils.rename(root_vmdk_path, linked_vmdk_path)
+            try:
+                self._pathutils.rename(full_vmdk_path, root_vmdk_path)
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    self._pathutils.rename(linked_vmdk_path, root_vmdk_path)
+            self._conn.invalidate_vm(vmx_path)
+
+            vmx_file.set(PROMOTED_VMX_KEY, 'TRUE')
+            vmx_file.save()
+            vmx.invalidate(vmx_path)
+            self._pathutils.remove(linked_vmdk_path)
+        finally:
+            if self._pathutils.exists(full_vmdk_path):
+                self._pathutils.remove(full_vmdk_path)
+        return True
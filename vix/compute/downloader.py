@@ -0,0 +1,222 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Segmented and resumable HTTP downloads.
+"""
+import httplib
+import os
+import re
+import threading
+import urlparse
+
+from eventlet import greenpool
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import jsonutils
+from nova.openstack.common import log as logging
+
+from vix import utils
+
+LOG = logging.getLogger(__name__)
+
+PROGRESS_EXTENSION = '.progress'
+
+_CONTENT_RANGE_REGEX = re.compile(r'^bytes\s+(\d+)-(\d+)/(\d+)$')
+
+
+class SegmentedDownloader(object):
+    """Downloads a URL over parallel connections, each fetching a range of
+    segments, when the server supports HTTP Range requests.
+
+    The progress of each segment is saved in a map next to the target file,
+    so an interrupted download is resumed by the next call instead of
+    restarting from zero.
+    """
+    def __init__(self, url, headers=None, max_connections=4,
+                 segment_size=64 * 1024 * 1024, chunk_size=1024 * 1024,
+                 progress_interval=16 * 1024 * 1024, timeout=None):
+        self._url = url
+        self._headers = headers or {}
+        self._max_connections = max_connections
+        self._segment_size = segment_size
+        self._chunk_size = chunk_size
+        self._progress_interval = progress_interval
+        self._timeout = timeout
+        self._lock = threading.Lock()
+
+    def _request(self, headers=None):
+        url = urlparse.urlparse(self._url)
+        if url.scheme == 'https':
+            conn_class = httplib.HTTPSConnection
+        else:
+            conn_class = httplib.HTTPConnection
+        conn = conn_class(url.netloc, timeout=self._timeout)
+
+        request_headers = dict(self._headers)
+        request_headers.update(headers or {})
+        path = url.path
+        if url.query:
+            path += '?' + url.query
+        conn.request('GET', path, headers=request_headers)
+        response = conn.getresponse()
+        if response.status not in [httplib.OK, httplib.PARTIAL_CONTENT]:
+            conn.close()
+            raise IOError(_('HTTP request to %(url)s failed with status '
+                            '%(status)d') % {'url': self._url,
+                                             'status': response.status})
+        return (conn, response)
+
+    def _load_progress(self, progress_path, size, validator):
+        try:
+            with open(progress_path, 'rb') as f:
+                progress = jsonutils.loads(f.read())
+        except (IOError, ValueError):
+            return None
+        if (progress.get('url') != self._url or
+                progress.get('size') != size or
+                progress.get('validator') != validator or
+                progress.get('segment_size') != self._segment_size):
+            return None
+        return progress
+
+    def _save_progress(self, progress_path, progress):
+        with self._lock:
+            utils.write_file_atomic(progress_path, jsonutils.dumps(progress))
+
+    def download(self, path):
+        """Downloads the URL to path, resuming a previous partial download
+        if a matching progress map exists.
+        """
+        (conn, response) = self._request({'Range': 'bytes=0-0'})
+        content_range = response.getheader('content-range', '')
+        m = _CONTENT_RANGE_REGEX.match(content_range)
+        if response.status != httplib.PARTIAL_CONTENT or not m:
+            LOG.debug(_('Range requests are not supported for %s, using a '
+                        'single connection') % self._url)
+            try:
+                self._download_stream(response, path)
+            finally:
+                conn.close()
+            return
+        conn.close()
+
+        size = int(m.group(3))
+        # Partial files of a different version of the content are discarded
+        validator = (response.getheader('etag') or
+                     response.getheader('last-modified'))
+        progress_path = path + PROGRESS_EXTENSION
+
+        progress = None
+        if os.path.exists(path):
+            progress = self._load_progress(progress_path, size, validator)
+        if progress:
+            LOG.info(_('Resuming the download of %(url)s, %(done)d of '
+                       '%(size)d bytes already downloaded') %
+                     {'url': self._url, 'done': sum(progress['segments']),
+                      'size': size})
+        else:
+            num_segments = max(1, (size + self._segment_size - 1) //
+                               self._segment_size)
+            progress = {'url': self._url,
+                        'size': size,
+                        'validator': validator,
+                        'segment_size': self._segment_size,
+                        'segments': [0] * num_segments}
+            with open(path, 'wb') as f:
+                f.truncate(size)
+            self._save_progress(progress_path, progress)
+
+        pending_segments = [i for i in range(len(progress['segments']))
+                            if progress['segments'][i] <
+                            self._get_segment_length(i, size)]
+
+        pool = greenpool.GreenPool(self._max_connections)
+        results = pool.imap(
+            lambda i: self._download_segment_safe(path, progress_path,
+                                                  progress, i, size),
+            pending_segments)
+        errors = [ex for ex in results if ex]
+
+        self._save_progress(progress_path, progress)
+        if errors:
+            raise errors[0]
+        os.remove(progress_path)
+
+    def _get_segment_length(self, index, size):
+        return min(self._segment_size, size - index * self._segment_size)
+
+    def _sync(self, f):
+        f.flush()
+        os.fsync(f.fileno())
+
+    def _download_stream(self, response, path):
+        with open(path, 'wb') as f:
+            while True:
+                chunk = response.read(self._chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+
+    def _download_segment_safe(self, path, progress_path, progress, index,
+                               size):
+        # Lets the other segments complete, saving their progress
+        try:
+            self._download_segment(path, progress_path, progress, index, size)
+        except Exception as ex:
+            LOG.warn(_('Download of segment %(index)d of %(url)s failed: '
+                       '%(ex)s') % {'index': index, 'url': self._url,
+                                    'ex': ex})
+            return ex
+
+    def _download_segment(self, path, progress_path, progress, index, size):
+        segments = progress['segments']
+        start = index * self._segment_size + segments[index]
+        end = index * self._segment_size + self._get_segment_length(index,
+                                                                    size) - 1
+
+        (conn, response) = self._request({'Range': 'bytes=%d-%d' %
+                                          (start, end)})
+        try:
+            if response.status != httplib.PARTIAL_CONTENT:
+                raise IOError(_('Range request to %s not honored') %
+                              self._url)
+
+            with open(path, 'r+b') as f:
+                f.seek(start)
+                unsaved = 0
+                try:
+                    while start <= end:
+                        chunk = response.read(min(self._chunk_size,
+                                                  end - start + 1))
+                        if not chunk:
+                            raise IOError(_('Connection closed while '
+                                            'downloading %s') % self._url)
+                        f.write(chunk)
+                        start += len(chunk)
+                        unsaved += len(chunk)
+
+                        if unsaved >= self._progress_interval:
+                            self._sync(f)
+                            segments[index] += unsaved
+                            unsaved = 0
+                            self._save_progress(progress_path, progress)
+                finally:
+                    # The data must be on disk before being recorded,
+                    # including when the download is interrupted
+                    self._sync(f)
+                    segments[index] += unsaved
+        finally:
+            conn.close()
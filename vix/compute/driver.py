@@ -17,25 +17,35 @@
 """
 A VIX Nova Compute driver.
 """
+import collections
+import fnmatch
 import os
 import platform
 
+from eventlet import greenpool
+from eventlet import tpool
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import excutils
 from nova.openstack.common import jsonutils
 from nova.openstack.common import log as logging
 from nova.compute import power_state
 from nova.compute import task_states
+from nova import context as nova_context
 from nova import exception
 from nova import utils as nova_utils
 from nova.virt import driver
 from oslo.config import cfg
 
+from vix.compute import clone_pool
+from vix.compute import clone_promoter
 from vix.compute import image_cache
 from vix.compute import pathutils
+from vix import copyutils
+from vix import disk_manager
 from vix import utils
 from vix import vixlib
 from vix import vixutils
+from vix import vmx
 
 LOG = logging.getLogger(__name__)
 
@@ -49,6 +59,61 @@ vix_opts = [
                 help='The default guest os to be set in the instance vmx '
                      'file if not specified by the image "vix_guestos" '
                      'property'),
+    cfg.IntOpt('job_threads',
+               default=20,
+               help='Size of the native thread pool used to wait for Vix '
+                    'jobs, allowing operations on different instances to '
+                    'run concurrently'),
+    cfg.StrOpt('library_path',
+               default=None,
+               help='Path of the Vix shared library. The platform specific '
+                    'default location is used if not set'),
+    cfg.IntOpt('vm_cache_size',
+               default=64,
+               help='Maximum number of open virtual machine handles kept '
+                    'by the driver to avoid reopening the instances on '
+                    'each operation. 0 disables the cache'),
+    cfg.IntOpt('image_fetch_workers',
+               default=4,
+               help='Maximum number of images fetched concurrently when '
+                    'spawning or prewarming the image cache'),
+    cfg.ListOpt('prewarm_images',
+                default=[],
+                help='Ids or name patterns (e.g. "centos-*") of the Glance '
+                     'images fetched in the cache when the service starts'),
+    cfg.IntOpt('prewarm_most_used_images',
+               default=0,
+               help='Number of the most used images, ranked by the recent '
+                    'spawns on this host, fetched in the cache when the '
+                    'service starts'),
+    cfg.IntOpt('clone_pool_size',
+               default=0,
+               help='Number of powered off linked clones kept ready for '
+                    'each prewarmed CoW image and refilled in the '
+                    'background. 0 disables the pool'),
+    cfg.IntOpt('boot_template_timeout',
+               default=600,
+               help='Number of seconds to wait for the VMware Tools in the '
+                    'guest when booting the template VM of an image with '
+                    'the "vix_instant_boot" property'),
+    cfg.BoolOpt('spawn_baseline_snapshot',
+                default=False,
+                help='Takes a snapshot of the instances after the disk '
+                     'provisioning, used by rebuild to reset them to their '
+                     'initial state instead of spawning them again'),
+    cfg.IntOpt('linked_clone_promotion_age',
+               default=0,
+               help='Number of seconds after which the powered off or '
+                    'suspended linked clone instances are converted to '
+                    'full clones in the background, removing their '
+                    'dependency on the cached image. 0 disables the age '
+                    'based promotion'),
+    cfg.IntOpt('linked_clone_promotion_disk_size_mb',
+               default=0,
+               help='Size in MB of the linked clone root disk, holding the '
+                    'data written by the instance, above which a powered '
+                    'off or suspended instance is converted to a full '
+                    'clone. 0 disables the size based promotion'),
 ]
 
 CONF = cfg.CONF
@@ -56,8 +121,25 @@ CONF.register_opts(vix_opts, 'vix')
 CONF.import_opt('use_cow_images', 'nova.virt.driver')
 CONF.import_opt('vnc_enabled', 'nova.vnc')
 
+# Name of the snapshot of the base VMs the linked clones are created from
+BASE_VM_SNAPSHOT_NAME = "nova-clone-source"
+
+# Name of the snapshot, including the memory state, taken on the booted
+# template VMs of the instant boot images
+INSTANT_BOOT_SNAPSHOT_NAME = "nova-instant-boot"
+
+# Name of the snapshot taken by spawn before the first power on, its
+# description is the id of the image of the instance
+BASELINE_SNAPSHOT_NAME = "nova-baseline"
+
 
 class VixDriver(driver.ComputeDriver):
+    # Without has_imagecache Nova never calls manage_image_cache
+    capabilities = {
+        "has_imagecache": True,
+        "supports_recreate": False,
+    }
+
     _power_state_map = {
         vixlib.VIX_POWERSTATE_POWERED_ON: power_state.RUNNING,
         vixlib.VIX_POWERSTATE_POWERING_ON: power_state.RUNNING,
@@ -68,14 +150,86 @@ class VixDriver(driver.ComputeDriver):
 
     def __init__(self, virtapi):
         super(VixDriver, self).__init__(virtapi)
-        self._conn = vixutils.VixConnection()
+        tpool.set_num_threads(CONF.vix.job_threads)
+        if CONF.vix.library_path:
+            vixlib.set_library_path(CONF.vix.library_path)
+        self._conn = vixutils.VixConnection(CONF.vix.vm_cache_size)
         self._conn.connect()
         self._image_cache = image_cache.ImageCache()
         self._pathutils = pathutils.PathUtils()
+        self._disk_manager = disk_manager.DiskManager()
+        self._clone_pool = clone_pool.ClonePool(self._pathutils,
+                                                self._clone_vmdk_vm,
+                                                CONF.vix.clone_pool_size)
+        self._clone_promoter = clone_promoter.ClonePromoter(
+            self._pathutils, self._conn, CONF.vix.linked_clone_promotion_age,
+            CONF.vix.linked_clone_promotion_disk_size_mb,
+            BASELINE_SNAPSHOT_NAME)
+        # Base VMs known to have their clone source snapshot
+        self._base_vmx_paths = set()
         self._stats = None
 
     def init_host(self, host):
-        pass
+        if CONF.vix.prewarm_images or CONF.vix.prewarm_most_used_images:
+            nova_utils.spawn_n(self._prewarm_image_cache,
+                               nova_context.get_admin_context())
+        else:
+            self._clone_pool.remove_unused()
+
+    def _get_prewarm_image_ids(self, context):
+        image_ids = []
+        if CONF.vix.prewarm_most_used_images > 0:
+            image_ids += self._image_cache.get_most_used_images(
+                CONF.vix.prewarm_most_used_images)
+
+        patterns = CONF.vix.prewarm_images
+        if patterns:
+            try:
+                images = self._image_cache.list_images(context)
+            except Exception:
+                LOG.exception(_("Unable to list the Glance images"))
+                images = []
+
+            for pattern in patterns:
+                matches = [image['id'] for image in images
+                           if image['id'] == pattern or
+                           fnmatch.fnmatch(image.get('name') or '', pattern)]
+                if not matches and not images:
+                    # Assume an image id if the images could not be listed
+                    matches = [pattern]
+                image_ids += matches
+
+        return list(collections.OrderedDict.fromkeys(image_ids))
+
+    def _prewarm_image(self, context, image_id):
+        try:
+            image_info = self._image_cache.get_image_info(context, image_id)
+            properties = image_info.get("properties", {})
+            if image_info.get("disk_format") not in ["vmdk", "qcow2", "raw"]:
+                self._image_cache.get_cached_image(context, image_id, None,
+                                                   None)
+                return
+
+            cow = (self._is_cow_image(properties) and
+                   vixutils.get_vix_host_type() != vixutils.VIX_VMWARE_PLAYER)
+            image_path = self._cache_root_image(context, image_id, None, None,
+                                                properties, cow)
+            if cow:
+                self._clone_pool.add_image(image_path,
+                                           properties.get("vix_guestos"))
+        except Exception:
+            LOG.exception(_("Prewarming the cache for image %s failed") %
+                          image_id)
+
+    def _prewarm_image_cache(self, context):
+        image_ids = self._get_prewarm_image_ids(context)
+        LOG.info(_("Prewarming the image cache: %s") % ", ".join(image_ids))
+
+        pool = greenpool.GreenPool(CONF.vix.image_fetch_workers)
+        for image_id in image_ids:
+            pool.spawn_n(self._prewarm_image, context, image_id)
+        pool.waitall()
+        self._clone_pool.remove_unused()
 
     def list_instances(self):
         return self._conn.list_running_vms()
@@ -85,40 +239,206 @@ class VixDriver(driver.ComputeDriver):
         if self._conn.vm_exists(vmx_path):
             self._conn.unregister_vm_and_delete_files(vmx_path, destroy_disks)
 
-    def _clone_vmdk_vm(self, src_vmdk, root_vmdk_path, dest_vmx_path):
+    def _delete_existing_instances(self, instance_names, destroy_disks=True):
+        vmx_paths = [self._pathutils.get_vmx_path(instance_name)
+                     for instance_name in instance_names]
+        vmx_paths = [vmx_path for vmx_path in vmx_paths
+                     if self._conn.vm_exists(vmx_path)]
+        if vmx_paths:
+            self._conn.unregister_vms_and_delete_files(vmx_paths,
+                                                       destroy_disks)
+
+    def _get_cached_images(self, context, image_ids, user_id, project_id,
+                           pool=None):
+        """Fetches the given images concurrently, returning their paths in
+        the cache keyed by image id. The fetches run in the given pool,
+        shared with other fetches of the caller.
+        """
+        image_ids = list(collections.OrderedDict.fromkeys(image_ids))
+        if not pool:
+            pool = greenpool.GreenPool(CONF.vix.image_fetch_workers)
+        image_fetches = [pool.spawn(self._image_cache.get_cached_image,
+                                    context, image_id, user_id, project_id)
+                         for image_id in image_ids]
+        return dict(zip(image_ids, [image_fetch.wait()
+                                    for image_fetch in image_fetches]))
+
+    def _cache_root_image(self, context, image_id, user_id, project_id,
+                          properties, cow):
+        """Returns the VMDK version of a cached root image. The base VM of
+        the linked clones of a CoW image is created as soon as its disk is
+        in the cache.
+        """
+        image_path = self._image_cache.get_cached_image(context, image_id,
+                                                        user_id, project_id)
+        vmdk_path = self._image_cache.get_vmdk_image(
+            image_path, properties.get("vix_vmdk_subformat"))
+        if cow:
+            self._create_base_vmx(vmdk_path, properties.get("vix_guestos"))
+        return vmdk_path
+
+    def _create_base_vmx(self, src_vmdk, guest_os=None):
+        """Returns the base VM of the linked clones of a cached disk,
+        creating it with its clone source snapshot if needed. Base VMs
+        already checked are returned without locking.
+        """
         src_vmdk_base_path = os.path.splitext(src_vmdk)[0]
         src_vmx_path = src_vmdk_base_path + ".vmx"
+        if src_vmx_path in self._base_vmx_paths:
+            return src_vmx_path
 
         @nova_utils.synchronized(src_vmx_path)
         def create_base_vmx():
+            if src_vmx_path in self._base_vmx_paths:
+                return
+
             if not self._pathutils.exists(src_vmx_path):
                 display_name = os.path.basename(src_vmdk_base_path)
 
-                self._conn.create_vm(vmx_path=src_vmx_path,
-                                     display_name=display_name,
-                                     guest_os="rhel6-64",
-                                     disk_paths=[src_vmdk])
-        create_base_vmx()
+                self._conn.create_vm(
+                    vmx_path=src_vmx_path,
+                    display_name=display_name,
+                    guest_os=guest_os or CONF.vix.default_guestos,
+                    disk_paths=[src_vmdk])
+
+            with self._conn.open_vm(src_vmx_path) as vm:
+                snapshot = vm.get_named_snapshot(BASE_VM_SNAPSHOT_NAME)
+                if not snapshot:
+                    # Also for the base VMs created before the clone
+                    # source snapshots were introduced
+                    snapshot = vm.create_snapshot(name=BASE_VM_SNAPSHOT_NAME)
+                snapshot.close()
+            self._base_vmx_paths.add(src_vmx_path)
 
-        self._conn.clone_vm(src_vmx_path, dest_vmx_path, True)
+        create_base_vmx()
+        return src_vmx_path
+
+    def _clone_vmdk_vm(self, src_vmdk, root_vmdk_path, dest_vmx_path,
+                       guest_os=None):
+        src_vmx_path = self._create_base_vmx(src_vmdk, guest_os)
+        # Cloning the current state would add a snapshot to the base VM
+        # for each clone
+        self._clone_vm(src_vmx_path, root_vmdk_path, dest_vmx_path,
+                       BASE_VM_SNAPSHOT_NAME)
+
+    def _clone_vm(self, src_vmx_path, root_vmdk_path, dest_vmx_path,
+                  snapshot_name=None):
+        # The clone is configured through its files, the handle is not used
+        with self._conn.clone_vm(src_vmx_path, dest_vmx_path, True,
+                                 snapshot_name):
+            pass
 
         # The cloned VM vmdk name differs from the standard naming
         # (e.g. root.vmdk). Rename the disk and update the
         # configuration files
-        vmdk_filename = vixutils.get_vmx_value(dest_vmx_path,
-                                               "scsi0:0.fileName")
+        vmx_file = vmx.VmxFile.load(dest_vmx_path)
+        vmdk_filename = vmx_file.get("scsi0:0.fileName")
         vm_dir = os.path.dirname(dest_vmx_path)
         vmdk_path = os.path.join(vm_dir, vmdk_filename)
 
         self._pathutils.rename(vmdk_path, root_vmdk_path)
 
         root_vmdk_filename = os.path.basename(root_vmdk_path)
-        vixutils.set_vmx_value(dest_vmx_path, "scsi0:0.fileName",
-                               root_vmdk_filename)
+        vmx_file.set("scsi0:0.fileName", root_vmdk_filename)
+        vmx_file.save()
 
         dest_vmsd_path = os.path.splitext(dest_vmx_path)[0] + ".vmsd"
-        vixutils.set_vmx_value(dest_vmsd_path, "sentinel0",
-                               root_vmdk_filename)
+        vmsd_file = vmx.VmxFile.load(dest_vmsd_path)
+        vmsd_file.set("sentinel0", root_vmdk_filename)
+        vmsd_file.save()
+
+    def _is_cow_image(self, properties):
+        cow_str = properties.get("cow", str(CONF.use_cow_images))
+        return cow_str.lower() in ["true", "1", "yes"]
+
+    def _is_instant_boot_image(self, properties):
+        instant_boot_str = properties.get("vix_instant_boot", "false")
+        return instant_boot_str.lower() in ["true", "1", "yes"]
+
+    def _get_boot_template_vmx(self, base_vmdk_path, num_vcpus, mem_size_mb,
+                               num_nics, vm_config):
+        """Returns the template VM of an instant boot image, created as a
+        linked clone of the base disk, booted once and snapshotted
+        including the memory state.
+
+        A suspended guest can only be resumed on the same virtual hardware,
+        so a template is created for each number of vcpus, memory size and
+        number of nics. vm_config contains the additional update_vm
+        arguments of the template.
+        """
+        template_path = "%s-boot-%dcpu-%dmb-%dnic" % (
+            base_vmdk_path.rsplit(".", 1)[0], num_vcpus, mem_size_mb,
+            num_nics)
+        template_vmx_path = template_path + ".vmx"
+
+        @nova_utils.synchronized(template_vmx_path)
+        def create_boot_template():
+            if self._conn.vm_exists(template_vmx_path):
+                with self._conn.open_vm(template_vmx_path) as vm:
+                    snapshot = vm.get_named_snapshot(
+                        INSTANT_BOOT_SNAPSHOT_NAME)
+                if snapshot:
+                    snapshot.close()
+                    return
+                # Leftover of an interrupted template creation
+                self._delete_boot_template(template_path)
+
+            LOG.info(_("Creating the instant boot template VM %s") %
+                     template_vmx_path)
+            try:
+                self._clone_vmdk_vm(base_vmdk_path, template_path + ".vmdk",
+                                    template_vmx_path,
+                                    vm_config.get("guest_os"))
+                additional_config = {
+                    # The template files are kept in the image cache
+                    # directory, prefixed by the image name
+                    "log.fileName": os.path.basename(template_path) + ".log"}
+                self._conn.update_vm(
+                    vmx_path=template_vmx_path,
+                    display_name=os.path.basename(template_path),
+                    num_vcpus=num_vcpus,
+                    mem_size_mb=mem_size_mb,
+                    networks=[(vixutils.NETWORK_NAT, None)] * num_nics,
+                    additional_config=additional_config,
+                    **vm_config)
+
+                with self._conn.open_vm(template_vmx_path) as vm:
+                    vm.power_on(False)
+                    vm.wait_for_tools_in_guest(
+                        CONF.vix.boot_template_timeout)
+                    vm.create_snapshot(
+                        include_memory=True,
+                        name=INSTANT_BOOT_SNAPSHOT_NAME).close()
+                    vm.power_off()
+            except Exception:
+                with excutils.save_and_reraise_exception():
+                    if self._conn.vm_exists(template_vmx_path):
+                        self._delete_boot_template(template_path)
+
+        create_boot_template()
+        return template_vmx_path
+
+    def _delete_boot_template(self, template_path):
+        template_vmx_path = template_path + ".vmx"
+        with self._conn.open_vm(template_vmx_path) as vm:
+            if vm.get_power_state() != vixlib.VIX_POWERSTATE_POWERED_OFF:
+                vm.power_off()
+        self._conn.invalidate_vm(template_vmx_path)
+        vmx.invalidate(template_vmx_path)
+
+        # The template shares the directory with the cached images, only
+        # its own files are removed, e.g. "<template>-Snapshot1.vmsn"
+        base_dir = os.path.dirname(template_path)
+        template_name = os.path.basename(template_path)
+        for file_name in self._pathutils.listdir(base_dir):
+            if (file_name.startswith(template_name) and
+                    file_name[len(template_name):len(template_name) + 1] in
+                    [".", "-"]):
+                path = os.path.join(base_dir, file_name)
+                if os.path.isdir(path):
+                    self._pathutils.rmtree(path)
+                else:
+                    self._pathutils.remove(path)
 
     def _check_player_compatibility(self, cow):
         if vixutils.get_vix_host_type() == vixutils.VIX_VMWARE_PLAYER:
@@ -136,7 +456,7 @@ class VixDriver(driver.ComputeDriver):
         instance_name = instance['name']
         root_image_id = instance['image_ref']
 
-        image_info = self._image_cache.get_image_info(
+        image_info = self._image_cache.get_cached_image_info(
             context, root_image_id)
         properties = image_info.get("properties", {})
 
@@ -147,8 +467,8 @@ class VixDriver(driver.ComputeDriver):
         tools_iso = properties.get("vix_tools_iso")
         boot_order = properties.get("vix_boot_order", "hdd,cdrom,floppy")
 
-        cow_str = properties.get("cow", str(CONF.use_cow_images))
-        cow = cow_str.lower() in ["true", "1", "yes"]
+        cow = self._is_cow_image(properties)
+        instant_boot = cow and self._is_instant_boot_image(properties)
 
         LOG.info(_("CoW image: %s" % cow))
 
@@ -162,27 +482,40 @@ class VixDriver(driver.ComputeDriver):
             user_id = instance['user_id']
             project_id = instance['project_id']
 
-            base_vmdk_path = self._image_cache.get_cached_image(context,
-                                                                root_image_id,
-                                                                user_id,
-                                                                project_id)
+            # The root image is prepared while the other images are fetched,
+            # within the same limit of concurrent fetches
+            pool = greenpool.GreenPool(CONF.vix.image_fetch_workers)
+            root_image_fetch = pool.spawn(
+                self._cache_root_image, context, root_image_id, user_id,
+                project_id, properties, cow)
+            image_ids = [image_id for image_id in iso_image_ids if image_id]
+            if floppy_image_id:
+                image_ids.append(floppy_image_id)
+            try:
+                image_paths = self._get_cached_images(context, image_ids,
+                                                      user_id, project_id,
+                                                      pool)
+            finally:
+                # On failure the instance is deleted only after the pending
+                # fetches complete
+                pool.waitall()
+            base_vmdk_path = root_image_fetch.wait()
+
             root_vmdk_path = self._pathutils.get_root_vmdk_path(instance_name)
 
             vmx_path = self._pathutils.get_vmx_path(instance_name)
 
-            if cow:
-                self._clone_vmdk_vm(base_vmdk_path, root_vmdk_path, vmx_path)
-            else:
+            if cow and not instant_boot:
+                if not self._clone_pool.claim(base_vmdk_path, instance_name):
+                    self._clone_vmdk_vm(base_vmdk_path, root_vmdk_path,
+                                        vmx_path, guest_os)
+            elif not cow:
                 self._pathutils.copy(base_vmdk_path, root_vmdk_path)
 
             iso_paths = []
             for image_id in iso_image_ids:
                 if image_id:
-                    iso_path = self._image_cache.get_cached_image(context,
-                                                                  image_id,
-                                                                  user_id,
-                                                                  project_id)
-                    iso_paths.append(iso_path)
+                    iso_paths.append(image_paths[image_id])
 
             if tools_iso:
                 tools_iso_path = os.path.join(self._conn.get_tools_iso_path(),
@@ -195,11 +528,11 @@ class VixDriver(driver.ComputeDriver):
                 iso_paths.append("")
 
             if floppy_image_id:
-                floppy_image_path = self._image_cache.get_cached_image(
-                    context, floppy_image_id, user_id, project_id)
+                floppy_image_path = image_paths[floppy_image_id]
                 floppy_path = self._pathutils.get_floppy_path(instance_name)
                 self._pathutils.copy(floppy_image_path, floppy_path)
             else:
+                floppy_image_path = None
                 floppy_path = None
 
             if CONF.vnc_enabled:
@@ -216,6 +549,19 @@ class VixDriver(driver.ComputeDriver):
                 networks.append((vixutils.NETWORK_NAT,
                                  vif['address']))
 
+            if instant_boot:
+                # The instance resumes the guest booted in the template
+                template_vmx_path = self._get_boot_template_vmx(
+                    base_vmdk_path, instance['vcpus'], instance['memory_mb'],
+                    len(networks),
+                    {'guest_os': guest_os,
+                     'iso_paths': iso_paths,
+                     'floppy_path': floppy_image_path,
+                     'boot_order': boot_order,
+                     'nested_hypervisor': nested_hypervisor})
+                self._clone_vm(template_vmx_path, root_vmdk_path, vmx_path,
+                               INSTANT_BOOT_SNAPSHOT_NAME)
+
             if cow:
                 self._conn.update_vm(vmx_path=vmx_path,
                                      display_name=display_name,
@@ -246,11 +592,68 @@ class VixDriver(driver.ComputeDriver):
                                      nested_hypervisor=nested_hypervisor)
 
             with self._conn.open_vm(vmx_path) as vm:
+                if (CONF.vix.spawn_baseline_snapshot and
+                        vixutils.get_vix_host_type() !=
+                        vixutils.VIX_VMWARE_PLAYER):
+                    vm.create_snapshot(name=BASELINE_SNAPSHOT_NAME,
+                                       description=root_image_id).close()
                 vm.power_on(CONF.vix.show_gui)
+
+            # Failed spawns must not keep the image in use
+            self._image_cache.add_image_instance(root_image_id, instance_name)
         except Exception:
             with excutils.save_and_reraise_exception():
                 self._delete_existing_instance(instance_name)
 
+    def _find_snapshot_info(self, snapshot_tree, name):
+        for snapshot_info in snapshot_tree:
+            if snapshot_info.name == name:
+                return snapshot_info
+            child_info = self._find_snapshot_info(snapshot_info.children,
+                                                  name)
+            if child_info:
+                return child_info
+
+    def rebuild(self, context, instance, image_meta, injected_files,
+                admin_password, bdms, detach_block_devices,
+                attach_block_devices, network_info=None,
+                recreate=False, block_device_info=None):
+        """Reverts the instance to the baseline snapshot taken by spawn.
+
+        NotImplementedError lets Nova destroy and spawn the instance when
+        there is no baseline snapshot of the requested image. As in spawn,
+        injected_files and admin_password are ignored.
+        """
+        if recreate:
+            raise NotImplementedError(_("Unsupported feature"))
+
+        instance_name = instance['name']
+        vmx_path = self._pathutils.get_vmx_path(instance_name)
+        if not self._conn.vm_exists(vmx_path):
+            raise exception.InstanceNotFound(instance_id=instance['uuid'])
+
+        with self._conn.open_vm(vmx_path) as vm:
+            baseline_info = self._find_snapshot_info(vm.get_snapshot_tree(),
+                                                     BASELINE_SNAPSHOT_NAME)
+            if (not baseline_info or
+                    baseline_info.description != image_meta.get('id')):
+                raise NotImplementedError(_("No baseline snapshot of the "
+                                            "image found for instance %s") %
+                                          instance_name)
+
+            # Expected by the compute manager once the driver returns, as
+            # set by its default rebuild implementation
+            instance.task_state = task_states.REBUILD_SPAWNING
+            instance.save(expected_task_state=[task_states.REBUILDING])
+
+            LOG.info(_("Reverting instance %s to its baseline snapshot") %
+                     instance_name)
+            with vm.get_named_snapshot(BASELINE_SNAPSHOT_NAME) as snapshot:
+                vm.revert_to_snapshot(snapshot, CONF.vix.show_gui)
+            if vm.get_power_state() & (vixlib.VIX_POWERSTATE_POWERED_OFF |
+                                       vixlib.VIX_POWERSTATE_SUSPENDED):
+                vm.power_on(CONF.vix.show_gui)
+
     def _exec_vm_action(self, instance, action):
         vmx_path = self._pathutils.get_vmx_path(instance['name'])
 
@@ -268,13 +671,59 @@ class VixDriver(driver.ComputeDriver):
     def destroy(self, instance, network_info, block_device_info=None,
                 destroy_disks=True, context=None):
         self._delete_existing_instance(instance['name'], destroy_disks)
+        self._image_cache.remove_image_instance(instance['image_ref'],
+                                                instance['name'])
+
+    def destroy_instances(self, instances, destroy_disks=True):
+        """Destroys multiple instances, powering them off concurrently and
+        unregistering them in a single batch.
+        """
+        self._delete_existing_instances(
+            [instance['name'] for instance in instances], destroy_disks)
+        for instance in instances:
+            self._image_cache.remove_image_instance(instance['image_ref'],
+                                                    instance['name'])
+
+    def manage_image_cache(self, context, all_instances):
+        # Called by the image cache manager periodic task, as the driver
+        # has the image cache capability. The promotion runs in the
+        # background, the images of the promoted instances can be evicted
+        # starting from the next call
+        self._clone_promoter.promote_instances(all_instances)
+        in_use_image_ids = [
+            instance['image_ref'] for instance in all_instances
+            if not self._clone_promoter.is_promoted(instance['name'])]
+
+        def before_remove(path):
+            if path.lower().endswith('.vmx'):
+                self._base_vmx_paths.discard(path)
+                self._conn.invalidate_vm(path)
+                vmx.invalidate(path)
+
+        self._image_cache.evict_unused_images(in_use_image_ids, before_remove)
+        LOG.debug(_("Image cache stats: %s") %
+                  self._image_cache.get_cache_stats())
+        LOG.debug(_("File copy stats: %s") % copyutils.get_copy_stats())
 
     def get_info(self, instance):
-        vm_state = self._exec_vm_action(instance,
-                                        lambda vm: vm.get_power_state())
-        for state in self._power_state_map:
-            if vm_state & state:
-                return {'state': self._power_state_map[state]}
+        props = self._exec_vm_action(
+            instance,
+            lambda vm: vm.get_properties([vixlib.VIX_PROPERTY_VM_POWER_STATE,
+                                          vixlib.VIX_PROPERTY_VM_MEMORY_SIZE,
+                                          vixlib.VIX_PROPERTY_VM_NUM_VCPUS]))
+
+        state = power_state.NOSTATE
+        for vix_state in self._power_state_map:
+            if props.power_state & vix_state:
+                state = self._power_state_map[vix_state]
+                break
+
+        mem_kb = props.mem_size_mb * 1024
+        return {'state': state,
+                'max_mem': mem_kb,
+                'mem': mem_kb,
+                'num_cpu': props.num_vcpus,
+                'cpu_time': 0}
 
     def attach_volume(self, context, connection_info, instance, mountpoint,
                       encryption=None):
@@ -379,19 +828,36 @@ class VixDriver(driver.ComputeDriver):
 
         update_task_state(task_state=task_states.IMAGE_PENDING_UPLOAD)
 
+        root_vmdk_path = self._pathutils.get_root_vmdk_path(instance_name)
+        # After the baseline snapshot taken by spawn, the data written by the
+        # instance is in the delta disks of the current disk
+        current_vmdk_path = os.path.join(
+            os.path.dirname(vmx_path),
+            vmx.VmxFile.load(vmx_path).get("scsi0:0.fileName"))
+        if (os.path.basename(current_vmdk_path) !=
+                os.path.basename(root_vmdk_path)):
+            image_vmdk_path = (os.path.splitext(root_vmdk_path)[0] +
+                               "-snapshot.vmdk")
+        else:
+            image_vmdk_path = root_vmdk_path
+
         with self._conn.open_vm(vmx_path) as vm:
             with vm.create_snapshot(name="Nova snapshot") as snapshot:
                 try:
-                    root_vmdk_path = self._pathutils.get_root_vmdk_path(
-                        instance_name)
+                    if image_vmdk_path != root_vmdk_path:
+                        self._disk_manager.consolidate_disk(current_vmdk_path,
+                                                            image_vmdk_path)
 
                     update_task_state(
                         task_state=task_states.IMAGE_UPLOADING,
                         expected_state=task_states.IMAGE_PENDING_UPLOAD)
 
                     self._image_cache.save_glance_image(context, name,
-                                                        root_vmdk_path)
+                                                        image_vmdk_path)
                 finally:
+                    if (image_vmdk_path != root_vmdk_path and
+                            self._pathutils.exists(image_vmdk_path)):
+                        self._pathutils.remove(image_vmdk_path)
                     vm.remove_snapshot(snapshot)
 
     def pause(self, instance):
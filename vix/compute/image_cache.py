@@ -17,34 +17,164 @@
 """
 Image caching and management.
 """
+import collections
+import hashlib
 import os
+import re
+import tempfile
+import time
 
 from nova.compute import flavors
+from nova import exception
 from nova.image import glance
 from nova.openstack.common import excutils
+from nova.openstack.common import fileutils
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
 from nova import utils
-from nova.virt import images
 from oslo.config import cfg
 
+from vix.compute import downloader
+from vix.compute import image_catalog
 from vix.compute import pathutils
+from vix import disk_manager
+from vix import utils as vix_utils
+from vix import vmx
 
 LOG = logging.getLogger(__name__)
 
+image_cache_opts = [
+    cfg.IntOpt('image_info_cache_ttl',
+               default=300,
+               help='Number of seconds the Glance image metadata is cached. '
+                    '0 disables the cache'),
+    cfg.IntOpt('image_info_negative_cache_ttl',
+               default=30,
+               help='Number of seconds a missing Glance image is cached. '
+                    '0 disables the negative cache'),
+    cfg.IntOpt('image_cache_high_watermark',
+               default=90,
+               help='Disk usage percentage of the instances path above '
+                    'which unused cached images are evicted'),
+    cfg.IntOpt('image_cache_low_watermark',
+               default=80,
+               help='Disk usage percentage to be reached when evicting '
+                    'unused cached images'),
+    cfg.IntOpt('image_cache_min_age',
+               default=3600,
+               help='Minimum number of seconds since their last use before '
+                    'cached images can be evicted'),
+    cfg.IntOpt('image_download_connections',
+               default=1,
+               help='Number of parallel connections used to download each '
+                    'image from Glance with HTTP range requests. Partial '
+                    'downloads are resumed on the next attempt. 1 uses a '
+                    'single stream through the Glance client'),
+    cfg.IntOpt('image_download_segment_size_mb',
+               default=64,
+               help='Size in MB of the image segments downloaded by each '
+                    'connection'),
+    cfg.StrOpt('image_vmdk_subformat',
+               default='monolithicSparse',
+               help='VMDK subformat of the qcow2 and raw images converted '
+                    'in the cache, unless set by the "vix_vmdk_subformat" '
+                    'image property'),
+    cfg.IntOpt('image_usage_window',
+               default=604800,
+               help='Number of seconds the spawns of each image are '
+                    'counted to rank the most used images'),
+]
+
 CONF = cfg.CONF
+CONF.register_opts(image_cache_opts, 'vix')
 CONF.import_opt('use_cow_images', 'nova.virt.driver')
 
+_IMAGE_INFO_CACHE_SIZE = 1024
+
+# Cached in place of the metadata of images not found in Glance
+_IMAGE_NOT_FOUND = object()
+
+# Files of the base VMs created in the cache for linked clones
+_BASE_VM_EXTENSIONS = ['.vmx', '.vmsd', '.vmxf', '.nvram']
+
+# Maximum size of the vmdk headers searched for the parent disk path
+_VMDK_HEADER_SIZE = 65536
+
+_PARENT_FILE_NAME_REGEX = re.compile(r'parentFileNameHint\s*=\s*"([^"]*)"')
+
+# Images downloaded over multiple connections are written to
+# "<image path>.part" until complete
+_PARTIAL_DOWNLOAD_EXTENSION = '.part'
+
+_CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# Disk formats converted to VMDK before being used by the instances
+_CONVERTIBLE_DISK_TYPES = [disk_manager.DISK_TYPE_QCOW2,
+                           disk_manager.DISK_TYPE_RAW]
+
+CachedImage = collections.namedtuple('CachedImage', ['image_id', 'path',
+                                                     'files', 'size',
+                                                     'last_used'])
+
 
 class ImageCache(object):
     def __init__(self):
         self._pathutils = pathutils.PathUtils()
+        # (expiration time, image metadata) tuples, keyed by image id
+        self._image_info_cache = vix_utils.LRUCache(_IMAGE_INFO_CACHE_SIZE)
+        self._catalog = image_catalog.ImageCatalog(self._pathutils)
+        self._usage_log = image_catalog.ImageUsageLog(self._pathutils)
+        self._disk_manager = disk_manager.DiskManager()
 
-    def get_image_info(self, context, image_id):
+    def _get_image_info(self, context, image_id):
         (image_service, image_id) = glance.get_remote_image_service(context,
                                                                     image_id)
         return image_service.show(context, image_id)
 
+    def get_image_info(self, context, image_id):
+        ttl = CONF.vix.image_info_cache_ttl
+        if ttl <= 0:
+            return self._get_image_info(context, image_id)
+
+        cached = self._image_info_cache.get(image_id)
+        if cached and cached[0] > time.time():
+            if cached[1] is _IMAGE_NOT_FOUND:
+                raise exception.ImageNotFound(image_id=image_id)
+            return cached[1]
+
+        try:
+            image_info = self._get_image_info(context, image_id)
+        except exception.ImageNotFound:
+            negative_ttl = CONF.vix.image_info_negative_cache_ttl
+            if negative_ttl > 0:
+                self._image_info_cache.put(
+                    image_id, (time.time() + negative_ttl, _IMAGE_NOT_FOUND))
+            raise
+
+        self._image_info_cache.put(image_id, (time.time() + ttl, image_info))
+        return image_info
+
+    def get_cached_image_info(self, context, image_id):
+        """Returns the image metadata recorded in the catalog when the image
+        is cached, allowing spawns without Glance, otherwise the metadata
+        retrieved from Glance.
+        """
+        entry = self._catalog.get(image_id)
+        if entry and entry.get('image_info'):
+            image_path = self._catalog.get_image_path(image_id)
+            if image_path and self._pathutils.exists(image_path):
+                return entry['image_info']
+        return self.get_image_info(context, image_id)
+
+    def invalidate_image_info(self, image_id=None):
+        """Removes the cached metadata of the given image, or of all the
+        images if image_id is None.
+        """
+        if image_id is None:
+            self._image_info_cache.clear()
+        else:
+            self._image_info_cache.pop(image_id)
+
     def save_glance_image(self, context, name, image_vmdk_path):
         (glance_image_service,
          image_id) = glance.get_remote_image_service(context, name)
@@ -54,26 +184,343 @@ class ImageCache(object):
                           "properties": {}}
         with open(image_vmdk_path, 'rb') as f:
             glance_image_service.update(context, image_id, image_metadata, f)
+        self.invalidate_image_info(name)
 
     def get_cached_image(self, context, image_id, user_id, project_id):
+        # Images already in the catalog are found without Glance calls
+        image_path = self._catalog.get_image_path(image_id)
+        if image_path and self._pathutils.exists(image_path):
+            image_info = None
+        else:
+            image_info = self.get_image_info(context, image_id)
+            disk_format = image_info.get("disk_format")
 
-        image_info = self.get_image_info(context, image_id)
-        disk_format = image_info.get("disk_format")
-
-        base_vmdk_dir = self._pathutils.get_base_vmdk_dir()
-        image_path = os.path.join(base_vmdk_dir, image_id + "." + disk_format)
+            base_vmdk_dir = self._pathutils.get_base_vmdk_dir()
+            image_path = os.path.join(base_vmdk_dir,
+                                      image_id + "." + disk_format)
 
         @utils.synchronized(image_path)
         def fetch_image_if_not_existing():
             if not self._pathutils.exists(image_path):
+                # The image might have been evicted after the catalog lookup
+                fetch_image_info = (image_info or
+                                    self.get_image_info(context, image_id))
+                self._fetch_image(context, image_id, image_path,
+                                  fetch_image_info)
+                self._catalog.record_fetch(image_id, image_path,
+                                           fetch_image_info)
+            elif image_info is not None:
+                # Cached before the catalog was introduced
+                self._catalog.record_fetch(image_id, image_path, image_info)
+
+            self._catalog.record_use(image_id)
+            return image_path
+
+        return fetch_image_if_not_existing()
+
+    def get_vmdk_image(self, image_path, subformat=None):
+        """Returns the VMDK version of a cached disk image. qcow2 and raw
+        images are converted once for each subformat and the converted
+        file is kept in the cache next to the original one.
+        """
+        (base_path, disk_format) = image_path.rsplit('.', 1)
+        disk_format = disk_format.lower()
+        if disk_format not in _CONVERTIBLE_DISK_TYPES:
+            return image_path
+
+        subformat = subformat or CONF.vix.image_vmdk_subformat
+        if subformat not in disk_manager.VMDK_SUBFORMATS:
+            raise vix_utils.VixException(_("Unsupported VMDK subformat: %s")
+                                         % subformat)
+        vmdk_path = "%(base_path)s-%(subformat)s.vmdk" % {
+            'base_path': base_path, 'subformat': subformat}
+
+        @utils.synchronized(vmdk_path)
+        def convert_image_if_not_existing():
+            if not self._pathutils.exists(vmdk_path):
+                LOG.info(_("Converting cached image %(image_path)s to a "
+                           "%(subformat)s VMDK") %
+                         {'image_path': image_path, 'subformat': subformat})
+                tmp_path = vmdk_path + '.tmp'
                 try:
-                    images.fetch(context, image_id, image_path,
-                                 user_id, project_id)
+                    self._disk_manager.convert_disk(
+                        image_path, tmp_path, disk_format,
+                        disk_manager.DISK_TYPE_VMDK, subformat)
+                    self._pathutils.rename(tmp_path, vmdk_path)
                 except Exception:
                     with excutils.save_and_reraise_exception():
-                        if self._pathutils.exists(image_path):
-                            self._pathutils.remove(image_path)
+                        if self._pathutils.exists(tmp_path):
+                            self._pathutils.remove(tmp_path)
+            return vmdk_path
 
-            return image_path
+        return convert_image_if_not_existing()
 
-        return fetch_image_if_not_existing()
+    def _fetch_image(self, context, image_id, image_path, image_info):
+        """Downloads the image to a temporary file in the cache, verifying
+        the Glance checksum, and renames it to image_path only on success.
+        """
+        fileutils.ensure_tree(os.path.dirname(image_path))
+
+        # Image hrefs can point to any Glance server, only the configured
+        # ones are used for segmented downloads
+        if CONF.vix.image_download_connections > 1 and '/' not in image_id:
+            self._fetch_image_segmented(context, image_id, image_path,
+                                        image_info)
+        else:
+            self._fetch_image_stream(context, image_id, image_path,
+                                     image_info)
+
+    def _check_image_checksum(self, image_id, image_info, md5):
+        checksum = image_info.get('checksum')
+        if checksum and md5.hexdigest() != checksum:
+            raise exception.ImageUnacceptable(
+                image_id=image_id,
+                reason=_("Checksum mismatch: expected %(expected)s, got "
+                         "%(actual)s") % {'expected': checksum,
+                                          'actual': md5.hexdigest()})
+        if not checksum:
+            LOG.warn(_("Glance image %s has no checksum, it cannot be "
+                       "verified") % image_id)
+
+    def _fetch_image_stream(self, context, image_id, image_path, image_info):
+        (image_service, image_id) = glance.get_remote_image_service(context,
+                                                                    image_id)
+        (fd, tmp_path) = tempfile.mkstemp(
+            dir=os.path.dirname(image_path),
+            prefix=os.path.basename(image_path) + '.', suffix='.tmp')
+        try:
+            md5 = hashlib.md5()
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in image_service.download(context, image_id):
+                    md5.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._check_image_checksum(image_id, image_info, md5)
+
+            # mkstemp creates files readable only by the owner
+            os.chmod(tmp_path, 0o644)
+            self._pathutils.rename(tmp_path, image_path)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                if self._pathutils.exists(tmp_path):
+                    self._pathutils.remove(tmp_path)
+
+    def _get_image_download_url(self, image_id):
+        (host, port, use_ssl) = glance.get_api_servers().next()
+        scheme = 'https' if use_ssl else 'http'
+        return '%(scheme)s://%(host)s:%(port)s/v1/images/%(image_id)s' % {
+            'scheme': scheme, 'host': host, 'port': port,
+            'image_id': image_id}
+
+    def _fetch_image_segmented(self, context, image_id, image_path,
+                               image_info):
+        """Downloads the image over parallel connections to a partial file
+        kept on failure, so the next attempt resumes the download.
+        """
+        part_path = image_path + _PARTIAL_DOWNLOAD_EXTENSION
+        progress_path = part_path + downloader.PROGRESS_EXTENSION
+
+        image_downloader = downloader.SegmentedDownloader(
+            self._get_image_download_url(image_id),
+            headers={'X-Auth-Token': context.auth_token},
+            max_connections=CONF.vix.image_download_connections,
+            segment_size=CONF.vix.image_download_segment_size_mb * 1024 * 1024)
+        image_downloader.download(part_path)
+
+        # The segments are written out of order and possibly across
+        # attempts, so the checksum needs a separate read pass
+        md5 = hashlib.md5()
+        with open(part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(_CHECKSUM_CHUNK_SIZE), ''):
+                md5.update(chunk)
+        try:
+            self._check_image_checksum(image_id, image_info, md5)
+        except exception.ImageUnacceptable:
+            with excutils.save_and_reraise_exception():
+                for path in [part_path, progress_path]:
+                    if self._pathutils.exists(path):
+                        self._pathutils.remove(path)
+
+        os.chmod(part_path, 0o644)
+        self._pathutils.rename(part_path, image_path)
+
+    def add_image_instance(self, image_id, instance_name):
+        self._catalog.add_instance(image_id, instance_name)
+        self._usage_log.record(image_id, CONF.vix.image_usage_window)
+
+    def get_most_used_images(self, count):
+        return self._usage_log.get_most_used(count,
+                                             CONF.vix.image_usage_window)
+
+    def list_images(self, context):
+        image_service = glance.get_default_image_service()
+        return image_service.detail(context)
+
+    def remove_image_instance(self, image_id, instance_name):
+        self._catalog.remove_instance(image_id, instance_name)
+
+    def get_cache_stats(self):
+        return self._catalog.get_stats()
+
+    def get_cached_images_info(self):
+        """Returns the images in the cache, including the files of the base
+        VMs created for linked clones.
+        """
+        base_dir = self._pathutils.get_base_vmdk_dir()
+        if not self._pathutils.exists(base_dir):
+            return []
+
+        file_names = self._pathutils.listdir(base_dir)
+        # Image ids are the shortest prefixes of the file names followed by
+        # a dot or dash, e.g. "<id>.vmdk", "<id>.vmx" and "<id>-000001.vmdk"
+        stems = sorted(set([f.split('.')[0] for f in file_names]), key=len)
+        image_files = collections.defaultdict(list)
+        for file_name in file_names:
+            for stem in stems:
+                if (file_name.startswith(stem) and
+                        file_name[len(stem):len(stem) + 1] in ['.', '-']):
+                    image_files[stem].append(file_name)
+                    break
+
+        cached_images = []
+        for (image_id, file_names) in image_files.items():
+            file_names = sorted(file_names)
+            paths = [os.path.join(base_dir, f) for f in file_names]
+
+            entry = None
+            if image_id + image_catalog.ENTRY_EXTENSION in file_names:
+                entry = self._catalog.get(image_id)
+
+            if entry and entry.get('file_name') in file_names:
+                # Only the files not tracked by the catalog are checked,
+                # e.g. the base VM files
+                image_path = os.path.join(base_dir, entry['file_name'])
+                size = entry['file_size'] + sum(
+                    [os.path.getsize(path) for path in paths
+                     if path != image_path])
+                last_used = entry.get('last_used', entry['fetched_at'])
+            else:
+                stats = [os.stat(path) for path in paths]
+                size = sum([st.st_size for st in stats])
+                last_used = max([max(st.st_atime, st.st_mtime)
+                                 for st in stats])
+
+                image_path = paths[0]
+                for path in paths:
+                    (base, ext) = os.path.splitext(os.path.basename(path))
+                    if (base == image_id and
+                            ext not in _BASE_VM_EXTENSIONS and
+                            ext != image_catalog.ENTRY_EXTENSION):
+                        image_path = path
+                        break
+
+            cached_images.append(CachedImage(image_id, image_path, paths,
+                                             size, last_used))
+        return cached_images
+
+    def _get_referenced_base_files(self):
+        """Returns the names of the files in the cache referenced by the
+        instances or the pooled clones, either as linked clone parent disks
+        or as attached images.
+        """
+        instances_dir = self._pathutils.get_instances_dir()
+        base_dir = self._pathutils.get_base_vmdk_dir()
+        base_dir_norm = os.path.normcase(os.path.abspath(base_dir)) + os.sep
+        pool_dir = self._pathutils.get_clone_pool_dir()
+
+        vm_dirs = []
+        for dir_name in self._pathutils.listdir(instances_dir):
+            vm_dir = os.path.join(instances_dir, dir_name)
+            if (dir_name == os.path.basename(base_dir) or
+                    not os.path.isdir(vm_dir)):
+                continue
+            if dir_name == os.path.basename(pool_dir):
+                # The pooled linked clones, in a directory for each image
+                for pool_name in self._pathutils.listdir(vm_dir):
+                    image_pool_dir = os.path.join(vm_dir, pool_name)
+                    vm_dirs += [os.path.join(image_pool_dir, slot) for slot
+                                in self._pathutils.listdir(image_pool_dir)]
+            else:
+                vm_dirs.append(vm_dir)
+
+        referenced_files = set()
+        for instance_dir in vm_dirs:
+            for file_name in self._pathutils.listdir(instance_dir):
+                path = os.path.join(instance_dir, file_name)
+                ext = os.path.splitext(file_name)[1].lower()
+                if ext == '.vmx':
+                    values = [v for (k, v) in vmx.VmxFile.load(path).items()]
+                elif ext == '.vmdk':
+                    with open(path, 'rb') as f:
+                        values = _PARENT_FILE_NAME_REGEX.findall(
+                            f.read(_VMDK_HEADER_SIZE))
+                else:
+                    continue
+
+                for value in values:
+                    ref_path = os.path.normcase(os.path.abspath(
+                        os.path.join(instance_dir, value)))
+                    if ref_path.startswith(base_dir_norm):
+                        referenced_files.add(os.path.basename(ref_path))
+        return referenced_files
+
+    def evict_unused_images(self, in_use_image_ids=None, before_remove=None):
+        """Removes the least recently used images when the disk usage is
+        above the high watermark, until the low watermark is reached.
+
+        Images referenced by the instances on disk, in in_use_image_ids or
+        used in the last image_cache_min_age seconds are never evicted.
+        before_remove is called with the path of each file to be removed.
+        """
+        base_dir = self._pathutils.get_base_vmdk_dir()
+        if not self._pathutils.exists(base_dir):
+            return []
+
+        (total, free) = vix_utils.get_disk_info(base_dir)
+        used = total - free
+        if used * 100 <= total * CONF.vix.image_cache_high_watermark:
+            return []
+
+        in_use_image_ids = set(in_use_image_ids or [])
+        referenced_files = self._get_referenced_base_files()
+        min_last_used = time.time() - CONF.vix.image_cache_min_age
+
+        candidates = []
+        for cached_image in self.get_cached_images_info():
+            file_names = set([os.path.basename(path)
+                              for path in cached_image.files])
+            # VMware keeps .lck directories for the disks in use
+            if (cached_image.image_id in in_use_image_ids or
+                    file_names.intersection(referenced_files) or
+                    [f for f in file_names if f.endswith('.lck')] or
+                    cached_image.last_used > min_last_used):
+                continue
+            candidates.append(cached_image)
+        candidates.sort(key=lambda cached_image: cached_image.last_used)
+
+        evicted_images = []
+        for cached_image in candidates:
+            if used * 100 <= total * CONF.vix.image_cache_low_watermark:
+                break
+
+            @utils.synchronized(cached_image.path)
+            def remove_image():
+                # The image might have been used after the listing
+                entry = self._catalog.get(cached_image.image_id)
+                if entry and entry.get('last_used', 0) > min_last_used:
+                    return False
+                LOG.info(_("Evicting cached image %(image_id)s, %(size)d "
+                           "bytes") % {'image_id': cached_image.image_id,
+                                       'size': cached_image.size})
+                for path in cached_image.files:
+                    if before_remove:
+                        before_remove(path)
+                    self._pathutils.remove(path)
+                return True
+
+            if remove_image():
+                used -= cached_image.size
+                evicted_images.append(cached_image)
+        return evicted_images
@@ -0,0 +1,200 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Persistent catalog of the images in the local cache.
+"""
+import os
+import time
+
+from nova.openstack.common.gettextutils import _
+from nova.openstack.common import jsonutils
+from nova.openstack.common import log as logging
+from nova import utils
+
+from vix import utils as vix_utils
+
+LOG = logging.getLogger(__name__)
+
+# Each cached image has a "<image id>.info" JSON file in the cache directory
+ENTRY_EXTENSION = '.info'
+
+# Image metadata retrieved from Glance and kept in the catalog
+_IMAGE_INFO_KEYS = ['name', 'disk_format', 'container_format', 'checksum',
+                    'size', 'properties']
+
+
+class ImageCatalog(object):
+    def __init__(self, pathutils):
+        self._pathutils = pathutils
+
+    def _get_entry_path(self, image_id):
+        return os.path.join(self._pathutils.get_base_vmdk_dir(),
+                            image_id + ENTRY_EXTENSION)
+
+    def get(self, image_id):
+        """Returns the catalog entry of the given image, or None."""
+        entry_path = self._get_entry_path(image_id)
+        try:
+            with open(entry_path, 'rb') as f:
+                return jsonutils.loads(f.read())
+        except IOError:
+            return None
+        except ValueError:
+            LOG.warn(_("Ignoring invalid image catalog entry: %s") %
+                     entry_path)
+            return None
+
+    def get_image_path(self, image_id):
+        entry = self.get(image_id)
+        if entry and entry.get('file_name'):
+            return os.path.join(self._pathutils.get_base_vmdk_dir(),
+                                entry['file_name'])
+
+    def update(self, image_id, update_func):
+        """Applies update_func to the entry of the given image, an empty dict
+        if missing, and writes the entry back atomically.
+        """
+        entry_path = self._get_entry_path(image_id)
+
+        @utils.synchronized(entry_path)
+        def update_entry():
+            entry = self.get(image_id) or {'image_id': image_id,
+                                           'use_count': 0,
+                                           'instances': []}
+            update_func(entry)
+            vix_utils.write_file_atomic(entry_path, jsonutils.dumps(entry))
+            return entry
+
+        return update_entry()
+
+    def record_fetch(self, image_id, image_path, image_info):
+        st = os.stat(image_path)
+        image_info = dict([(k, image_info.get(k)) for k in _IMAGE_INFO_KEYS])
+
+        def update_func(entry):
+            entry['file_name'] = os.path.basename(image_path)
+            entry['file_size'] = st.st_size
+            entry['fetched_at'] = st.st_mtime
+            entry['image_info'] = image_info
+        return self.update(image_id, update_func)
+
+    def record_use(self, image_id):
+        def update_func(entry):
+            entry['last_used'] = time.time()
+            entry['use_count'] = entry.get('use_count', 0) + 1
+        return self.update(image_id, update_func)
+
+    def add_instance(self, image_id, instance_name):
+        def update_func(entry):
+            if instance_name not in entry['instances']:
+                entry['instances'].append(instance_name)
+        return self.update(image_id, update_func)
+
+    def remove_instance(self, image_id, instance_name):
+        if not self.get(image_id):
+            return
+
+        def update_func(entry):
+            if instance_name in entry['instances']:
+                entry['instances'].remove(instance_name)
+        return self.update(image_id, update_func)
+
+    def remove(self, image_id):
+        self._pathutils.check_remove(self._get_entry_path(image_id))
+
+    def list(self):
+        base_dir = self._pathutils.get_base_vmdk_dir()
+        if not self._pathutils.exists(base_dir):
+            return []
+
+        entries = []
+        for file_name in self._pathutils.listdir(base_dir):
+            (image_id, ext) = os.path.splitext(file_name)
+            if ext == ENTRY_EXTENSION:
+                entry = self.get(image_id)
+                if entry:
+                    entries.append(entry)
+        return entries
+
+    def get_stats(self):
+        entries = [entry for entry in self.list() if 'file_name' in entry]
+        return {'images': len(entries),
+                'size': sum([entry['file_size'] for entry in entries]),
+                'use_count': sum([entry['use_count'] for entry in entries]),
+                'instances': sum([len(entry['instances'])
+                                  for entry in entries])}
+
+
+class ImageUsageLog(object):
+    """Recent spawn times of each image. Unlike the catalog entries, the log
+    is kept when the images are evicted from the cache.
+    """
+    _FILE_NAME = 'image_usage.json'
+
+    # Maximum number of spawn times kept for each image
+    _MAX_ENTRIES = 1000
+
+    def __init__(self, pathutils):
+        self._pathutils = pathutils
+
+    def _get_path(self):
+        return os.path.join(self._pathutils.get_instances_dir(),
+                            self._FILE_NAME)
+
+    def _load(self):
+        try:
+            with open(self._get_path(), 'rb') as f:
+                return jsonutils.loads(f.read())
+        except IOError:
+            return {}
+        except ValueError:
+            LOG.warn(_("Ignoring invalid image usage log: %s") %
+                     self._get_path())
+            return {}
+
+    def record(self, image_id, max_age):
+        path = self._get_path()
+
+        @utils.synchronized(path)
+        def record_usage():
+            now = time.time()
+            usage = self._load()
+            for (usage_image_id, times) in usage.items():
+                times = [t for t in times if t > now - max_age]
+                if times:
+                    usage[usage_image_id] = times
+                else:
+                    del usage[usage_image_id]
+            times = usage.setdefault(image_id, [])
+            times.append(now)
+            del times[:-self._MAX_ENTRIES]
+            vix_utils.write_file_atomic(path, jsonutils.dumps(usage))
+
+        record_usage()
+
+    def get_most_used(self, count, max_age):
+        """Returns the ids of the images spawned most often in the last
+        max_age seconds.
+        """
+        min_time = time.time() - max_age
+        counts = []
+        for (image_id, times) in self._load().items():
+            recent_count = len([t for t in times if t > min_time])
+            if recent_count:
+                counts.append((recent_count, image_id))
+        counts.sort(reverse=True)
+        return [entry[1] for entry in counts[:count]]
@@ -18,12 +18,16 @@
 import os
 import shutil
 import sys
+import time
 
+from eventlet import tpool
 from nova.openstack.common.gettextutils import _
 from nova.openstack.common import log as logging
 from nova import utils
 from oslo.config import cfg
 
+from vix import copyutils
+
 LOG = logging.getLogger(__name__)
 
 CONF = cfg.CONF
@@ -44,27 +48,46 @@ class PathUtils(object):
         if self.exists(path):
             self.remove(path)
 
+    def listdir(self, path):
+        return os.listdir(path)
+
     def rename(self, src, dest):
         os.rename(src, dest)
 
     def copyfile(self, src, dest):
         self.copy(src, dest)
 
-    def copy(self, src, dest):
-        # With large files this is 2x-3x faster than shutil.copy(src, dest),
-        # especially when copying to a UNC target.
-        # shutil.copyfileobj(...) with a proper buffer is better than
-        # shutil.copy(...) but still 20% slower than a shell copy.
-        # It can be replaced with Win32 API calls to avoid the process
-        # spawning overhead.
+    def copy(self, src, dest, progress_callback=None):
+        """Copies src to dest. progress_callback is called with the bytes
+        processed, the total bytes and the throughput in bytes per second,
+        from a native thread.
+        """
         if sys.platform == "win32":
+            # With large files this is 2x-3x faster than
+            # shutil.copy(src, dest), especially when copying to a UNC
+            # target.
             output, ret = utils.execute('cmd.exe', '/C', 'copy', '/Y',
                                         src, dest)
-        else:
-            output, ret = utils.execute('/bin/cp', '-f', src, dest)
-        if ret:
-            raise IOError(_('The file copy from %(src)s to %(dest)s failed')
-                          % {'src': src, 'dest': dest})
+            if ret:
+                raise IOError(_('The file copy from %(src)s to %(dest)s '
+                                'failed') % {'src': src, 'dest': dest})
+            return
+
+        # The copy blocks in system calls, run it in a native thread
+        start = time.time()
+        try:
+            strategy = tpool.execute(copyutils.copy_file, src, dest,
+                                     progress_callback)
+        except EnvironmentError as ex:
+            raise IOError(_('The file copy from %(src)s to %(dest)s failed: '
+                            '%(ex)s') % {'src': src, 'dest': dest, 'ex': ex})
+        elapsed = time.time() - start
+        LOG.info(_('Copied %(src)s to %(dest)s using %(strategy)s in '
+                   '%(elapsed).2f seconds, %(rate).1f MB/s') %
+                 {'src': src, 'dest': dest, 'strategy': strategy,
+                  'elapsed': elapsed,
+                  'rate': os.path.getsize(dest) / max(elapsed, 1e-6) /
+                  (1024 * 1024)})
 
     def rmtree(self, path):
         shutil.rmtree(path)
@@ -114,3 +137,6 @@ class PathUtils(object):
 
     def get_base_vmdk_dir(self):
         return self._get_instances_sub_dir('_base')
+
+    def get_clone_pool_dir(self):
+        return self._get_instances_sub_dir('_pool')
@@ -0,0 +1,315 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+In-process file copies using the fastest method supported by the source
+and destination filesystems.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import sys
+import time
+
+from eventlet import patcher
+
+if sys.platform != 'win32':
+    import fcntl
+
+STRATEGY_REFLINK = 'reflink'
+STRATEGY_COPY_FILE_RANGE = 'copy_file_range'
+STRATEGY_SENDFILE = 'sendfile'
+STRATEGY_SPARSE_COPY = 'sparse_copy'
+
+# Reflinks and sendfile to regular files are Linux specific
+_LINUX = sys.platform.startswith('linux')
+
+# FICLONE ioctl from linux/fs.h: _IOW(0x94, 9, int)
+_FICLONE = 0x40049409
+
+# lseek whence values from unistd.h, not exposed by the os module
+if _LINUX:
+    (_SEEK_DATA, _SEEK_HOLE) = (3, 4)
+elif sys.platform == 'darwin':
+    (_SEEK_DATA, _SEEK_HOLE) = (4, 3)
+else:
+    (_SEEK_DATA, _SEEK_HOLE) = (None, None)
+
+# Size of the buffers and of the ranges copied in each system call,
+# rounded to a multiple of the filesystem block size
+_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Minimum number of bytes between two progress reports
+_PROGRESS_INTERVAL = 64 * 1024 * 1024
+
+# Errors meaning that a copy method is not available for the given files,
+# e.g. reflinks on filesystems without CoW support or across filesystems
+_UNSUPPORTED_ERRNOS = set([errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS,
+                           errno.ENOTTY, errno.EXDEV, errno.EINVAL])
+
+# (strategy, source device, destination device) tuples of the methods that
+# failed with one of the errors above, not attempted again
+_unsupported = set()
+
+_stats = {}
+# Copies run in native threads, where green locks cannot be used
+_stats_lock = patcher.original('threading').Lock()
+
+_libc_functions = {}
+
+
+def _get_libc_function(name, restype, argtypes):
+    if name not in _libc_functions:
+        func = None
+        lib_name = ctypes.util.find_library('c')
+        if lib_name:
+            func = getattr(ctypes.CDLL(lib_name, use_errno=True), name, None)
+            if func:
+                func.restype = restype
+                func.argtypes = argtypes
+        _libc_functions[name] = func
+    return _libc_functions[name]
+
+
+def _raise_errno():
+    err = ctypes.get_errno()
+    raise OSError(err, os.strerror(err))
+
+
+def _raise_unsupported():
+    raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+
+
+class _Progress(object):
+    """Tracks the bytes processed by a copy, reporting them together with
+    the throughput to an optional callback.
+    """
+    def __init__(self, total, callback):
+        self.total = total
+        self.copied = 0
+        self.skipped = 0
+        self._callback = callback
+        self._start = time.time()
+        self._reported = 0
+        self._finished = False
+
+    def update(self, copied=0, skipped=0):
+        self.copied += copied
+        self.skipped += skipped
+        done = self.copied + self.skipped
+        if not self._callback or self._finished:
+            return
+        if done - self._reported >= _PROGRESS_INTERVAL or done >= self.total:
+            self._reported = done
+            self._finished = done >= self.total
+            self._callback(done, self.total, self.get_bytes_per_second())
+
+    def get_bytes_per_second(self):
+        return self.copied / max(time.time() - self._start, 1e-6)
+
+
+def _get_data_extents(fd, size):
+    """Yields the (offset, length) tuples of the data regions of the file,
+    the whole file if holes cannot be detected.
+    """
+    if _SEEK_DATA is None:
+        yield (0, size)
+        return
+
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, _SEEK_DATA)
+            end = os.lseek(fd, start, _SEEK_HOLE)
+        except OSError as ex:
+            if ex.errno == errno.ENXIO:
+                # No data after offset
+                return
+            if offset == 0 and ex.errno in _UNSUPPORTED_ERRNOS:
+                yield (0, size)
+                return
+            raise
+        end = min(end, size)
+        yield (start, end - start)
+        offset = end
+
+
+def _copy_extents(src_fd, dest_fd, size, progress, copy_range):
+    # The destination gets the source size first, leaving the regions not
+    # written as holes
+    os.ftruncate(dest_fd, size)
+    data_size = 0
+    for (offset, length) in _get_data_extents(src_fd, size):
+        copy_range(src_fd, dest_fd, offset, length, progress)
+        data_size += length
+    progress.update(skipped=size - data_size)
+
+
+def _reflink(src_fd, dest_fd, size, progress, chunk_size):
+    if not _LINUX:
+        _raise_unsupported()
+    fcntl.ioctl(dest_fd, _FICLONE, src_fd)
+    progress.update(copied=size)
+
+
+def _copy_file_range(src_fd, dest_fd, size, progress, chunk_size):
+    func = _get_libc_function('copy_file_range', ctypes.c_ssize_t,
+                              [ctypes.c_int,
+                               ctypes.POINTER(ctypes.c_longlong),
+                               ctypes.c_int,
+                               ctypes.POINTER(ctypes.c_longlong),
+                               ctypes.c_size_t, ctypes.c_uint])
+    if not func:
+        _raise_unsupported()
+
+    def copy_range(src_fd, dest_fd, offset, length, progress):
+        src_offset = ctypes.c_longlong(offset)
+        dest_offset = ctypes.c_longlong(offset)
+        end = offset + length
+        while src_offset.value < end:
+            copied = func(src_fd, ctypes.byref(src_offset), dest_fd,
+                          ctypes.byref(dest_offset),
+                          min(chunk_size, end - src_offset.value), 0)
+            if copied < 0:
+                _raise_errno()
+            if not copied:
+                break
+            progress.update(copied=copied)
+
+    _copy_extents(src_fd, dest_fd, size, progress, copy_range)
+
+
+def _sendfile(src_fd, dest_fd, size, progress, chunk_size):
+    func = _get_libc_function('sendfile', ctypes.c_ssize_t,
+                              [ctypes.c_int, ctypes.c_int,
+                               ctypes.POINTER(ctypes.c_longlong),
+                               ctypes.c_size_t])
+    # Only Linux supports regular files as destination
+    if not func or not _LINUX:
+        _raise_unsupported()
+
+    def copy_range(src_fd, dest_fd, offset, length, progress):
+        # sendfile writes at the current destination offset
+        os.lseek(dest_fd, offset, os.SEEK_SET)
+        src_offset = ctypes.c_longlong(offset)
+        end = offset + length
+        while src_offset.value < end:
+            copied = func(dest_fd, src_fd, ctypes.byref(src_offset),
+                          min(chunk_size, end - src_offset.value))
+            if copied < 0:
+                _raise_errno()
+            if not copied:
+                break
+            progress.update(copied=copied)
+
+    _copy_extents(src_fd, dest_fd, size, progress, copy_range)
+
+
+def _write_all(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+
+def _sparse_copy(src_fd, dest_fd, size, progress, chunk_size):
+    def copy_range(src_fd, dest_fd, offset, length, progress):
+        os.lseek(src_fd, offset, os.SEEK_SET)
+        end = offset + length
+        while offset < end:
+            # Reads after the first one are aligned to the chunk size
+            chunk = os.read(src_fd, min(chunk_size - offset % chunk_size,
+                                        end - offset))
+            if not chunk:
+                break
+            # Blocks of zeros within the data regions are skipped as well
+            if chunk.count('\0') == len(chunk):
+                progress.update(skipped=len(chunk))
+            else:
+                os.lseek(dest_fd, offset, os.SEEK_SET)
+                _write_all(dest_fd, chunk)
+                progress.update(copied=len(chunk))
+            offset += len(chunk)
+
+    _copy_extents(src_fd, dest_fd, size, progress, copy_range)
+
+
+_STRATEGIES = [(STRATEGY_REFLINK, _reflink),
+               (STRATEGY_COPY_FILE_RANGE, _copy_file_range),
+               (STRATEGY_SENDFILE, _sendfile),
+               (STRATEGY_SPARSE_COPY, _sparse_copy)]
+
+
+def _record_copy(strategy, progress, elapsed):
+    with _stats_lock:
+        stats = _stats.setdefault(strategy, {'count': 0, 'bytes': 0,
+                                             'skipped_bytes': 0,
+                                             'seconds': 0.0})
+        stats['count'] += 1
+        stats['bytes'] += progress.copied
+        stats['skipped_bytes'] += progress.skipped
+        stats['seconds'] += elapsed
+
+
+def get_copy_stats():
+    """Returns the number of copies, bytes copied, bytes skipped as holes
+    and seconds spent for each strategy.
+    """
+    with _stats_lock:
+        return dict([(strategy, dict(stats))
+                     for (strategy, stats) in _stats.items()])
+
+
+def copy_file(src, dest, progress_callback=None):
+    """Copies src to dest with a reflink if the filesystem supports it,
+    falling back to copy_file_range, sendfile and to a buffered copy. Holes
+    in the source file are preserved.
+
+    progress_callback is called periodically with the bytes processed, the
+    total bytes and the copy throughput in bytes per second.
+
+    Returns the strategy used.
+    """
+    start = time.time()
+    with open(src, 'rb') as fsrc:
+        with open(dest, 'wb') as fdest:
+            src_fd = fsrc.fileno()
+            dest_fd = fdest.fileno()
+            src_st = os.fstat(src_fd)
+            dest_st = os.fstat(dest_fd)
+            devices = (src_st.st_dev, dest_st.st_dev)
+            block_size = max(getattr(dest_st, 'st_blksize', 0), 512)
+            chunk_size = max(_CHUNK_SIZE // block_size, 1) * block_size
+
+            for (strategy, copy_func) in _STRATEGIES:
+                if (strategy,) + devices in _unsupported:
+                    continue
+                progress = _Progress(src_st.st_size, progress_callback)
+                try:
+                    copy_func(src_fd, dest_fd, src_st.st_size, progress,
+                              chunk_size)
+                    break
+                except EnvironmentError as ex:
+                    if (strategy == STRATEGY_SPARSE_COPY or
+                            ex.errno not in _UNSUPPORTED_ERRNOS or
+                            progress.copied):
+                        raise
+                    _unsupported.add((strategy,) + devices)
+                    os.lseek(src_fd, 0, os.SEEK_SET)
+                    os.lseek(dest_fd, 0, os.SEEK_SET)
+                    os.ftruncate(dest_fd, 0)
+
+    _record_copy(strategy, progress, time.time() - start)
+    return strategy
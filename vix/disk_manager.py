@@ -30,6 +30,26 @@ DISK_TYPE_VHD = "vpc"
 DISK_TYPE_QCOW2 = "qcow2"
 DISK_TYPE_RAW = "raw"
 
+VMDK_SUBFORMAT_MONOLITHIC_SPARSE = "monolithicSparse"
+VMDK_SUBFORMAT_MONOLITHIC_FLAT = "monolithicFlat"
+VMDK_SUBFORMAT_TWO_GB_SPARSE = "twoGbMaxExtentSparse"
+VMDK_SUBFORMAT_TWO_GB_FLAT = "twoGbMaxExtentFlat"
+VMDK_SUBFORMAT_STREAM_OPTIMIZED = "streamOptimized"
+
+VMDK_SUBFORMATS = [VMDK_SUBFORMAT_MONOLITHIC_SPARSE,
+                   VMDK_SUBFORMAT_MONOLITHIC_FLAT,
+                   VMDK_SUBFORMAT_TWO_GB_SPARSE,
+                   VMDK_SUBFORMAT_TWO_GB_FLAT,
+                   VMDK_SUBFORMAT_STREAM_OPTIMIZED]
+
+# Maximum size of the VMDK headers, including the embedded descriptor
+_VMDK_HEADER_SIZE = 65536
+
+_PARENT_FILE_NAME_REGEX = re.compile(r'parentFileNameHint\s*=\s*"([^"]*)"')
+
+# Content id of the disk, not matching the parentCID entry
+_CID_REGEX = re.compile(r'^CID=([0-9a-fA-F]{8})', re.MULTILINE)
+
 
 class DiskManager(object):
     def _get_vdisk_man_path(self):
@@ -123,3 +143,54 @@ class DiskManager(object):
             self._resize_disk_vdisk_man(disk_path, new_size_mb)
         else:
             self._resize_disk_qemu(disk_path, new_size_mb, new_disk_type)
+
+    def convert_disk(self, src_path, dest_path, src_disk_type, dest_disk_type,
+                     subformat=None):
+        args = ["qemu-img", "convert", "-f", src_disk_type, "-O",
+                dest_disk_type]
+        if subformat:
+            args += ["-o", "subformat=%s" % subformat]
+        args += [src_path, dest_path]
+        self._exec_cmd(args)
+
+    def get_parent_disk_path(self, disk_path):
+        """Returns the path of the parent disk of a VMDK delta disk, None
+        for standalone disks.
+        """
+        with open(disk_path, 'rb') as f:
+            m = _PARENT_FILE_NAME_REGEX.search(f.read(_VMDK_HEADER_SIZE))
+        if m:
+            return os.path.join(os.path.dirname(disk_path), m.group(1))
+
+    def _consolidate_disk_vdisk_man(self, src_path, dest_path):
+        vdisk_man_path = self._get_vdisk_man_path()
+
+        args = [vdisk_man_path, "-r", src_path, "-t", "0", dest_path]
+        self._exec_cmd(args)
+
+    def _copy_content_id(self, src_path, dest_path):
+        with open(src_path, 'rb') as f:
+            m = _CID_REGEX.search(f.read(_VMDK_HEADER_SIZE))
+        if not m:
+            return
+
+        with open(dest_path, 'r+b') as f:
+            dest_m = _CID_REGEX.search(f.read(_VMDK_HEADER_SIZE))
+            if dest_m:
+                f.seek(dest_m.start(1))
+                f.write(m.group(1))
+
+    def consolidate_disk(self, src_path, dest_path):
+        """Copies a VMDK delta disk, including the data of its parent disks,
+        to a new standalone monolithic sparse disk.
+
+        The new disk keeps the content id of the source disk, as its data is
+        the same, e.g. for suspended VMs to be resumed.
+        """
+        if self._check_vdisk_man_exists():
+            self._consolidate_disk_vdisk_man(src_path, dest_path)
+        else:
+            self.convert_disk(src_path, dest_path, DISK_TYPE_VMDK,
+                              DISK_TYPE_VMDK,
+                              VMDK_SUBFORMAT_MONOLITHIC_SPARSE)
+        self._copy_content_id(src_path, dest_path)
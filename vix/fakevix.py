@@ -0,0 +1,714 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-process simulator of the subset of the Vix API used by vixutils.
+
+It replaces the Vix shared library to run and benchmark the driver on hosts
+where VMware is not installed:
+
+    from vix import fakevix
+    fakevix.install(fakevix.FakeVixLibrary(
+        latencies={'VixVM_PowerOn': 0.5}))
+"""
+import os
+import re
+import shutil
+
+from eventlet import patcher
+
+from vix import vixlib
+from vix import vixutils
+
+# The Vix calls are executed in native threads
+_threading = patcher.original('threading')
+_time = patcher.original('time')
+
+FAKE_SOFTWARE_VERSION = "VMware Workstation 10.0.0 build-fake"
+
+_RUNNING_STATES = [vixlib.VIX_POWERSTATE_POWERED_ON,
+                   vixlib.VIX_POWERSTATE_PAUSED]
+
+
+def _handle_value(handle):
+    # Handles are passed either as ints or as VixHandle instances
+    return getattr(handle, 'value', handle)
+
+
+def _set_output(ref, value):
+    # ctypes.byref() references expose the target object as _obj
+    obj = getattr(ref, '_obj', None)
+    if obj is None:
+        obj = ref.contents
+    obj.value = value
+
+
+def _normalize_path(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _read_vmx(vmx_path):
+    config = {}
+    if os.path.exists(vmx_path):
+        with open(vmx_path, 'rb') as f:
+            for s in f.readlines():
+                m = re.match(r'^([^\s=]+)\s*=\s*"(.*)"(\r)?$', s)
+                if m:
+                    config[m.group(1).lower()] = m.group(2)
+    return config
+
+
+class _FakeHost(object):
+    handle_type = vixlib.VIX_HANDLETYPE_HOST
+
+    def __init__(self, host_type):
+        self.host_type = host_type
+
+    def get_property(self, prop_id):
+        if prop_id == vixlib.VIX_PROPERTY_HOST_SOFTWARE_VERSION:
+            return FAKE_SOFTWARE_VERSION
+        elif prop_id == vixlib.VIX_PROPERTY_HOST_HOSTTYPE:
+            return self.host_type
+
+
+class _FakeVMState(object):
+    def __init__(self, vmx_path):
+        self.vmx_path = vmx_path
+        self.power_state = vixlib.VIX_POWERSTATE_POWERED_OFF
+        self.tools_state = vixlib.VIX_TOOLSSTATE_UNKNOWN
+        self.root_snapshots = []
+        self.current_snapshot = None
+
+
+class _FakeVM(object):
+    handle_type = vixlib.VIX_HANDLETYPE_VM
+
+    def __init__(self, state):
+        self.state = state
+        self.config = _read_vmx(state.vmx_path)
+
+    def get_property(self, prop_id):
+        if prop_id == vixlib.VIX_PROPERTY_VM_POWER_STATE:
+            return self.state.power_state
+        elif prop_id == vixlib.VIX_PROPERTY_VM_VMX_PATHNAME:
+            return self.state.vmx_path
+        elif prop_id == vixlib.VIX_PROPERTY_VM_IS_RUNNING:
+            return int(self.state.power_state in _RUNNING_STATES)
+        elif prop_id == vixlib.VIX_PROPERTY_VM_TOOLS_STATE:
+            return self.state.tools_state
+        elif prop_id == vixlib.VIX_PROPERTY_VM_NUM_VCPUS:
+            return int(self.config.get("numvcpus", 1))
+        elif prop_id == vixlib.VIX_PROPERTY_VM_MEMORY_SIZE:
+            return int(self.config.get("memsize", 0))
+        elif prop_id == vixlib.VIX_PROPERTY_VM_GUESTOS:
+            return self.config.get("guestos", "")
+        elif prop_id == vixlib.VIX_PROPERTY_VM_NAME:
+            return self.config.get("displayname", "")
+
+
+class _FakeSnapshot(object):
+    handle_type = vixlib.VIX_HANDLETYPE_SNAPSHOT
+
+    def __init__(self, name, description, power_state, parent):
+        # Vix returns empty strings for the values not set
+        self.name = name or ""
+        self.description = description or ""
+        self.power_state = power_state
+        self.parent = parent
+        self.children = []
+
+    def get_property(self, prop_id):
+        if prop_id == vixlib.VIX_PROPERTY_SNAPSHOT_DISPLAYNAME:
+            return self.name
+        elif prop_id == vixlib.VIX_PROPERTY_SNAPSHOT_DESCRIPTION:
+            return self.description
+        elif prop_id == vixlib.VIX_PROPERTY_SNAPSHOT_POWERSTATE:
+            return self.power_state
+
+
+class _FakeFoundItem(object):
+    handle_type = vixlib.VIX_HANDLETYPE_PROPERTY_LIST
+
+    def __init__(self, location):
+        self.location = location
+
+    def get_property(self, prop_id):
+        if prop_id == vixlib.VIX_PROPERTY_FOUND_ITEM_LOCATION:
+            return self.location
+
+
+class _FakeJob(object):
+    handle_type = vixlib.VIX_HANDLETYPE_JOB
+
+    def __init__(self, ready_time, err, results, events, callback,
+                 client_data):
+        self.ready_time = ready_time
+        self.err = err
+        self.results = results
+        self.events = events
+        self.callback = callback
+        self.client_data = client_data
+        self.completed = False
+
+    def get_property(self, prop_id):
+        return self.results.get(prop_id)
+
+
+class FakeVixLibrary(object):
+    """Simulates the Vix functions used by vixutils.
+
+    Every asynchronous operation returns a job that completes after the
+    latency configured for the operation, in seconds. Failures can be
+    injected per operation with inject_failure().
+    """
+
+    def __init__(self, latencies=None, default_latency=0,
+                 host_type=vixlib.VIX_SERVICEPROVIDER_VMWARE_WORKSTATION):
+        self._latencies = latencies or {}
+        self._default_latency = default_latency
+        self._host_type = host_type
+        self._failures = {}
+        self._handles = {}
+        self._refcounts = {}
+        self._vm_states = {}
+        self._registered_vms = set()
+        self._last_handle = vixlib.VIX_INVALID_HANDLE
+        self._lock = _threading.RLock()
+        self.call_counts = {}
+
+    def set_latency(self, operation, latency):
+        self._latencies[operation] = latency
+
+    def inject_failure(self, operation, err=vixlib.VIX_E_FAIL, count=1):
+        """Fails the next count calls of the given operation with err.
+
+        A count of None fails all the calls until clear_failures() is
+        invoked.
+        """
+        with self._lock:
+            self._failures[operation] = [err, count]
+
+    def clear_failures(self):
+        with self._lock:
+            self._failures.clear()
+
+    def get_open_handles_count(self):
+        with self._lock:
+            return len(self._handles)
+
+    def _add_handle(self, obj):
+        self._last_handle += 1
+        self._handles[self._last_handle] = obj
+        self._refcounts[self._last_handle] = 1
+        return self._last_handle
+
+    def _get_object(self, handle):
+        return self._handles.get(_handle_value(handle))
+
+    def _get_vm_state(self, vmx_path):
+        key = _normalize_path(vmx_path)
+        state = self._vm_states.get(key)
+        if not state:
+            state = _FakeVMState(vmx_path)
+            self._vm_states[key] = state
+        return state
+
+    def _pop_failure(self, operation):
+        failure = self._failures.get(operation)
+        if not failure:
+            return vixlib.VIX_OK
+        err, count = failure
+        if count is not None:
+            if count <= 1:
+                del self._failures[operation]
+            else:
+                failure[1] = count - 1
+        return err
+
+    def _start_job(self, operation, action, callback=None, client_data=None):
+        # action performs the operation and returns a tuple containing
+        # the error code, the job result properties and the events to be
+        # delivered to the callback
+        with self._lock:
+            self.call_counts[operation] = self.call_counts.get(operation,
+                                                               0) + 1
+            err = self._pop_failure(operation)
+            results = {}
+            events = []
+            if not err:
+                err, results, events = action()
+
+            latency = self._latencies.get(operation, self._default_latency)
+            job = _FakeJob(_time.time() + latency, err, results, events,
+                           callback, client_data)
+            return self._add_handle(job)
+
+    def _complete_job(self, job_handle, job):
+        with self._lock:
+            if job.completed:
+                return
+            job.completed = True
+            events = job.events
+        if job.callback:
+            for event_type, item in events:
+                with self._lock:
+                    item_handle = self._add_handle(item)
+                job.callback(job_handle, event_type, item_handle,
+                             job.client_data)
+                self.Vix_ReleaseHandle(item_handle)
+            job.callback(job_handle, vixlib.VIX_EVENTTYPE_JOB_COMPLETED,
+                         vixlib.VIX_INVALID_HANDLE, job.client_data)
+
+    def _set_properties(self, obj, args):
+        i = 0
+        while i + 1 < len(args) and args[i] != vixlib.VIX_PROPERTY_NONE:
+            value = obj.get_property(args[i])
+            if value is None:
+                return vixlib.VIX_E_INVALID_ARG
+            _set_output(args[i + 1], value)
+            i += 2
+        return vixlib.VIX_OK
+
+    def _ok(self, results=None, events=None):
+        return vixlib.VIX_OK, results or {}, events or []
+
+    def _error(self, err):
+        return err, {}, []
+
+    def _vm_result(self, vmx_path):
+        vm_handle = self._add_handle(_FakeVM(self._get_vm_state(vmx_path)))
+        return self._ok({vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE: vm_handle})
+
+    def _power_op(self, operation, vm_handle, from_states, to_state):
+        def action():
+            vm = self._get_object(vm_handle)
+            if not vm:
+                return self._error(vixlib.VIX_E_INVALID_HANDLE)
+            if from_states and vm.state.power_state not in from_states:
+                return self._error(vixlib.VIX_E_VM_NOT_RUNNING)
+            vm.state.power_state = to_state
+            if to_state != vixlib.VIX_POWERSTATE_POWERED_ON:
+                vm.state.tools_state = vixlib.VIX_TOOLSSTATE_UNKNOWN
+            return self._ok()
+        return self._start_job(operation, action)
+
+    def Vix_GetErrorText(self, err, locale):
+        return "Fake Vix error: %d" % err
+
+    def Vix_ReleaseHandle(self, handle):
+        handle = _handle_value(handle)
+        with self._lock:
+            if handle in self._refcounts:
+                self._refcounts[handle] -= 1
+                if not self._refcounts[handle]:
+                    del self._refcounts[handle]
+                    del self._handles[handle]
+
+    def Vix_AddRefHandle(self, handle):
+        handle = _handle_value(handle)
+        with self._lock:
+            if handle in self._refcounts:
+                self._refcounts[handle] += 1
+
+    def Vix_GetHandleType(self, handle):
+        obj = self._get_object(handle)
+        if not obj:
+            return vixlib.VIX_HANDLETYPE_NONE
+        return obj.handle_type
+
+    def Vix_GetProperties(self, handle, *args):
+        with self._lock:
+            obj = self._get_object(handle)
+            if not obj:
+                return vixlib.VIX_E_INVALID_HANDLE
+            return self._set_properties(obj, args)
+
+    def Vix_FreeBuffer(self, buf):
+        pass
+
+    def VixHost_Connect(self, api_version, host_type, host_name, port,
+                        user_name, password, options, property_list,
+                        callback, client_data):
+        def action():
+            host_handle = self._add_handle(_FakeHost(self._host_type))
+            return self._ok({vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE:
+                             host_handle})
+        return self._start_job('VixHost_Connect', action, callback,
+                               client_data)
+
+    def VixHost_Disconnect(self, host_handle):
+        self.Vix_ReleaseHandle(host_handle)
+
+    def VixHost_RegisterVM(self, host_handle, vmx_path, callback,
+                           client_data):
+        def action():
+            self._registered_vms.add(_normalize_path(vmx_path))
+            return self._ok()
+        return self._start_job('VixHost_RegisterVM', action, callback,
+                               client_data)
+
+    def VixHost_UnregisterVM(self, host_handle, vmx_path, callback,
+                             client_data):
+        def action():
+            self._registered_vms.discard(_normalize_path(vmx_path))
+            return self._ok()
+        return self._start_job('VixHost_UnregisterVM', action, callback,
+                               client_data)
+
+    def VixHost_FindItems(self, host_handle, search_type, search_criteria,
+                          timeout, callback, client_data):
+        def action():
+            events = []
+            for state in self._vm_states.values():
+                if (search_type == vixlib.VIX_FIND_RUNNING_VMS and
+                        state.power_state not in _RUNNING_STATES):
+                    continue
+                events.append((vixlib.VIX_EVENTTYPE_FIND_ITEM,
+                               _FakeFoundItem(state.vmx_path)))
+            return self._ok(events=events)
+        return self._start_job('VixHost_FindItems', action, callback,
+                               client_data)
+
+    def VixVM_Open(self, host_handle, vmx_path, callback, client_data):
+        def action():
+            if not os.path.exists(vmx_path):
+                return self._error(vixlib.VIX_E_FILE_NOT_FOUND)
+            return self._vm_result(vmx_path)
+        return self._start_job('VixVM_Open', action, callback, client_data)
+
+    def VixVM_PowerOn(self, vm_handle, options, property_list, callback,
+                      client_data):
+        return self._power_op('VixVM_PowerOn', vm_handle, None,
+                              vixlib.VIX_POWERSTATE_POWERED_ON)
+
+    def VixVM_PowerOff(self, vm_handle, options, callback, client_data):
+        return self._power_op('VixVM_PowerOff', vm_handle, None,
+                              vixlib.VIX_POWERSTATE_POWERED_OFF)
+
+    def VixVM_Reset(self, vm_handle, options, callback, client_data):
+        return self._power_op('VixVM_Reset', vm_handle,
+                              [vixlib.VIX_POWERSTATE_POWERED_ON],
+                              vixlib.VIX_POWERSTATE_POWERED_ON)
+
+    def VixVM_Suspend(self, vm_handle, options, callback, client_data):
+        return self._power_op('VixVM_Suspend', vm_handle, _RUNNING_STATES,
+                              vixlib.VIX_POWERSTATE_SUSPENDED)
+
+    def VixVM_Pause(self, vm_handle, options, property_list, callback,
+                    client_data):
+        return self._power_op('VixVM_Pause', vm_handle,
+                              [vixlib.VIX_POWERSTATE_POWERED_ON],
+                              vixlib.VIX_POWERSTATE_PAUSED)
+
+    def VixVM_Unpause(self, vm_handle, options, property_list, callback,
+                      client_data):
+        return self._power_op('VixVM_Unpause', vm_handle,
+                              [vixlib.VIX_POWERSTATE_PAUSED],
+                              vixlib.VIX_POWERSTATE_POWERED_ON)
+
+    def VixVM_Delete(self, vm_handle, options, callback, client_data):
+        def action():
+            vm = self._get_object(vm_handle)
+            if not vm:
+                return self._error(vixlib.VIX_E_INVALID_HANDLE)
+            if vm.state.power_state in _RUNNING_STATES:
+                return self._error(vixlib.VIX_E_VM_IS_RUNNING)
+
+            vmx_path = vm.state.vmx_path
+            if options & vixlib.VIX_VMDELETE_DISK_FILES:
+                shutil.rmtree(os.path.dirname(vmx_path), True)
+            elif os.path.exists(vmx_path):
+                os.remove(vmx_path)
+            del self._vm_states[_normalize_path(vmx_path)]
+            return self._ok()
+        return self._start_job('VixVM_Delete', action, callback, client_data)
+
+    def VixVM_WaitForToolsInGuest(self, vm_handle, timeout, callback,
+                                  client_data):
+        def action():
+            vm = self._get_object(vm_handle)
+            if not vm:
+                return self._error(vixlib.VIX_E_INVALID_HANDLE)
+            if vm.state.power_state != vixlib.VIX_POWERSTATE_POWERED_ON:
+                return self._error(vixlib.VIX_E_VM_NOT_RUNNING)
+            vm.state.tools_state = vixlib.VIX_TOOLSSTATE_RUNNING
+            return self._ok()
+        return self._start_job('VixVM_WaitForToolsInGuest', action,
+                               callback, client_data)
+
+    def VixVM_ReadVariable(self, vm_handle, variable_type, name, options,
+                           callback, client_data):
+        def action():
+            vm = self._get_object(vm_handle)
+            if not vm:
+                return self._error(vixlib.VIX_E_INVALID_HANDLE)
+            value = ""
+            if name == "ip":
+                value = "10.0.%d.%d" % divmod(_handle_value(vm_handle) % 65024,
+                                              254)
+            return self._ok({
+                vixlib.VIX_PROPERTY_JOB_RESULT_VM_VARIABLE_STRING: value})
+        return self._start_job('VixVM_ReadVariable', action, callback,
+                               client_data)
+
+    def _write_clone_files(self, src_vmx_path, dest_vmx_path, linked):
+        src_config = _read_vmx(src_vmx_path)
+        src_disk = src_config.get("scsi0:0.filename")
+        if src_disk and not os.path.isabs(src_disk):
+            src_disk = os.path.join(os.path.dirname(src_vmx_path), src_disk)
+
+        dest_dir = os.path.dirname(dest_vmx_path)
+        dest_name = os.path.splitext(os.path.basename(dest_vmx_path))[0]
+        disk_filename = "%s-cl1.vmdk" % dest_name
+        disk_path = os.path.join(dest_dir, disk_filename)
+
+        if not os.path.exists(dest_dir):
+            os.makedirs(dest_dir)
+
+        if linked or not src_disk or not os.path.exists(src_disk):
+            with open(disk_path, 'wb') as f:
+                f.write('# Disk DescriptorFile' + os.linesep)
+                f.write('createType="monolithicSparse"' + os.linesep)
+                if linked and src_disk:
+                    f.write('parentFileNameHint="%s"' % src_disk +
+                            os.linesep)
+        else:
+            shutil.copyfile(src_disk, disk_path)
+
+        with open(src_vmx_path, 'rb') as f:
+            lines = f.readlines()
+        with open(dest_vmx_path, 'wb') as f:
+            for s in lines:
+                if re.match(r'^scsi0:0\.fileName\s*=', s, re.IGNORECASE):
+                    s = 'scsi0:0.fileName = "%s"' % disk_filename + os.linesep
+                f.write(s)
+
+        vmsd_path = os.path.join(dest_dir, dest_name + ".vmsd")
+        with open(vmsd_path, 'wb') as f:
+            f.write('.encoding = "UTF-8"' + os.linesep)
+            f.write('sentinel0 = "%s"' % disk_filename + os.linesep)
+
+    def VixVM_Clone(self, vm_handle, snapshot_handle, clone_type,
+                    dest_vmx_path, options, property_list, callback,
+                    client_data):
+        def action():
+            vm = self._get_object(vm_handle)
+            if not vm:
+                return self._error(vixlib.VIX_E_INVALID_HANDLE)
+            if os.path.exists(dest_vmx_path):
+                return self._error(vixlib.VIX_E_FILE_ALREADY_EXISTS)
+
+            snapshot = None
+            if _handle_value(snapshot_handle):
+                snapshot = self._get_object(snapshot_handle)
+                if not snapshot:
+                    return self._error(vixlib.VIX_E_SNAPSHOT_NOTFOUND)
+
+            self._write_clone_files(
+                vm.state.vmx_path, dest_vmx_path,
+                clone_type == vixlib.VIX_CLONETYPE_LINKED)
+
+            err, results, events = self._vm_result(dest_vmx_path)
+            if snapshot:
+                # Clones of a snapshot start in the snapshot power state
+                state = self._get_vm_state(dest_vmx_path)
+                state.power_state = snapshot.power_state
+            return err, results, events
+        return self._start_job('VixVM_Clone', action, callback, client_data)
+
+    def VixVM_CreateSnapshot(self, vm_handle, name, description, options,
+                             property_list, callback, client_data):
+        def action():
+            vm = self._get_object(vm_handle)
+            if not vm:
+                return self._error(vixlib.VIX_E_INVALID_HANDLE)
+
+            state = vm.state
+            if options & vixlib.VIX_SNAPSHOT_INCLUDE_MEMORY:
+                power_state = state.power_state
+            else:
+                power_state = vixlib.VIX_POWERSTATE_POWERED_OFF
+
+            parent = state.current_snapshot
+            snapshot = _FakeSnapshot(name, description, power_state, parent)
+            if parent:
+                parent.children.append(snapshot)
+            else:
+                state.root_snapshots.append(snapshot)
+            state.current_snapshot = snapshot
+
+            return self._ok({vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE:
+                             self._add_handle(snapshot)})
+        return self._start_job('VixVM_CreateSnapshot', action, callback,
+                               client_data)
+
+    def VixVM_RemoveSnapshot(self, vm_handle, snapshot_handle, options,
+                             callback, client_data):
+        def action():
+            vm = self._get_object(vm_handle)
+            snapshot = self._get_object(snapshot_handle)
+            if not vm or not snapshot:
+                return self._error(vixlib.VIX_E_INVALID_HANDLE)
+
+            state = vm.state
+            if snapshot.parent:
+                siblings = snapshot.parent.children
+            else:
+                siblings = state.root_snapshots
+            if snapshot not in siblings:
+                return self._error(vixlib.VIX_E_SNAPSHOT_NOTFOUND)
+
+            # Children are reparented, as in the Vix API
+            index = siblings.index(snapshot)
+            siblings[index:index + 1] = snapshot.children
+            for child in snapshot.children:
+                child.parent = snapshot.parent
+            if state.current_snapshot is snapshot:
+                state.current_snapshot = snapshot.parent
+            return self._ok()
+        return self._start_job('VixVM_RemoveSnapshot', action, callback,
+                               client_data)
+
+    def VixVM_RevertToSnapshot(self, vm_handle, snapshot_handle, options,
+                               property_list, callback, client_data):
+        def action():
+            vm = self._get_object(vm_handle)
+            snapshot = self._get_object(snapshot_handle)
+            if not vm or not snapshot:
+                return self._error(vixlib.VIX_E_INVALID_HANDLE)
+            vm.state.power_state = snapshot.power_state
+            vm.state.current_snapshot = snapshot
+            return self._ok()
+        return self._start_job('VixVM_RevertToSnapshot', action, callback,
+                               client_data)
+
+    def _get_snapshot_output(self, snapshot, ref):
+        if not snapshot:
+            return vixlib.VIX_E_SNAPSHOT_NOTFOUND
+        _set_output(ref, self._add_handle(snapshot))
+        return vixlib.VIX_OK
+
+    def VixVM_GetNumRootSnapshots(self, vm_handle, ref):
+        with self._lock:
+            vm = self._get_object(vm_handle)
+            if not vm:
+                return vixlib.VIX_E_INVALID_HANDLE
+            _set_output(ref, len(vm.state.root_snapshots))
+            return vixlib.VIX_OK
+
+    def VixVM_GetRootSnapshot(self, vm_handle, index, ref):
+        with self._lock:
+            vm = self._get_object(vm_handle)
+            if not vm:
+                return vixlib.VIX_E_INVALID_HANDLE
+            snapshots = vm.state.root_snapshots
+            snapshot = None
+            if 0 <= index < len(snapshots):
+                snapshot = snapshots[index]
+            return self._get_snapshot_output(snapshot, ref)
+
+    def VixVM_GetCurrentSnapshot(self, vm_handle, ref):
+        with self._lock:
+            vm = self._get_object(vm_handle)
+            if not vm:
+                return vixlib.VIX_E_INVALID_HANDLE
+            return self._get_snapshot_output(vm.state.current_snapshot, ref)
+
+    def VixVM_GetNamedSnapshot(self, vm_handle, name, ref):
+        with self._lock:
+            vm = self._get_object(vm_handle)
+            if not vm:
+                return vixlib.VIX_E_INVALID_HANDLE
+
+            snapshots = list(vm.state.root_snapshots)
+            while snapshots:
+                snapshot = snapshots.pop(0)
+                if snapshot.name == name:
+                    return self._get_snapshot_output(snapshot, ref)
+                snapshots += snapshot.children
+            return vixlib.VIX_E_SNAPSHOT_NOTFOUND
+
+    def VixSnapshot_GetNumChildren(self, snapshot_handle, ref):
+        with self._lock:
+            snapshot = self._get_object(snapshot_handle)
+            if not snapshot:
+                return vixlib.VIX_E_INVALID_HANDLE
+            _set_output(ref, len(snapshot.children))
+            return vixlib.VIX_OK
+
+    def VixSnapshot_GetChild(self, snapshot_handle, index, ref):
+        with self._lock:
+            snapshot = self._get_object(snapshot_handle)
+            if not snapshot:
+                return vixlib.VIX_E_INVALID_HANDLE
+            child = None
+            if 0 <= index < len(snapshot.children):
+                child = snapshot.children[index]
+            return self._get_snapshot_output(child, ref)
+
+    def VixSnapshot_GetParent(self, snapshot_handle, ref):
+        with self._lock:
+            snapshot = self._get_object(snapshot_handle)
+            if not snapshot:
+                return vixlib.VIX_E_INVALID_HANDLE
+            if not snapshot.parent:
+                _set_output(ref, vixlib.VIX_INVALID_HANDLE)
+                return vixlib.VIX_OK
+            return self._get_snapshot_output(snapshot.parent, ref)
+
+    def VixJob_CheckCompletion(self, job_handle, ref):
+        job = self._get_object(job_handle)
+        if not job:
+            return vixlib.VIX_E_INVALID_HANDLE
+        completed = _time.time() >= job.ready_time
+        if completed:
+            self._complete_job(_handle_value(job_handle), job)
+        _set_output(ref, int(completed))
+        return vixlib.VIX_OK
+
+    def VixJob_GetError(self, job_handle):
+        job = self._get_object(job_handle)
+        if not job:
+            return vixlib.VIX_E_INVALID_HANDLE
+        return job.err
+
+    def VixJob_Wait(self, job_handle, *args):
+        job = self._get_object(job_handle)
+        if not job:
+            return vixlib.VIX_E_INVALID_HANDLE
+
+        delay = job.ready_time - _time.time()
+        if delay > 0:
+            # Blocks the calling thread, as the Vix library does
+            _time.sleep(delay)
+        self._complete_job(_handle_value(job_handle), job)
+
+        if job.err:
+            return job.err
+        with self._lock:
+            return self._set_properties(job, args)
+
+
+def install(library=None):
+    """Replaces the Vix shared library with a FakeVixLibrary instance."""
+    if library is None:
+        library = FakeVixLibrary()
+    vixlib.set_backend(library)
+    # The VMware product is detected from the local installation instead
+    # of the Vix API
+    vixutils._host_type = library._host_type
+    return library
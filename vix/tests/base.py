@@ -0,0 +1,50 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Base class of the unit tests working on real files.
+"""
+import mock
+import os
+import shutil
+import unittest
+
+from nova.openstack.common import excutils
+
+# Some tests replace these functions without restoring them, the originals
+# are captured when the test modules are imported
+_ORIGINAL_FUNCS = dict(
+    [('os.path.' + name, getattr(os.path, name)) for name in
+     ['join', 'dirname', 'basename', 'splitext', 'exists', 'getsize',
+      'isdir']] +
+    [('os.makedirs', os.makedirs), ('os.remove', os.remove),
+     ('os.linesep', os.linesep), ('shutil.rmtree', shutil.rmtree),
+     ('nova.openstack.common.excutils.save_and_reraise_exception',
+      excutils.save_and_reraise_exception)])
+
+
+def restore_original_funcs(test_case):
+    """Restores the original functions until the end of the test."""
+    for (name, func) in _ORIGINAL_FUNCS.items():
+        patcher = mock.patch(name, func)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        super(TestCase, self).setUp()
+        restore_original_funcs(self)
@@ -0,0 +1,138 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import os
+import shutil
+import tempfile
+
+from vix.compute import clone_pool
+from vix.compute import pathutils
+from vix import vmx
+from vix.tests import base
+
+
+class ClonePoolTestCase(base.TestCase):
+    """Unit tests for the pool of linked clones"""
+
+    def setUp(self):
+        super(ClonePoolTestCase, self).setUp()
+        patcher = mock.patch('nova.utils.spawn_n')
+        self._mock_spawn_n = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self._tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tmpdir)
+        self._base_vmdk_path = os.path.join(self._tmpdir, '_base',
+                                            'fake_id.vmdk')
+        self._pool_dir = os.path.join(self._tmpdir, '_pool', 'fake_id')
+
+        self._pathutils = pathutils.PathUtils()
+        self._pathutils.get_instances_dir = mock.MagicMock(
+            return_value=self._tmpdir)
+        self._clone_func = mock.MagicMock(side_effect=self._fake_clone)
+        self._pool = clone_pool.ClonePool(self._pathutils, self._clone_func,
+                                          2)
+
+    def _fake_clone(self, base_vmdk_path, root_vmdk_path, vmx_path,
+                    guest_os):
+        vm_dir = os.path.dirname(vmx_path)
+        with open(root_vmdk_path, 'wb') as f:
+            f.write('parentFileNameHint="%s"' % base_vmdk_path)
+        with open(os.path.join(vm_dir, 'pool.vmsd'), 'wb') as f:
+            f.write('sentinel0 = "root.vmdk"\n')
+        with open(vmx_path, 'wb') as f:
+            f.write('scsi0:0.fileName = "root.vmdk"\n'
+                    'extendedConfigFile = "pool.vmxf"\n'
+                    'displayName = "pool"\n')
+
+    def _get_slots(self):
+        return sorted(os.listdir(self._pool_dir))
+
+    def test_add_image(self):
+        self._pool.add_image(self._base_vmdk_path)
+
+        self._mock_spawn_n.assert_called_once_with(self._pool.fill,
+                                                   self._base_vmdk_path)
+
+    def test_add_image_disabled(self):
+        pool = clone_pool.ClonePool(self._pathutils, self._clone_func, 0)
+
+        pool.add_image(self._base_vmdk_path)
+
+        self.assertFalse(self._mock_spawn_n.called)
+
+    def test_fill(self):
+        os.makedirs(os.path.join(self._pool_dir, 'stale.tmp'))
+
+        self._pool.fill(self._base_vmdk_path)
+        self._pool.fill(self._base_vmdk_path)
+
+        slots = self._get_slots()
+        self.assertEqual(len(slots), 2)
+        self.assertEqual(self._clone_func.call_count, 2)
+        self.assertFalse([slot for slot in slots if slot.endswith('.tmp')])
+        self.assertEqual(sorted(os.listdir(os.path.join(self._pool_dir,
+                                                        slots[0]))),
+                         ['pool.vmsd', 'pool.vmx', 'root.vmdk'])
+
+    def test_fill_failure(self):
+        self._clone_func.side_effect = Exception
+
+        self._pool.fill(self._base_vmdk_path)
+
+        self.assertEqual(self._get_slots(), [])
+
+    def test_claim(self):
+        self._pool.add_image(self._base_vmdk_path, 'fake_guest_os')
+        self._pool.fill(self._base_vmdk_path)
+        self._clone_func.assert_called_with(self._base_vmdk_path, mock.ANY,
+                                            mock.ANY, 'fake_guest_os')
+        self._mock_spawn_n.reset_mock()
+        self._pathutils.create_instance_dir('instance1')
+
+        response = self._pool.claim(self._base_vmdk_path, 'instance1')
+
+        self.assertTrue(response)
+        self.assertEqual(len(self._get_slots()), 1)
+        instance_dir = self._pathutils.get_instance_dir('instance1')
+        self.assertEqual(sorted(os.listdir(instance_dir)),
+                         ['instance1.vmsd', 'instance1.vmx', 'root.vmdk'])
+        vmx_file = vmx.VmxFile.load(self._pathutils.get_vmx_path(
+            'instance1'))
+        self.assertEqual(vmx_file.get('extendedConfigFile'),
+                         'instance1.vmxf')
+        self.assertEqual(vmx_file.get('displayName'), 'pool')
+        self._mock_spawn_n.assert_called_once_with(self._pool.fill,
+                                                   self._base_vmdk_path)
+
+    def test_claim_empty_pool(self):
+        response = self._pool.claim(self._base_vmdk_path, 'instance1')
+
+        self.assertFalse(response)
+        self.assertFalse(self._mock_spawn_n.called)
+
+    def test_remove_unused(self):
+        self._pool.add_image(self._base_vmdk_path)
+        self._pool.fill(self._base_vmdk_path)
+        unused_pool_dir = os.path.join(self._tmpdir, '_pool', 'unused_id')
+        os.makedirs(unused_pool_dir)
+
+        self._pool.remove_unused()
+
+        self.assertEqual(os.listdir(os.path.join(self._tmpdir, '_pool')),
+                         ['fake_id'])
@@ -0,0 +1,220 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import mock
+import os
+import shutil
+import tempfile
+
+from vix.compute import clone_promoter
+from vix.compute import pathutils
+from vix import vixlib
+from vix import vixutils
+from vix import vmx
+from vix.tests import base
+
+
+class ClonePromoterTestCase(base.TestCase):
+    """Unit tests for the promotion of linked clones to full clones"""
+
+    def setUp(self):
+        super(ClonePromoterTestCase, self).setUp()
+        patcher = mock.patch('nova.utils.spawn_n')
+        self._mock_spawn_n = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self._tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tmpdir)
+
+        self._pathutils = pathutils.PathUtils()
+        self._pathutils.get_instances_dir = mock.MagicMock(
+            return_value=self._tmpdir)
+        self._conn = mock.MagicMock()
+        self._vm = self._conn.open_vm.return_value.__enter__.return_value
+        self._vm.get_power_state.return_value = (
+            vixlib.VIX_POWERSTATE_POWERED_OFF)
+        self._promoter = clone_promoter.ClonePromoter(
+            self._pathutils, self._conn, 3600, 0, 'fake_baseline')
+        self._disk_manager = mock.MagicMock()
+        self._disk_manager.consolidate_disk.side_effect = self._fake_copy
+        self._promoter._disk_manager = self._disk_manager
+
+        self._pathutils.create_instance_dir('instance1')
+        self._vmx_path = self._pathutils.get_vmx_path('instance1')
+        self._root_vmdk_path = self._pathutils.get_root_vmdk_path(
+            'instance1')
+        with open(self._vmx_path, 'wb') as f:
+            f.write('scsi0:0.fileName = "root.vmdk"\n')
+        with open(self._root_vmdk_path, 'wb') as f:
+            f.write('parentFileNameHint="fake_base.vmdk"')
+
+    def _fake_copy(self, src_path, dest_path):
+        with open(dest_path, 'wb') as f:
+            f.write('full disk')
+
+    def _read_root_vmdk(self):
+        with open(self._root_vmdk_path, 'rb') as f:
+            return f.read()
+
+    def _get_instance(self, age):
+        created_at = (datetime.datetime.utcnow() -
+                      datetime.timedelta(seconds=age))
+        return {'name': 'instance1', 'created_at': created_at}
+
+    def test_promote_instances(self):
+        self._promoter.promote_instances(['fake_instance'])
+
+        self._mock_spawn_n.assert_called_once_with(
+            self._promoter._promote_instances, ['fake_instance'])
+
+    def test_promote_instances_disabled(self):
+        promoter = clone_promoter.ClonePromoter(self._pathutils, self._conn,
+                                                0, 0)
+
+        promoter.promote_instances(['fake_instance'])
+
+        self.assertFalse(self._mock_spawn_n.called)
+
+    def test_promote_instances_running(self):
+        self._promoter.promote_instances(['fake_instance'])
+        self._promoter.promote_instances(['fake_instance'])
+
+        self.assertEqual(self._mock_spawn_n.call_count, 1)
+
+    def test_is_promotion_due(self):
+        self._disk_manager.get_parent_disk_path.return_value = 'fake_base'
+
+        self.assertTrue(self._promoter._is_promotion_due(
+            self._get_instance(7200)))
+        self.assertFalse(self._promoter._is_promotion_due(
+            self._get_instance(60)))
+        self._disk_manager.get_parent_disk_path.assert_called_with(
+            self._root_vmdk_path)
+
+    def test_is_promotion_due_iso_time(self):
+        self._disk_manager.get_parent_disk_path.return_value = 'fake_base'
+
+        self.assertTrue(self._promoter._is_promotion_due(
+            {'name': 'instance1', 'created_at': '2013-01-01T00:00:00Z'}))
+
+    def test_is_promotion_due_disk_size(self):
+        self._disk_manager.get_parent_disk_path.return_value = 'fake_base'
+        promoter = clone_promoter.ClonePromoter(self._pathutils, self._conn,
+                                                0, 1)
+        promoter._disk_manager = self._disk_manager
+
+        self.assertFalse(promoter._is_promotion_due(self._get_instance(0)))
+        with open(self._root_vmdk_path, 'ab') as f:
+            f.write('\0' * 1024 * 1024)
+        self.assertTrue(promoter._is_promotion_due(self._get_instance(0)))
+
+    def test_is_promotion_due_full_clone(self):
+        self._disk_manager.get_parent_disk_path.return_value = None
+
+        self.assertFalse(self._promoter._is_promotion_due(
+            self._get_instance(7200)))
+
+    def test_promote(self):
+        response = self._promoter.promote('instance1')
+
+        self.assertTrue(response)
+        self._disk_manager.consolidate_disk.assert_called_once_with(
+            self._root_vmdk_path,
+            os.path.join(os.path.dirname(self._root_vmdk_path),
+                         'root-full.vmdk'))
+        self.assertEqual(self._read_root_vmdk(), 'full disk')
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self._vmx_path))),
+                         ['instance1.vmx', 'root.vmdk'])
+        self._conn.invalidate_vm.assert_called_once_with(self._vmx_path)
+        self.assertTrue(self._promoter.is_promoted('instance1'))
+        self.assertFalse(self._promoter.is_promoted('instance2'))
+
+    def test_promote_powered_on(self):
+        self._vm.get_power_state.return_value = (
+            vixlib.VIX_POWERSTATE_POWERED_ON)
+
+        response = self._promoter.promote('instance1')
+
+        self.assertFalse(response)
+        self.assertFalse(self._disk_manager.consolidate_disk.called)
+
+    def _set_root_disk_file_name(self, file_name):
+        vmx_file = vmx.VmxFile.load(self._vmx_path)
+        vmx_file.set('scsi0:0.fileName', file_name)
+        vmx_file.save()
+
+    def _test_promote_with_snapshots(self, snapshot_tree):
+        self._set_root_disk_file_name('root-000001.vmdk')
+        self._vm.get_snapshot_tree.return_value = snapshot_tree
+
+        response = self._promoter.promote('instance1')
+
+        self.assertFalse(response)
+        self.assertFalse(self._vm.remove_snapshot.called)
+        self.assertFalse(self._disk_manager.consolidate_disk.called)
+
+    def test_promote_with_snapshots(self):
+        self._test_promote_with_snapshots(
+            [vixutils.VixSnapshotInfo('fake_snapshot', '', 0, [])])
+
+    def test_promote_with_baseline_child_snapshots(self):
+        self._test_promote_with_snapshots(
+            [vixutils.VixSnapshotInfo(
+                'fake_baseline', '', 0,
+                [vixutils.VixSnapshotInfo('fake_snapshot', '', 0, [])])])
+
+    def test_promote_with_baseline_snapshot(self):
+        self._set_root_disk_file_name('root-000001.vmdk')
+        self._vm.get_snapshot_tree.return_value = [
+            vixutils.VixSnapshotInfo('fake_baseline', 'fake_image_id', 0, [])]
+        self._vm.remove_snapshot.side_effect = (
+            lambda snapshot: self._set_root_disk_file_name('root.vmdk'))
+
+        response = self._promoter.promote('instance1')
+
+        self.assertTrue(response)
+        self._vm.get_named_snapshot.assert_called_once_with('fake_baseline')
+        self._vm.remove_snapshot.assert_called_once_with(
+            self._vm.get_named_snapshot.return_value)
+        self.assertEqual(self._read_root_vmdk(), 'full disk')
+        self.assertTrue(self._promoter.is_promoted('instance1'))
+
+    def test_promote_started_during_copy(self):
+        self._vm.get_power_state.side_effect = [
+            vixlib.VIX_POWERSTATE_POWERED_OFF,
+            vixlib.VIX_POWERSTATE_POWERED_ON]
+
+        response = self._promoter.promote('instance1')
+
+        self.assertFalse(response)
+        self.assertEqual(self._read_root_vmdk(),
+                         'parentFileNameHint="fake_base.vmdk"')
+        self.assertEqual(sorted(os.listdir(os.path.dirname(self._vmx_path))),
+                         ['instance1.vmx', 'root.vmdk'])
+        self.assertFalse(self._promoter.is_promoted('instance1'))
+
+    def test_promote_instances_failure(self):
+        self._disk_manager.get_parent_disk_path.return_value = 'fake_base'
+        self._disk_manager.consolidate_disk.side_effect = Exception
+
+        self._promoter._running = True
+        self._promoter._promote_instances([self._get_instance(7200)])
+
+        self.assertFalse(self._promoter._running)
+        self.assertEqual(self._read_root_vmdk(),
+                         'parentFileNameHint="fake_base.vmdk"')
@@ -0,0 +1,171 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import BaseHTTPServer
+import hashlib
+import json
+import os
+import re
+import shutil
+import SocketServer
+import tempfile
+import threading
+
+from vix.compute import downloader
+from vix.tests import base
+
+_FAKE_DATA = ''.join([chr(i % 251) for i in range(10000)])
+
+
+class _FakeImageServer(SocketServer.ThreadingMixIn,
+                       BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           _FakeImageRequestHandler)
+        self.data = _FAKE_DATA
+        self.support_ranges = True
+        # Number of bytes sent before closing the connection of the
+        # requests starting at the given offsets
+        self.fail_at = {}
+        self.requests = []
+
+
+class _FakeImageRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        range_header = self.headers.getheader('Range')
+        server.requests.append((self.path, range_header,
+                                self.headers.getheader('X-Auth-Token')))
+
+        m = re.match(r'^bytes=(\d+)-(\d+)$', range_header or '')
+        if not server.support_ranges or not m:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(server.data)))
+            self.end_headers()
+            self.wfile.write(server.data)
+            return
+
+        start = int(m.group(1))
+        end = min(int(m.group(2)), len(server.data) - 1)
+        self.send_response(206)
+        self.send_header('ETag',
+                         '"%s"' % hashlib.md5(server.data).hexdigest())
+        self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                         (start, end, len(server.data)))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if start in server.fail_at:
+            self.wfile.write(server.data[start:start + server.fail_at[start]])
+        else:
+            self.wfile.write(server.data[start:end + 1])
+
+
+class SegmentedDownloaderTestCase(base.TestCase):
+    """Unit tests for the segmented downloads, using a local HTTP server"""
+
+    def setUp(self):
+        super(SegmentedDownloaderTestCase, self).setUp()
+        self._tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tmpdir)
+        self._path = os.path.join(self._tmpdir, 'fake_image')
+        self._progress_path = self._path + downloader.PROGRESS_EXTENSION
+
+        self._server = _FakeImageServer()
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self._server.server_close)
+        self.addCleanup(self._server.shutdown)
+
+        self._url = 'http://127.0.0.1:%d/v1/images/fake_id' % (
+            self._server.server_address[1])
+
+    def _get_downloader(self):
+        return downloader.SegmentedDownloader(
+            self._url, headers={'X-Auth-Token': 'fake_token'},
+            max_connections=3, segment_size=3000, chunk_size=500,
+            progress_interval=1000)
+
+    def _read(self):
+        with open(self._path, 'rb') as f:
+            return f.read()
+
+    def _get_ranges(self):
+        return [r for (path, r, token) in self._server.requests]
+
+    def test_download(self):
+        self._get_downloader().download(self._path)
+
+        self.assertEqual(self._read(), _FAKE_DATA)
+        self.assertFalse(os.path.exists(self._progress_path))
+        self.assertEqual(sorted(self._get_ranges()),
+                         ['bytes=0-0', 'bytes=0-2999', 'bytes=3000-5999',
+                          'bytes=6000-8999', 'bytes=9000-9999'])
+        self.assertEqual(set([(path, token) for (path, r, token)
+                              in self._server.requests]),
+                         set([('/v1/images/fake_id', 'fake_token')]))
+
+    def test_download_without_range_support(self):
+        self._server.support_ranges = False
+
+        self._get_downloader().download(self._path)
+
+        self.assertEqual(self._read(), _FAKE_DATA)
+        self.assertEqual(self._get_ranges(), ['bytes=0-0'])
+        self.assertFalse(os.path.exists(self._progress_path))
+
+    def test_download_failure_keeps_progress(self):
+        self._server.fail_at = {3000: 1200}
+
+        self.assertRaises(IOError, self._get_downloader().download,
+                          self._path)
+
+        with open(self._progress_path, 'rb') as f:
+            progress = json.loads(f.read())
+        self.assertEqual(progress['segments'], [3000, 1200, 3000, 1000])
+        self.assertEqual(self._read()[:4200], _FAKE_DATA[:4200])
+
+    def test_download_resume(self):
+        self._server.fail_at = {3000: 1200}
+        self.assertRaises(IOError, self._get_downloader().download,
+                          self._path)
+        self._server.fail_at = {}
+        self._server.requests = []
+
+        self._get_downloader().download(self._path)
+
+        self.assertEqual(self._read(), _FAKE_DATA)
+        self.assertEqual(self._get_ranges(), ['bytes=0-0', 'bytes=4200-5999'])
+        self.assertFalse(os.path.exists(self._progress_path))
+
+    def test_download_restarts_if_content_changed(self):
+        self._server.fail_at = {3000: 1200}
+        self.assertRaises(IOError, self._get_downloader().download,
+                          self._path)
+        self._server.fail_at = {}
+        self._server.data = _FAKE_DATA[::-1]
+        self._server.requests = []
+
+        self._get_downloader().download(self._path)
+
+        self.assertEqual(self._read(), _FAKE_DATA[::-1])
+        self.assertEqual(len(self._get_ranges()), 5)
@@ -15,18 +15,25 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
 import mock
 import os
 import platform
+import shutil
+import tempfile
+import time
 import unittest
 
+from nova.compute import power_state
 from nova.compute import task_states
 from nova.openstack.common import jsonutils
 from oslo.config import cfg
 from vix.compute import driver
+from vix.compute import pathutils
 from vix import utils
 from vix import vixlib
 from vix import vixutils
+from vix.tests import base
 
 
 class VixDriverTestCase(unittest.TestCase):
@@ -41,6 +48,106 @@ class VixDriverTestCase(unittest.TestCase):
         self._driver._pathutils = mock.MagicMock()
         self._driver._image_cache = mock.MagicMock()
         self._driver._conn = mock.MagicMock()
+        self._driver._clone_pool = mock.MagicMock()
+        self._driver._clone_promoter = mock.MagicMock()
+        self._driver._disk_manager = mock.MagicMock()
+
+    @mock.patch('nova.utils.spawn_n')
+    def test_init_host(self, mock_spawn_n):
+        self._driver.init_host('fake_host')
+        self.assertFalse(mock_spawn_n.called)
+        self._driver._clone_pool.remove_unused.assert_called_once_with()
+
+        driver.CONF.set_override('prewarm_images', ['fake_id'], 'vix')
+        self.addCleanup(driver.CONF.clear_override, 'prewarm_images', 'vix')
+        self._driver.init_host('fake_host')
+
+        self.assertEqual(mock_spawn_n.call_args[0][0],
+                         self._driver._prewarm_image_cache)
+
+    def test_get_prewarm_image_ids(self):
+        driver.CONF.set_override('prewarm_images',
+                                 ['centos-*', 'fake_id3', 'fake_id4'], 'vix')
+        self.addCleanup(driver.CONF.clear_override, 'prewarm_images', 'vix')
+        driver.CONF.set_override('prewarm_most_used_images', 2, 'vix')
+        self.addCleanup(driver.CONF.clear_override,
+                        'prewarm_most_used_images', 'vix')
+        self._driver._image_cache.get_most_used_images.return_value = [
+            'fake_id1', 'fake_id2']
+        self._driver._image_cache.list_images.return_value = [
+            {'id': 'fake_id1', 'name': 'centos-6'},
+            {'id': 'fake_id2', 'name': 'ubuntu'},
+            {'id': 'fake_id3', 'name': None},
+            {'id': 'fake_id5', 'name': 'centos-5'}]
+
+        response = self._driver._get_prewarm_image_ids('fake_context')
+
+        self._driver._image_cache.get_most_used_images.assert_called_with(2)
+        self.assertEqual(response,
+                         ['fake_id1', 'fake_id2', 'fake_id5', 'fake_id3'])
+
+    def test_get_prewarm_image_ids_list_failure(self):
+        driver.CONF.set_override('prewarm_images', ['fake_id'], 'vix')
+        self.addCleanup(driver.CONF.clear_override, 'prewarm_images', 'vix')
+        self._driver._image_cache.list_images.side_effect = Exception
+
+        response = self._driver._get_prewarm_image_ids('fake_context')
+
+        self.assertEqual(response, ['fake_id'])
+
+    @mock.patch('vix.vixutils.get_vix_host_type')
+    def _test_prewarm_image(self, mock_get_vix_host_type, disk_format,
+                            cow, base_vmx_created):
+        mock_get_vix_host_type.return_value = vixutils.VIX_VMWARE_WORKSTATION
+        self._driver._image_cache.get_image_info.return_value = {
+            'disk_format': disk_format, 'properties': {'cow': str(cow)}}
+        fake_image_path = 'fake/path.%s' % disk_format
+        self._driver._image_cache.get_cached_image.return_value = (
+            fake_image_path)
+        self._driver._image_cache.get_vmdk_image.return_value = (
+            'fake/path.vmdk')
+        self._driver._create_base_vmx = mock.MagicMock()
+
+        self._driver._prewarm_image('fake_context', 'fake_id')
+
+        self._driver._image_cache.get_cached_image.assert_called_with(
+            'fake_context', 'fake_id', None, None)
+        if disk_format == 'iso':
+            self.assertFalse(self._driver._image_cache.get_vmdk_image.called)
+        else:
+            self._driver._image_cache.get_vmdk_image.assert_called_once_with(
+                fake_image_path, None)
+        if base_vmx_created:
+            self._driver._create_base_vmx.assert_called_with('fake/path.vmdk',
+                                                             None)
+            self._driver._clone_pool.add_image.assert_called_once_with(
+                'fake/path.vmdk', None)
+        else:
+            self.assertFalse(self._driver._create_base_vmx.called)
+            self.assertFalse(self._driver._clone_pool.add_image.called)
+
+    def test_prewarm_image_cow(self):
+        self._test_prewarm_image(disk_format='vmdk', cow=True,
+                                 base_vmx_created=True)
+
+    def test_prewarm_image_cow_qcow2(self):
+        self._test_prewarm_image(disk_format='qcow2', cow=True,
+                                 base_vmx_created=True)
+
+    def test_prewarm_image_no_cow(self):
+        self._test_prewarm_image(disk_format='vmdk', cow=False,
+                                 base_vmx_created=False)
+
+    def test_prewarm_image_iso(self):
+        self._test_prewarm_image(disk_format='iso', cow=True,
+                                 base_vmx_created=False)
+
+    def test_prewarm_image_failure(self):
+        self._driver._image_cache.get_image_info.side_effect = Exception
+
+        self._driver._prewarm_image('fake_context', 'fake_id')
+
+        self.assertFalse(self._driver._image_cache.get_cached_image.called)
 
     def test_list_instances(self):
         self._driver.list_instances()
@@ -58,9 +165,78 @@ class VixDriverTestCase(unittest.TestCase):
         self._driver._conn.unregister_vm_and_delete_files.assert_called_with(
             fake_path, True)
 
-    @mock.patch('vix.vixutils.get_vmx_value')
-    @mock.patch('vix.vixutils.set_vmx_value')
-    def test_clone_vmdk_vm(self, mock_set_vmx_value, mock_get_vmx_value):
+    def test_destroy_instances(self):
+        fake_instances = [{'name': 'fake_name1', 'image_ref': 'fake_id'},
+                          {'name': 'fake_name2', 'image_ref': 'fake_id'}]
+        self._driver._pathutils.get_vmx_path.side_effect = (
+            lambda name: name + '.vmx')
+        self._driver._conn.vm_exists.side_effect = (
+            lambda path: path != 'fake_name2.vmx')
+
+        self._driver.destroy_instances(fake_instances)
+
+        self._driver._conn.unregister_vms_and_delete_files.assert_called_with(
+            ['fake_name1.vmx'], True)
+        self._driver._image_cache.remove_image_instance.assert_called_with(
+            'fake_id', 'fake_name2')
+
+    def test_capabilities(self):
+        self.assertTrue(self._driver.capabilities['has_imagecache'])
+        self.assertFalse(self._driver.capabilities['supports_recreate'])
+
+    @mock.patch('vix.vmx.invalidate')
+    def test_manage_image_cache(self, mock_invalidate):
+        fake_instances = [{'image_ref': 'fake_id1', 'name': 'fake_name1'},
+                          {'image_ref': 'fake_id2', 'name': 'fake_name2'}]
+        self._driver._base_vmx_paths.add('fake/path.vmx')
+        self._driver._clone_promoter.is_promoted.return_value = False
+
+        self._driver.manage_image_cache('fake_context', fake_instances)
+
+        self._driver._clone_promoter.promote_instances.assert_called_once_with(
+            fake_instances)
+        evict_unused_images = self._driver._image_cache.evict_unused_images
+        (image_ids, before_remove) = evict_unused_images.call_args[0]
+        self.assertEqual(image_ids, ['fake_id1', 'fake_id2'])
+        before_remove('fake/path.vmdk')
+        self.assertFalse(self._driver._conn.invalidate_vm.called)
+        before_remove('fake/path.vmx')
+        self._driver._conn.invalidate_vm.assert_called_with('fake/path.vmx')
+        mock_invalidate.assert_called_with('fake/path.vmx')
+        self.assertEqual(self._driver._base_vmx_paths, set())
+
+    def test_manage_image_cache_promoted_instances(self):
+        fake_instances = [{'image_ref': 'fake_id1', 'name': 'fake_name1'},
+                          {'image_ref': 'fake_id2', 'name': 'fake_name2'}]
+        self._driver._clone_promoter.is_promoted.side_effect = (
+            lambda instance_name: instance_name == 'fake_name1')
+
+        self._driver.manage_image_cache('fake_context', fake_instances)
+
+        evict_unused_images = self._driver._image_cache.evict_unused_images
+        self.assertEqual(evict_unused_images.call_args[0][0], ['fake_id2'])
+
+    def test_get_cached_images(self):
+        def fake_get_cached_image(context, image_id, user_id, project_id):
+            eventlet.sleep(0.1)
+            return 'fake/%s' % image_id
+
+        self._driver._image_cache.get_cached_image.side_effect = (
+            fake_get_cached_image)
+
+        start = time.time()
+        response = self._driver._get_cached_images(
+            'fake_context', ['id1', 'id2', 'id1', 'id3'], 'fake_user_id',
+            'fake_project_id')
+
+        self.assertLess(time.time() - start, 0.25)
+        self.assertEqual(response, {'id1': 'fake/id1', 'id2': 'fake/id2',
+                                    'id3': 'fake/id3'})
+        self.assertEqual(
+            self._driver._image_cache.get_cached_image.call_count, 3)
+
+    @mock.patch('vix.vmx.VmxFile.load')
+    def test_clone_vmdk_vm(self, mock_load):
         fake_src_vmdk = 'src/fake.vmdk'
         fake_file_name = 'fake.vmdk'
         fake_root_vmdk_path = 'root/fake.vmdk'
@@ -68,23 +244,168 @@ class VixDriverTestCase(unittest.TestCase):
         fake_vmdk_path = 'path/fake.vmdk'
         fake_split = mock.MagicMock()
         fake_base = mock.MagicMock()
+        fake_vmx_file = mock.MagicMock()
+        fake_vmsd_file = mock.MagicMock()
 
         os.path.basename = mock.MagicMock(return_value=fake_base)
         os.path.splitext = mock.MagicMock(return_value=fake_split)
         os.path.dirname = mock.MagicMock()
         os.path.join = mock.MagicMock(return_value=fake_vmdk_path)
-        mock_get_vmx_value.return_value = fake_file_name
+        mock_load.side_effect = [fake_vmx_file, fake_vmsd_file]
+        fake_vmx_file.get.return_value = fake_file_name
+        self._driver._pathutils.exists.return_value = False
 
         self._driver._clone_vmdk_vm(fake_src_vmdk, fake_root_vmdk_path,
-                                    fake_dest_vmx_path)
+                                    fake_dest_vmx_path, 'fake_guest_os')
 
-        self._driver._conn.create_vm.assert_called_once()
+        self.assertEqual(self._driver._conn.create_vm.call_count, 1)
+        self.assertEqual(
+            self._driver._conn.create_vm.call_args[1]['guest_os'],
+            'fake_guest_os')
         self._driver._conn.clone_vm.assert_called_with(
-            fake_split[0] + ".vmx", fake_dest_vmx_path, True)
+            fake_split[0] + ".vmx", fake_dest_vmx_path, True,
+            driver.BASE_VM_SNAPSHOT_NAME)
+        fake_clone = self._driver._conn.clone_vm.return_value
+        fake_clone.__exit__.assert_called_once_with(None, None, None)
         self._driver._pathutils.rename.assert_called_with(
             fake_vmdk_path, fake_root_vmdk_path)
-        mock_set_vmx_value.assert_called_with(fake_split[0] + ".vmsd",
-                                              "sentinel0", fake_base)
+        self.assertEqual(mock_load.call_args_list,
+                         [mock.call(fake_dest_vmx_path),
+                          mock.call(fake_split[0] + ".vmsd")])
+        fake_vmx_file.get.assert_called_once_with("scsi0:0.fileName")
+        fake_vmx_file.set.assert_called_once_with("scsi0:0.fileName",
+                                                  fake_base)
+        fake_vmx_file.save.assert_called_once_with()
+        fake_vmsd_file.set.assert_called_once_with("sentinel0", fake_base)
+        fake_vmsd_file.save.assert_called_once_with()
+
+    def _test_create_base_vmx(self, vmx_exists, snapshot_exists):
+        base.restore_original_funcs(self)
+        self._driver._pathutils.exists.return_value = vmx_exists
+        fake_vm = self._driver._conn.open_vm.return_value.__enter__()
+        fake_snapshot = mock.MagicMock()
+        fake_vm.get_named_snapshot.return_value = (
+            fake_snapshot if snapshot_exists else None)
+        fake_vm.create_snapshot.return_value = fake_snapshot
+
+        response = self._driver._create_base_vmx('_base/fake_id.vmdk',
+                                                 'fake_guest_os')
+
+        self.assertEqual(response, '_base/fake_id.vmx')
+        if vmx_exists:
+            self.assertFalse(self._driver._conn.create_vm.called)
+        else:
+            self._driver._conn.create_vm.assert_called_once_with(
+                vmx_path='_base/fake_id.vmx', display_name='fake_id',
+                guest_os='fake_guest_os', disk_paths=['_base/fake_id.vmdk'])
+        fake_vm.get_named_snapshot.assert_called_once_with(
+            driver.BASE_VM_SNAPSHOT_NAME)
+        if snapshot_exists:
+            self.assertFalse(fake_vm.create_snapshot.called)
+        else:
+            fake_vm.create_snapshot.assert_called_once_with(
+                name=driver.BASE_VM_SNAPSHOT_NAME)
+        fake_snapshot.close.assert_called_once_with()
+
+        # Later spawns find the base VM without locking or Vix calls
+        self._driver._conn.reset_mock()
+        with mock.patch('nova.utils.synchronized') as mock_synchronized:
+            response = self._driver._create_base_vmx('_base/fake_id.vmdk')
+
+        self.assertEqual(response, '_base/fake_id.vmx')
+        self.assertFalse(mock_synchronized.called)
+        self.assertFalse(self._driver._conn.open_vm.called)
+
+    def test_create_base_vmx(self):
+        self._test_create_base_vmx(False, False)
+
+    def test_create_base_vmx_existing(self):
+        self._test_create_base_vmx(True, True)
+
+    def test_create_base_vmx_without_snapshot(self):
+        self._test_create_base_vmx(True, False)
+
+    def _test_get_boot_template_vmx(self, snapshot_exists):
+        base.restore_original_funcs(self)
+        fake_vm = self._driver._conn.open_vm.return_value.__enter__()
+        self._driver._conn.vm_exists.return_value = snapshot_exists
+        if not snapshot_exists:
+            fake_vm.get_named_snapshot.return_value = None
+        self._driver._clone_vmdk_vm = mock.MagicMock()
+
+        response = self._driver._get_boot_template_vmx(
+            'base/fake_id.vmdk', 2, 1024, 1, {'guest_os': 'fake_os'})
+
+        self.assertEqual(response, 'base/fake_id-boot-2cpu-1024mb-1nic.vmx')
+        if snapshot_exists:
+            self.assertFalse(self._driver._clone_vmdk_vm.called)
+            fake_snapshot = fake_vm.get_named_snapshot.return_value
+            fake_snapshot.close.assert_called_once_with()
+        else:
+            self._driver._clone_vmdk_vm.assert_called_once_with(
+                'base/fake_id.vmdk', 'base/fake_id-boot-2cpu-1024mb-1nic.vmdk',
+                response, 'fake_os')
+            self._driver._conn.update_vm.assert_called_once_with(
+                vmx_path=response,
+                display_name='fake_id-boot-2cpu-1024mb-1nic',
+                num_vcpus=2, mem_size_mb=1024,
+                networks=[(vixutils.NETWORK_NAT, None)],
+                additional_config={
+                    'log.fileName': 'fake_id-boot-2cpu-1024mb-1nic.log'},
+                guest_os='fake_os')
+            fake_vm.power_on.assert_called_once_with(False)
+            fake_vm.wait_for_tools_in_guest.assert_called_once_with(
+                driver.CONF.vix.boot_template_timeout)
+            fake_vm.create_snapshot.assert_called_once_with(
+                include_memory=True, name=driver.INSTANT_BOOT_SNAPSHOT_NAME)
+            fake_vm.power_off.assert_called_once_with()
+
+    def test_get_boot_template_vmx(self):
+        self._test_get_boot_template_vmx(snapshot_exists=False)
+
+    def test_get_boot_template_vmx_existing(self):
+        self._test_get_boot_template_vmx(snapshot_exists=True)
+
+    def test_get_boot_template_vmx_failure(self):
+        base.restore_original_funcs(self)
+        fake_vm = self._driver._conn.open_vm.return_value.__enter__()
+        fake_vm.wait_for_tools_in_guest.side_effect = utils.VixException
+        self._driver._conn.vm_exists.side_effect = [False, True]
+        self._driver._clone_vmdk_vm = mock.MagicMock()
+        self._driver._delete_boot_template = mock.MagicMock()
+
+        self.assertRaises(utils.VixException,
+                          self._driver._get_boot_template_vmx,
+                          'base/fake_id.vmdk', 2, 1024, 1, {})
+
+        self.assertFalse(fake_vm.create_snapshot.called)
+        self._driver._delete_boot_template.assert_called_once_with(
+            'base/fake_id-boot-2cpu-1024mb-1nic')
+
+    def test_delete_boot_template(self):
+        base.restore_original_funcs(self)
+        base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, base_dir)
+        for file_name in ['fake_id.vmdk', 'fake_id.vmx',
+                          'fake_id-boot-1cpu-512mb-1nic.vmx',
+                          'fake_id-boot-1cpu-512mb-1nic.vmdk',
+                          'fake_id-boot-1cpu-512mb-1nic-Snapshot1.vmsn',
+                          'fake_id-boot-1cpu-512mb-10nic.vmx']:
+            open(os.path.join(base_dir, file_name), 'wb').close()
+        os.mkdir(os.path.join(base_dir,
+                              'fake_id-boot-1cpu-512mb-1nic.vmdk.lck'))
+        self._driver._pathutils = pathutils.PathUtils()
+        fake_vm = self._driver._conn.open_vm.return_value.__enter__()
+        fake_vm.get_power_state.return_value = (
+            vixlib.VIX_POWERSTATE_POWERED_ON)
+
+        self._driver._delete_boot_template(
+            os.path.join(base_dir, 'fake_id-boot-1cpu-512mb-1nic'))
+
+        fake_vm.power_off.assert_called_once_with()
+        self.assertEqual(sorted(os.listdir(base_dir)),
+                         ['fake_id-boot-1cpu-512mb-10nic.vmx',
+                          'fake_id.vmdk', 'fake_id.vmx'])
 
     @mock.patch('vix.vixutils.get_vix_host_type')
     def test_check_player_compatibility(self, mock_get_vix_host_type):
@@ -92,7 +413,7 @@ class VixDriverTestCase(unittest.TestCase):
         self.assertRaises(NotImplementedError,
                           self._driver._check_player_compatibility, True)
 
-    def _test_spawn(self, cow):
+    def _test_spawn(self, cow, pooled_clone=False, instant_boot=False):
 
         fake_admin_password = 'fake password'
         fake_instance = mock.MagicMock()
@@ -104,15 +425,24 @@ class VixDriverTestCase(unittest.TestCase):
         fake_image_info = mock.MagicMock()
         fake_iso_image_ids = ['fakeid']
         fake_b_path = 'fake/base/vmdk/path'
+        fake_vmdk_path = 'fake/base/converted/vmdk/path'
         fake_r_path = 'fake/root/vmdk/path'
         fake_vmx_path = 'fake/vmx/path'
         fake_floppy_path = 'fake/floppy/path'
 
-        self._driver._image_cache.get_image_info.return_value = fake_image_info
+        self._driver._image_cache.get_cached_image_info.return_value = (
+            fake_image_info)
         self._driver._check_player_compatibility = mock.MagicMock()
         self._driver._delete_existing_instance = mock.MagicMock()
         self._driver._clone_vmdk_vm = mock.MagicMock()
+        self._driver._create_base_vmx = mock.MagicMock()
+        self._driver._clone_pool.claim.return_value = pooled_clone
+        self._driver._is_instant_boot_image = mock.MagicMock(
+            return_value=instant_boot)
+        self._driver._get_boot_template_vmx = mock.MagicMock()
+        self._driver._clone_vm = mock.MagicMock()
         self._driver._image_cache.get_cached_image.return_value = fake_b_path
+        self._driver._image_cache.get_vmdk_image.return_value = fake_vmdk_path
         self._driver._pathutils.get_root_vmdk_path.return_value = fake_r_path
         self._driver._pathutils.get_vmx_path.return_value = fake_vmx_path
         self._driver._pathutils.get_floppy_path.return_value = fake_floppy_path
@@ -130,8 +460,10 @@ class VixDriverTestCase(unittest.TestCase):
                            block_device_info=fake_block_device_info)
         print fake_image_info.get().get.mock_calls
 
-        self._driver._image_cache.get_image_info.assert_called_with(
+        self._driver._image_cache.get_cached_image_info.assert_called_with(
             fake_context, fake_instance['image_ref'])
+        self._driver._image_cache.add_image_instance.assert_called_once_with(
+            fake_instance['image_ref'], fake_instance['name'])
 
         self._driver._check_player_compatibility.assert_called_with(cow)
         self._driver._delete_existing_instance.assert_called_with(
@@ -140,13 +472,41 @@ class VixDriverTestCase(unittest.TestCase):
             fake_instance['name'])
         self.assertEqual(self._driver._image_cache.get_cached_image.call_count,
                          3)
+        self._driver._image_cache.get_vmdk_image.assert_called_once_with(
+            fake_b_path, fake_image_info.get().get())
         self._driver._pathutils.get_root_vmdk_path.assert_called_with(
             fake_instance['name'])
         self._driver._pathutils.get_vmx_path.assert_called_with(
             fake_instance['name'])
         if cow:
-            self._driver._clone_vmdk_vm.assert_called_with(
-                fake_b_path, fake_r_path, fake_vmx_path)
+            self._driver._create_base_vmx.assert_called_once_with(
+                fake_vmdk_path, fake_image_info.get().get())
+        else:
+            self.assertFalse(self._driver._create_base_vmx.called)
+        if instant_boot:
+            self.assertFalse(self._driver._clone_pool.claim.called)
+            self.assertFalse(self._driver._clone_vmdk_vm.called)
+            self._driver._get_boot_template_vmx.assert_called_once_with(
+                fake_vmdk_path, fake_instance['vcpus'],
+                fake_instance['memory_mb'], 0,
+                {'guest_os': fake_image_info.get().get(),
+                 'iso_paths': [fake_b_path, fake_b_path],
+                 'floppy_path': fake_b_path,
+                 'boot_order': fake_image_info.get().get(),
+                 'nested_hypervisor': fake_image_info.get().get()})
+            self._driver._clone_vm.assert_called_once_with(
+                self._driver._get_boot_template_vmx.return_value,
+                fake_r_path, fake_vmx_path,
+                driver.INSTANT_BOOT_SNAPSHOT_NAME)
+        elif cow:
+            self._driver._clone_pool.claim.assert_called_once_with(
+                fake_vmdk_path, fake_instance['name'])
+            if pooled_clone:
+                self.assertFalse(self._driver._clone_vmdk_vm.called)
+            else:
+                self._driver._clone_vmdk_vm.assert_called_with(
+                    fake_vmdk_path, fake_r_path, fake_vmx_path,
+                    fake_image_info.get().get())
             self.assertEqual(self._driver._pathutils.copy.call_count, 1)
             self._driver._conn.update_vm.assert_called_with(
                 vmx_path=fake_vmx_path,
@@ -162,6 +522,8 @@ class VixDriverTestCase(unittest.TestCase):
                 vnc_port=9999, nested_hypervisor=fake_image_info.get().get())
         else:
             self.assertEqual(self._driver._pathutils.copy.call_count, 2)
+            self._driver._pathutils.copy.assert_any_call(fake_vmdk_path,
+                                                         fake_r_path)
             self._driver._conn.create_vm.assert_called_with(
                 vmx_path=fake_vmx_path,
                 display_name=fake_instance.get("display_name"),
@@ -183,13 +545,105 @@ class VixDriverTestCase(unittest.TestCase):
             fake_instance['name'])
         utils.get_free_port.assert_called_once()
         self._driver._conn.open_vm.assert_called_with(fake_vmx_path)
+        fake_vm = self._driver._conn.open_vm.return_value.__enter__()
+        fake_vm.power_on.assert_called_once_with(driver.CONF.vix.show_gui)
+        return fake_vm
 
     def test_spawn_cow(self):
-        self._test_spawn(cow=True)
+        fake_vm = self._test_spawn(cow=True)
+        self.assertFalse(fake_vm.create_snapshot.called)
+
+    @mock.patch('vix.vixutils.get_vix_host_type')
+    def test_spawn_baseline_snapshot(self, mock_get_vix_host_type):
+        mock_get_vix_host_type.return_value = vixutils.VIX_VMWARE_WORKSTATION
+        driver.CONF.set_override('spawn_baseline_snapshot', True, 'vix')
+        self.addCleanup(driver.CONF.clear_override,
+                        'spawn_baseline_snapshot', 'vix')
+
+        fake_vm = self._test_spawn(cow=True)
+
+        fake_vm.create_snapshot.assert_called_once_with(
+            name=driver.BASELINE_SNAPSHOT_NAME, description=mock.ANY)
+        fake_vm.create_snapshot.return_value.close.assert_called_once_with()
+
+    def test_spawn_cow_pooled_clone(self):
+        self._test_spawn(cow=True, pooled_clone=True)
+
+    def test_spawn_cow_instant_boot(self):
+        self._test_spawn(cow=True, instant_boot=True)
 
     def test_spawn_no_cow(self):
         self._test_spawn(cow=False)
 
+    def test_spawn_failure(self):
+        base.restore_original_funcs(self)
+        fake_instance = mock.MagicMock()
+        self._driver._image_cache.get_cached_image_info.return_value = {
+            'properties': {}}
+        self._driver._check_player_compatibility = mock.MagicMock()
+        self._driver._delete_existing_instance = mock.MagicMock()
+        self._driver._get_cached_images = mock.MagicMock(
+            side_effect=Exception)
+
+        self.assertRaises(Exception, self._driver.spawn, 'fake_context',
+                          fake_instance, None, [], 'fake_password', [])
+
+        self._driver._delete_existing_instance.assert_called_with(
+            fake_instance['name'])
+        self.assertFalse(self._driver._image_cache.add_image_instance.called)
+
+    def _fake_image_fetch(self, name, result):
+        self._active_fetches += 1
+        self._max_active_fetches = max(self._max_active_fetches,
+                                       self._active_fetches)
+        # The root image is the slowest one
+        eventlet.sleep(0.05 if name == 'root' else 0.01)
+        self._active_fetches -= 1
+        self._fetch_events.append(name)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _test_spawn_image_fetches(self, iso_image_ids, iso_result):
+        base.restore_original_funcs(self)
+        self._fetch_events = []
+        self._active_fetches = 0
+        self._max_active_fetches = 0
+        self._driver._image_cache.get_cached_image_info.return_value = {
+            'properties': {'vix_iso_images': ','.join(iso_image_ids),
+                           'cow': 'false'}}
+        self._driver._check_player_compatibility = mock.MagicMock()
+        self._driver._delete_existing_instance = mock.MagicMock(
+            side_effect=lambda name: self._fetch_events.append('deleted'))
+        self._driver._cache_root_image = mock.MagicMock(
+            side_effect=lambda *args: self._fake_image_fetch('root',
+                                                             'fake_root'))
+        self._driver._image_cache.get_cached_image.side_effect = (
+            lambda *args: self._fake_image_fetch('iso', iso_result))
+
+    def test_spawn_image_fetch_failure(self):
+        self._test_spawn_image_fetches(['fake_iso_id'], utils.VixException())
+
+        self.assertRaises(utils.VixException, self._driver.spawn,
+                          'fake_context', mock.MagicMock(), None, [], None, [])
+
+        # The instance is not deleted while the root image is being cached
+        self.assertEqual(self._fetch_events,
+                         ['deleted', 'iso', 'root', 'deleted'])
+
+    def test_spawn_image_fetch_workers(self):
+        driver.CONF.set_override('image_fetch_workers', 2, 'vix')
+        self.addCleanup(driver.CONF.clear_override, 'image_fetch_workers',
+                        'vix')
+        self._test_spawn_image_fetches(['fake_iso_id1', 'fake_iso_id2'],
+                                       utils.VixException())
+
+        self.assertRaises(utils.VixException, self._driver.spawn,
+                          'fake_context', mock.MagicMock(), None, [], None, [])
+
+        # The root image fetch counts towards the limit
+        self.assertEqual(self._max_active_fetches, 2)
+
     def _test_exec_vm_action(self, vm_exists):
         fake_instance = mock.MagicMock()
         fake_action = mock.MagicMock()
@@ -212,6 +666,67 @@ class VixDriverTestCase(unittest.TestCase):
     def test_exec_vm_action_vm_exists_true(self):
         self._test_exec_vm_action(True)
 
+    def test_find_snapshot_info(self):
+        child = vixutils.VixSnapshotInfo('child', '', 0, [])
+        tree = [vixutils.VixSnapshotInfo('root1', '', 0, []),
+                vixutils.VixSnapshotInfo('root2', '', 0, [child])]
+
+        self.assertEqual(self._driver._find_snapshot_info(tree, 'child'),
+                         child)
+        self.assertIsNone(self._driver._find_snapshot_info(tree, 'other'))
+
+    def _test_rebuild(self, snapshot_tree, image_id='fake_image_id',
+                      recreate=False):
+        fake_instance = mock.MagicMock()
+        fake_instance.__getitem__.side_effect = {'name': 'fake_name',
+                                                 'uuid': 'fake_uuid'}.get
+        fake_vm = self._driver._conn.open_vm.return_value.__enter__()
+        fake_vm.get_snapshot_tree.return_value = snapshot_tree
+        fake_vm.get_power_state.return_value = (
+            vixlib.VIX_POWERSTATE_POWERED_OFF)
+
+        self._fake_instance = fake_instance
+
+        self._driver.rebuild('fake_context', fake_instance,
+                             {'id': image_id}, [], 'fake_password', [],
+                             mock.MagicMock(), mock.MagicMock(),
+                             recreate=recreate)
+        return fake_vm
+
+    def test_rebuild(self):
+        baseline = vixutils.VixSnapshotInfo(driver.BASELINE_SNAPSHOT_NAME,
+                                            'fake_image_id', 0, [])
+        fake_vm = self._test_rebuild(
+            [vixutils.VixSnapshotInfo('fake_snapshot', '', 0, [baseline])])
+
+        fake_vm.get_named_snapshot.assert_called_once_with(
+            driver.BASELINE_SNAPSHOT_NAME)
+        fake_snapshot = fake_vm.get_named_snapshot.return_value.__enter__()
+        fake_vm.revert_to_snapshot.assert_called_once_with(
+            fake_snapshot, driver.CONF.vix.show_gui)
+        fake_vm.power_on.assert_called_once_with(driver.CONF.vix.show_gui)
+        self.assertEqual(self._fake_instance.task_state,
+                         task_states.REBUILD_SPAWNING)
+        self._fake_instance.save.assert_called_once_with(
+            expected_task_state=[task_states.REBUILDING])
+
+    def test_rebuild_no_baseline_snapshot(self):
+        self.assertRaises(NotImplementedError, self._test_rebuild,
+                          [vixutils.VixSnapshotInfo('fake_snapshot', '', 0,
+                                                    [])])
+        self.assertFalse(self._fake_instance.save.called)
+
+    def test_rebuild_other_image(self):
+        baseline = vixutils.VixSnapshotInfo(driver.BASELINE_SNAPSHOT_NAME,
+                                            'fake_image_id', 0, [])
+        self.assertRaises(NotImplementedError, self._test_rebuild,
+                          [baseline], image_id='other_image_id')
+
+    def test_rebuild_recreate(self):
+        self.assertRaises(NotImplementedError, self._test_rebuild, [],
+                          recreate=True)
+        self.assertFalse(self._driver._conn.open_vm.called)
+
     @mock.patch('vix.vixutils.VixVM.reboot')
     def test_reboot(self, mock_reboot):
         fake_instance = mock.MagicMock()
@@ -229,16 +744,25 @@ class VixDriverTestCase(unittest.TestCase):
         self._driver._delete_existing_instance.assert_called_with(
             fake_instance['name'], True)
 
-    @mock.patch('vix.vixutils.VixVM.get_power_state')
-    def test_get_info(self, mock_get_power_state):
+    def test_get_info(self):
         fake_instance = mock.MagicMock()
-
-        mock_get_power_state.return_value = vixlib.VIX_POWERSTATE_POWERED_ON
+        fake_vm = self._driver._conn.open_vm.return_value.__enter__()
+        fake_vm.get_properties.return_value = vixutils.VixVMProperties(
+            power_state=vixlib.VIX_POWERSTATE_POWERED_ON,
+            tools_state=None, is_running=None, num_vcpus=2,
+            mem_size_mb=512, guest_os=None, name=None, vmx_path=None)
 
         response = self._driver.get_info(fake_instance)
-        print response
-        mock_get_power_state.assert_called_once()
-        self.assertTrue(response is not None)
+
+        fake_vm.get_properties.assert_called_once_with(
+            [vixlib.VIX_PROPERTY_VM_POWER_STATE,
+             vixlib.VIX_PROPERTY_VM_MEMORY_SIZE,
+             vixlib.VIX_PROPERTY_VM_NUM_VCPUS])
+        self.assertEqual(response, {'state': power_state.RUNNING,
+                                    'max_mem': 512 * 1024,
+                                    'mem': 512 * 1024,
+                                    'num_cpu': 2,
+                                    'cpu_time': 0})
 
     def test_attach_volume(self):
         fake_instance = mock.MagicMock()
@@ -379,18 +903,22 @@ class VixDriverTestCase(unittest.TestCase):
     def test_get_host_stats_refresh_false(self):
         self._test_get_host_stats(False)
 
+    @mock.patch('vix.vmx.VmxFile.load')
     @mock.patch('vix.vixutils.VixVM.create_snapshot')
     @mock.patch('vix.vixutils.VixVM.remove_snapshot')
     @mock.patch('vix.vixutils.get_vix_host_type')
     def _test_snapshot(self, feature_supported, mock_get_vix_host_type,
-                       mock_remove_snapshot, mock_create_snapshot):
+                       mock_remove_snapshot, mock_create_snapshot, mock_load,
+                       current_vmdk_file_name='root.vmdk'):
+        base.restore_original_funcs(self)
         fake_name = 'fake name'
         fake_instance = mock.MagicMock()
         fake_context = mock.MagicMock()
         fake_update_task_state = mock.MagicMock()
-        fake_path = 'fake/path'
-        fake_r_path = 'fake/root/vmdk/path'
+        fake_path = 'fake/instance/fake.vmx'
+        fake_r_path = 'fake/instance/root.vmdk'
         fake_vm = mock.MagicMock()
+        mock_load.return_value.get.return_value = current_vmdk_file_name
         self._driver._conn.open_vm.return_value = fake_vm
         self._driver._pathutils.get_root_vmdk_path.return_value = fake_r_path
         self._driver._pathutils.get_vmx_path.return_value = fake_path
@@ -413,9 +941,10 @@ class VixDriverTestCase(unittest.TestCase):
             self.assertEqual(fake_update_task_state.call_count, 2)
             fake_vm.__enter__().create_snapshot.assert_called_with(
                 name="Nova snapshot")
-            self._driver._image_cache.save_glance_image.assert_called_with(
-                fake_context, fake_name, fake_r_path)
-            mock_remove_snapshot.assert_called_once()
+            mock_load.return_value.get.assert_called_once_with(
+                "scsi0:0.fileName")
+            fake_vm.__enter__().remove_snapshot.assert_called_once_with(
+                fake_vm.__enter__().create_snapshot().__enter__())
 
     def test_snapshot_not_implemented(self):
         self._test_snapshot(False)
@@ -423,6 +952,25 @@ class VixDriverTestCase(unittest.TestCase):
     def test_snapshot(self):
         self._test_snapshot(True)
 
+        self._driver._image_cache.save_glance_image.assert_called_with(
+            mock.ANY, 'fake name', 'fake/instance/root.vmdk')
+        self.assertFalse(self._driver._disk_manager.consolidate_disk.called)
+        self.assertFalse(self._driver._pathutils.remove.called)
+
+    def test_snapshot_baseline_snapshot(self):
+        self._driver._pathutils.exists.return_value = True
+
+        self._test_snapshot(True, current_vmdk_file_name='root-000001.vmdk')
+
+        # The uploaded disk includes the data written after the baseline
+        self._driver._disk_manager.consolidate_disk.assert_called_once_with(
+            'fake/instance/root-000001.vmdk',
+            'fake/instance/root-snapshot.vmdk')
+        self._driver._image_cache.save_glance_image.assert_called_with(
+            mock.ANY, 'fake name', 'fake/instance/root-snapshot.vmdk')
+        self._driver._pathutils.remove.assert_called_once_with(
+            'fake/instance/root-snapshot.vmdk')
+
     @mock.patch('vix.vixutils.VixVM.pause')
     def test_pause(self, mock_pause):
         fake_instance = mock.MagicMock()
@@ -15,18 +15,24 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
 import mock
 import os
+import shutil
+import tempfile
+import time
 import unittest
 import sys
 if sys.platform == 'win32':
     import _winreg
     import win32api
+from nova import exception
 from nova.image import glance
 from nova.openstack.common import excutils
-from nova.virt import images
 from vix.compute import image_cache
 from vix.compute import pathutils
+from vix import utils as vix_utils
+from vix.tests import base
 
 
 class VixUtilsTestCase(unittest.TestCase):
@@ -53,6 +59,53 @@ class VixUtilsTestCase(unittest.TestCase):
                                                            fake_image_id))
         fake_image_service.show.assert_called_with(fake_context, fake_image_id)
 
+    @mock.patch('time.time')
+    def test_get_image_info_cached(self, mock_time):
+        mock_time.return_value = 1000
+        self._image_cache._get_image_info = mock.MagicMock()
+
+        response = self._image_cache.get_image_info('fake_context', 'fake_id')
+        self.assertIs(self._image_cache.get_image_info('fake_context',
+                                                       'fake_id'), response)
+        self.assertEqual(self._image_cache._get_image_info.call_count, 1)
+
+        mock_time.return_value = 1000 + 300
+        self._image_cache.get_image_info('fake_context', 'fake_id')
+        self.assertEqual(self._image_cache._get_image_info.call_count, 2)
+
+        self._image_cache.invalidate_image_info('fake_id')
+        self._image_cache.get_image_info('fake_context', 'fake_id')
+        self.assertEqual(self._image_cache._get_image_info.call_count, 3)
+
+    @mock.patch('time.time')
+    def test_get_image_info_not_found(self, mock_time):
+        mock_time.return_value = 1000
+        self._image_cache._get_image_info = mock.MagicMock(
+            side_effect=exception.ImageNotFound(image_id='fake_id'))
+
+        for i in range(2):
+            self.assertRaises(exception.ImageNotFound,
+                              self._image_cache.get_image_info,
+                              'fake_context', 'fake_id')
+        self.assertEqual(self._image_cache._get_image_info.call_count, 1)
+
+        mock_time.return_value = 1000 + 30
+        self.assertRaises(exception.ImageNotFound,
+                          self._image_cache.get_image_info,
+                          'fake_context', 'fake_id')
+        self.assertEqual(self._image_cache._get_image_info.call_count, 2)
+
+    def test_get_image_info_cache_disabled(self):
+        image_cache.CONF.set_override('image_info_cache_ttl', 0, 'vix')
+        self.addCleanup(image_cache.CONF.clear_override,
+                        'image_info_cache_ttl', 'vix')
+        self._image_cache._get_image_info = mock.MagicMock()
+
+        self._image_cache.get_image_info('fake_context', 'fake_id')
+        self._image_cache.get_image_info('fake_context', 'fake_id')
+
+        self.assertEqual(self._image_cache._get_image_info.call_count, 2)
+
     def test_save_glance_image(self):
         fake_context = mock.MagicMock()
         fake_name = mock.MagicMock()
@@ -93,6 +146,8 @@ class VixUtilsTestCase(unittest.TestCase):
         self._image_cache.get_image_info.return_value = fake_image_info
         fake_image_info.get = mock.MagicMock()
         fake_image_info.get.return_value = fake_disk_format
+        self._image_cache._catalog = mock.MagicMock()
+        self._image_cache._catalog.get_image_path.return_value = None
 
         self._image_cache._pathutils.exists = mock.MagicMock()
         self._image_cache._pathutils.exists.return_value = image_exists
@@ -102,12 +157,10 @@ class VixUtilsTestCase(unittest.TestCase):
         os.path.join = mock.MagicMock()
         os.path.join.return_value = fake_image_path
 
-        images.fetch = mock.MagicMock()
+        self._image_cache._fetch_image = mock.MagicMock()
         if not image_exists:
             if exception:
-                excutils.save_and_reraise_exception = mock.MagicMock()
-                excutils.save_and_reraise_exception.side_effect = Exception
-                images.fetch.side_effect = Exception
+                self._image_cache._fetch_image.side_effect = Exception
                 self.assertRaises(Exception,
                                   self._image_cache.get_cached_image,
                                   fake_context, fake_image_id, fake_user_id,
@@ -117,9 +170,8 @@ class VixUtilsTestCase(unittest.TestCase):
                     fake_context, fake_image_id, fake_user_id, fake_project_id)
                 self.assertEqual(response, fake_image_path)
                 #It cannot go here unless it s a race - this fails
-            images.fetch.assert_called_with(fake_context, fake_image_id,
-                                            fake_image_path, fake_user_id,
-                                            fake_project_id)
+            self._image_cache._fetch_image.assert_called_with(
+                fake_context, fake_image_id, fake_image_path, fake_image_info)
         else:
             response = self._image_cache.get_cached_image(fake_context,
                                                           fake_image_id,
@@ -135,6 +187,58 @@ class VixUtilsTestCase(unittest.TestCase):
         self._image_cache._pathutils.get_base_vmdk_dir.assert_called_once()
         os.path.join.assert_called_with(fake_base_vmdk_dir,
                                         fake_image_id + "." + fake_disk_format)
+        if not exception:
+            self._image_cache._catalog.record_use.assert_called_with(
+                fake_image_id)
+            if not image_exists:
+                self._image_cache._catalog.record_fetch.assert_called_with(
+                    fake_image_id, fake_image_path, fake_image_info)
+
+    def test_get_cached_image_in_catalog(self):
+        fake_image_path = 'fake/path'
+        self._image_cache.get_image_info = mock.MagicMock()
+        self._image_cache._catalog = mock.MagicMock()
+        self._image_cache._catalog.get_image_path.return_value = (
+            fake_image_path)
+        self._image_cache._pathutils.exists = mock.MagicMock(
+            return_value=True)
+
+        response = self._image_cache.get_cached_image(
+            'fake_context', 'fake_id', 'fake_user_id', 'fake_project_id')
+
+        self.assertEqual(response, fake_image_path)
+        self.assertFalse(self._image_cache.get_image_info.called)
+        self.assertFalse(self._image_cache._catalog.record_fetch.called)
+        self._image_cache._catalog.record_use.assert_called_with('fake_id')
+
+    def _test_get_cached_image_info(self, image_exists):
+        fake_image_info = {'properties': {'cow': 'true'}}
+        self._image_cache.get_image_info = mock.MagicMock()
+        self._image_cache._catalog = mock.MagicMock()
+        self._image_cache._catalog.get.return_value = {
+            'image_info': fake_image_info}
+        self._image_cache._catalog.get_image_path.return_value = 'fake/path'
+        self._image_cache._pathutils.exists = mock.MagicMock(
+            return_value=image_exists)
+
+        response = self._image_cache.get_cached_image_info('fake_context',
+                                                           'fake_id')
+
+        self._image_cache._catalog.get.assert_called_once_with('fake_id')
+        if image_exists:
+            self.assertEqual(response, fake_image_info)
+            self.assertFalse(self._image_cache.get_image_info.called)
+        else:
+            self._image_cache.get_image_info.assert_called_once_with(
+                'fake_context', 'fake_id')
+            self.assertEqual(response,
+                             self._image_cache.get_image_info.return_value)
+
+    def test_get_cached_image_info(self):
+        self._test_get_cached_image_info(True)
+
+    def test_get_cached_image_info_evicted(self):
+        self._test_get_cached_image_info(False)
 
     def test_get_cached_image_existent(self):
         self._test_get_cached_image(True)
@@ -147,3 +251,287 @@ class VixUtilsTestCase(unittest.TestCase):
 
     def test_get_cached_image_not_existent_and_path_exists(self):
         self._test_get_cached_image(False, True, True)
+
+
+class ImageCacheFetchTestCase(base.TestCase):
+    """Unit tests for the image download"""
+
+    def setUp(self):
+        super(ImageCacheFetchTestCase, self).setUp()
+        self._base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._base_dir)
+        self._image_path = os.path.join(self._base_dir, 'fake_id.vmdk')
+
+        self._image_service = mock.MagicMock()
+        self._image_service.download.return_value = iter(['fake', 'data'])
+        patcher = mock.patch('nova.image.glance.get_remote_image_service',
+                             return_value=(self._image_service, 'fake_id'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self._image_cache = image_cache.ImageCache()
+
+    def test_fetch_image(self):
+        self._image_cache._fetch_image(
+            'fake_context', 'fake_id', self._image_path,
+            {'checksum': hashlib.md5('fakedata').hexdigest()})
+
+        self._image_service.download.assert_called_once_with('fake_context',
+                                                             'fake_id')
+        with open(self._image_path, 'rb') as f:
+            self.assertEqual(f.read(), 'fakedata')
+        self.assertEqual(os.listdir(self._base_dir), ['fake_id.vmdk'])
+
+    def test_fetch_image_no_checksum(self):
+        self._image_cache._fetch_image('fake_context', 'fake_id',
+                                       self._image_path, {})
+
+        self.assertEqual(os.listdir(self._base_dir), ['fake_id.vmdk'])
+
+    def test_fetch_image_checksum_mismatch(self):
+        self.assertRaises(exception.ImageUnacceptable,
+                          self._image_cache._fetch_image,
+                          'fake_context', 'fake_id', self._image_path,
+                          {'checksum': hashlib.md5('other').hexdigest()})
+
+        self.assertEqual(os.listdir(self._base_dir), [])
+
+    def test_fetch_image_download_failure(self):
+        def fake_download(context, image_id):
+            yield 'fake'
+            raise IOError()
+        self._image_service.download.side_effect = fake_download
+
+        self.assertRaises(IOError, self._image_cache._fetch_image,
+                          'fake_context', 'fake_id', self._image_path, {})
+
+        self.assertEqual(os.listdir(self._base_dir), [])
+
+    def _test_fetch_image_segmented(self, checksum):
+        image_cache.CONF.set_override('image_download_connections', 4, 'vix')
+        self.addCleanup(image_cache.CONF.clear_override,
+                        'image_download_connections', 'vix')
+        context = mock.MagicMock(auth_token='fake_token')
+
+        def fake_download(path):
+            with open(path, 'wb') as f:
+                f.write('fakedata')
+
+        with mock.patch('vix.compute.downloader.SegmentedDownloader') as \
+                mock_downloader_class, \
+                mock.patch('nova.image.glance.get_api_servers') as \
+                mock_get_api_servers:
+            mock_get_api_servers.return_value = iter([('fake_host', 9292,
+                                                      False)])
+            mock_downloader = mock_downloader_class.return_value
+            mock_downloader.download.side_effect = fake_download
+
+            self._image_cache._fetch_image(context, 'fake_id',
+                                           self._image_path,
+                                           {'checksum': checksum})
+
+        mock_downloader_class.assert_called_once_with(
+            'http://fake_host:9292/v1/images/fake_id',
+            headers={'X-Auth-Token': 'fake_token'}, max_connections=4,
+            segment_size=64 * 1024 * 1024)
+        mock_downloader.download.assert_called_once_with(
+            self._image_path + '.part')
+        self.assertFalse(self._image_service.download.called)
+
+    def test_fetch_image_segmented(self):
+        self._test_fetch_image_segmented(hashlib.md5('fakedata').hexdigest())
+        self.assertEqual(os.listdir(self._base_dir), ['fake_id.vmdk'])
+
+    def test_fetch_image_segmented_checksum_mismatch(self):
+        self.assertRaises(exception.ImageUnacceptable,
+                          self._test_fetch_image_segmented,
+                          hashlib.md5('other').hexdigest())
+        self.assertEqual(os.listdir(self._base_dir), [])
+
+
+class ImageCacheConversionTestCase(unittest.TestCase):
+    """Unit tests for the conversion of the cached images to VMDK"""
+
+    _save_and_reraise_exception = excutils.save_and_reraise_exception
+
+    def setUp(self):
+        patcher = mock.patch(
+            'nova.openstack.common.excutils.save_and_reraise_exception',
+            self._save_and_reraise_exception)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self._image_cache = image_cache.ImageCache()
+        self._image_cache._pathutils = mock.MagicMock()
+        self._image_cache._disk_manager = mock.MagicMock()
+
+    def test_get_vmdk_image(self):
+        self._image_cache._pathutils.exists.return_value = False
+
+        response = self._image_cache.get_vmdk_image('fake/id.QCOW2')
+
+        self.assertEqual(response, 'fake/id-monolithicSparse.vmdk')
+        self._image_cache._disk_manager.convert_disk.assert_called_once_with(
+            'fake/id.QCOW2', 'fake/id-monolithicSparse.vmdk.tmp', 'qcow2',
+            'vmdk', 'monolithicSparse')
+        self._image_cache._pathutils.rename.assert_called_once_with(
+            'fake/id-monolithicSparse.vmdk.tmp',
+            'fake/id-monolithicSparse.vmdk')
+
+    def test_get_vmdk_image_already_converted(self):
+        self._image_cache._pathutils.exists.return_value = True
+
+        response = self._image_cache.get_vmdk_image('fake/id.raw',
+                                                    'streamOptimized')
+
+        self.assertEqual(response, 'fake/id-streamOptimized.vmdk')
+        self.assertFalse(self._image_cache._disk_manager.convert_disk.called)
+
+    def test_get_vmdk_image_not_convertible(self):
+        for path in ['fake/id.vmdk', 'fake/id.iso']:
+            self.assertEqual(self._image_cache.get_vmdk_image(path), path)
+        self.assertFalse(self._image_cache._disk_manager.convert_disk.called)
+
+    def test_get_vmdk_image_invalid_subformat(self):
+        self.assertRaises(vix_utils.VixException,
+                          self._image_cache.get_vmdk_image, 'fake/id.raw',
+                          '../fake')
+
+    def test_get_vmdk_image_conversion_failure(self):
+        self._image_cache._pathutils.exists.side_effect = (
+            lambda path: path.endswith('.tmp'))
+        self._image_cache._disk_manager.convert_disk.side_effect = (
+            vix_utils.VixException)
+
+        self.assertRaises(vix_utils.VixException,
+                          self._image_cache.get_vmdk_image, 'fake/id.raw')
+
+        self._image_cache._pathutils.remove.assert_called_once_with(
+            'fake/id-monolithicSparse.vmdk.tmp')
+        self.assertFalse(self._image_cache._pathutils.rename.called)
+
+
+class ImageCacheEvictionTestCase(base.TestCase):
+    """Unit tests for the cached images eviction"""
+
+    def setUp(self):
+        super(ImageCacheEvictionTestCase, self).setUp()
+        self._tmpdir = tempfile.mkdtemp()
+        self._base_dir = os.path.join(self._tmpdir, '_base')
+        os.makedirs(self._base_dir)
+
+        self._image_cache = image_cache.ImageCache()
+        self._image_cache._pathutils.get_instances_dir = mock.MagicMock(
+            return_value=self._tmpdir)
+        self._image_cache._pathutils.get_base_vmdk_dir = mock.MagicMock(
+            return_value=self._base_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def _create_file(self, path, data='x' * 100, age=7200):
+        with open(path, 'wb') as f:
+            f.write(data)
+        t = time.time() - age
+        os.utime(path, (t, t))
+
+    def _create_base_file(self, file_name, age=7200):
+        self._create_file(os.path.join(self._base_dir, file_name), age=age)
+
+    def test_get_cached_images_info(self):
+        for file_name in ['id1.vmdk', 'id1.vmx', 'id1-000001.vmdk',
+                          'id2.iso']:
+            self._create_base_file(file_name)
+
+        response = dict([(i.image_id, i) for i in
+                         self._image_cache.get_cached_images_info()])
+
+        self.assertEqual(sorted(response.keys()), ['id1', 'id2'])
+        self.assertEqual(response['id1'].path,
+                         os.path.join(self._base_dir, 'id1.vmdk'))
+        self.assertEqual(len(response['id1'].files), 3)
+        self.assertEqual(response['id1'].size, 300)
+        self.assertEqual(response['id2'].path,
+                         os.path.join(self._base_dir, 'id2.iso'))
+
+    @mock.patch('vix.utils.get_disk_info')
+    def test_evict_unused_images(self, mock_get_disk_info):
+        mock_get_disk_info.return_value = (1000, 0)
+        image_cache.CONF.set_override('image_cache_low_watermark', 70, 'vix')
+        self.addCleanup(image_cache.CONF.clear_override,
+                        'image_cache_low_watermark', 'vix')
+
+        self._create_base_file('oldest.vmdk', age=9000)
+        self._create_base_file('oldest.vmx', age=9000)
+        self._create_base_file('old.vmdk', age=8000)
+        self._create_base_file('unneeded.vmdk', age=7200)
+        self._create_base_file('recent.vmdk', age=0)
+        self._create_base_file('in_use.vmdk', age=10000)
+        self._create_base_file('parent.vmdk', age=10000)
+        self._create_base_file('iso.iso', age=10000)
+        self._create_base_file('locked.vmdk', age=10000)
+        os.mkdir(os.path.join(self._base_dir, 'locked.vmdk.lck'))
+
+        instance_dir = os.path.join(self._tmpdir, 'instance1')
+        os.mkdir(instance_dir)
+        self._create_file(os.path.join(instance_dir, 'root.vmdk'),
+                          'parentFileNameHint="%s"' %
+                          os.path.join(self._base_dir, 'parent.vmdk'))
+        self._create_file(os.path.join(instance_dir, 'instance1.vmx'),
+                          'ide0:0.fileName = "%s"\n' %
+                          os.path.join(self._base_dir, 'iso.iso'))
+        before_remove = mock.MagicMock()
+
+        response = self._image_cache.evict_unused_images(['in_use'],
+                                                         before_remove)
+
+        self.assertEqual([i.image_id for i in response], ['oldest', 'old'])
+        self.assertEqual(before_remove.call_count, 3)
+        self.assertEqual(sorted(os.listdir(self._base_dir)),
+                         ['in_use.vmdk', 'iso.iso', 'locked.vmdk',
+                          'locked.vmdk.lck', 'parent.vmdk', 'recent.vmdk',
+                          'unneeded.vmdk'])
+
+    @mock.patch('vix.utils.get_disk_info')
+    def test_evict_unused_images_catalog(self, mock_get_disk_info):
+        mock_get_disk_info.return_value = (1000, 0)
+        self._create_base_file('used.vmdk', age=9000)
+        self._create_base_file('unused.vmdk', age=9000)
+        catalog = self._image_cache._catalog
+        for image_id in ['used', 'unused']:
+            catalog.record_fetch(image_id, os.path.join(
+                self._base_dir, image_id + '.vmdk'), {})
+        catalog.record_use('used')
+
+        response = self._image_cache.evict_unused_images()
+
+        self.assertEqual([i.image_id for i in response], ['unused'])
+        self.assertEqual(sorted(os.listdir(self._base_dir)),
+                         ['used.info', 'used.vmdk'])
+
+    @mock.patch('vix.utils.get_disk_info')
+    def test_evict_unused_images_below_watermark(self, mock_get_disk_info):
+        mock_get_disk_info.return_value = (1000, 100)
+        self._create_base_file('old.vmdk', age=9000)
+
+        response = self._image_cache.evict_unused_images()
+
+        self.assertEqual(response, [])
+        self.assertEqual(os.listdir(self._base_dir), ['old.vmdk'])
+
+    @mock.patch('vix.utils.get_disk_info')
+    def test_evict_unused_images_pooled_clones(self, mock_get_disk_info):
+        mock_get_disk_info.return_value = (1000, 0)
+        self._create_base_file('pooled.vmdk', age=9000)
+        self._create_base_file('unused.vmdk', age=9000)
+
+        slot_dir = os.path.join(self._tmpdir, '_pool', 'pooled', 'slot1')
+        os.makedirs(slot_dir)
+        self._create_file(os.path.join(slot_dir, 'root.vmdk'),
+                          'parentFileNameHint="%s"' %
+                          os.path.join(self._base_dir, 'pooled.vmdk'))
+
+        response = self._image_cache.evict_unused_images()
+
+        self.assertEqual([i.image_id for i in response], ['unused'])
+        self.assertEqual(os.listdir(self._base_dir), ['pooled.vmdk'])
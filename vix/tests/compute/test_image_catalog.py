@@ -0,0 +1,135 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import os
+import shutil
+import tempfile
+
+from vix.compute import image_catalog
+from vix.compute import pathutils
+from vix.tests import base
+
+
+class ImageCatalogTestCase(base.TestCase):
+    """Unit tests for the persistent image catalog"""
+
+    def setUp(self):
+        super(ImageCatalogTestCase, self).setUp()
+        self._base_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._base_dir)
+
+        self._pathutils = pathutils.PathUtils()
+        self._pathutils.get_base_vmdk_dir = mock.MagicMock(
+            return_value=self._base_dir)
+        self._catalog = image_catalog.ImageCatalog(self._pathutils)
+
+        self._image_path = os.path.join(self._base_dir, 'fake_id.vmdk')
+        with open(self._image_path, 'wb') as f:
+            f.write('x' * 100)
+
+    def _record_fetch(self):
+        self._catalog.record_fetch('fake_id', self._image_path,
+                                   {'disk_format': 'vmdk',
+                                    'checksum': 'fake_checksum',
+                                    'properties': {'vix_guestos': 'fake_os'},
+                                    'owner': 'fake_owner'})
+
+    def test_record_fetch(self):
+        self._record_fetch()
+
+        entry = self._catalog.get('fake_id')
+        self.assertEqual(entry['file_name'], 'fake_id.vmdk')
+        self.assertEqual(entry['file_size'], 100)
+        self.assertEqual(entry['image_info']['checksum'], 'fake_checksum')
+        self.assertNotIn('owner', entry['image_info'])
+        self.assertEqual(self._catalog.get_image_path('fake_id'),
+                         self._image_path)
+        self.assertEqual(sorted(os.listdir(self._base_dir)),
+                         ['fake_id.info', 'fake_id.vmdk'])
+
+    def test_get_missing(self):
+        self.assertIsNone(self._catalog.get('fake_id'))
+        self.assertIsNone(self._catalog.get_image_path('fake_id'))
+
+    def test_get_invalid(self):
+        with open(os.path.join(self._base_dir, 'fake_id.info'), 'wb') as f:
+            f.write('{')
+
+        self.assertIsNone(self._catalog.get('fake_id'))
+
+    def test_record_use_and_instances(self):
+        self._record_fetch()
+
+        self._catalog.record_use('fake_id')
+        self._catalog.record_use('fake_id')
+        self._catalog.add_instance('fake_id', 'instance1')
+        self._catalog.add_instance('fake_id', 'instance2')
+        self._catalog.add_instance('fake_id', 'instance1')
+        self._catalog.remove_instance('fake_id', 'instance2')
+
+        entry = self._catalog.get('fake_id')
+        self.assertEqual(entry['use_count'], 2)
+        self.assertIsNotNone(entry['last_used'])
+        self.assertEqual(entry['instances'], ['instance1'])
+        self.assertEqual(self._catalog.get_stats(),
+                         {'images': 1, 'size': 100, 'use_count': 2,
+                          'instances': 1})
+
+    def test_remove(self):
+        self._record_fetch()
+
+        self._catalog.remove('fake_id')
+
+        self.assertEqual(self._catalog.list(), [])
+        self.assertIsNone(self._catalog.get('fake_id'))
+
+
+class ImageUsageLogTestCase(base.TestCase):
+    """Unit tests for the image usage log"""
+
+    def setUp(self):
+        super(ImageUsageLogTestCase, self).setUp()
+        self._instances_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._instances_dir)
+
+        self._pathutils = pathutils.PathUtils()
+        self._pathutils.get_instances_dir = mock.MagicMock(
+            return_value=self._instances_dir)
+        self._usage_log = image_catalog.ImageUsageLog(self._pathutils)
+
+    @mock.patch('time.time')
+    def test_get_most_used(self, mock_time):
+        mock_time.return_value = 1000
+        self._usage_log.record('old_id', 500)
+        self._usage_log.record('old_id', 500)
+        self._usage_log.record('old_id', 500)
+        mock_time.return_value = 1400
+        for image_id in ['id1', 'id2', 'id2', 'id3', 'id2', 'id1']:
+            self._usage_log.record(image_id, 500)
+
+        mock_time.return_value = 1600
+        self.assertEqual(self._usage_log.get_most_used(2, 500),
+                         ['id2', 'id1'])
+        self.assertEqual(self._usage_log.get_most_used(5, 500),
+                         ['id2', 'id1', 'id3'])
+
+        # Spawns older than the window are dropped from the log
+        self._usage_log.record('id1', 500)
+        self._usage_log.record('id1', 500)
+        self.assertEqual(self._usage_log.get_most_used(5, 5000),
+                         ['id1', 'id2', 'id3'])
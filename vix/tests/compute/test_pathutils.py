@@ -0,0 +1,61 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import unittest
+
+from vix.compute import pathutils
+from vix import copyutils
+
+
+class PathUtilsTestCase(unittest.TestCase):
+    """Unit tests for the PathUtils class"""
+
+    def setUp(self):
+        self._pathutils = pathutils.PathUtils()
+
+    @mock.patch('sys.platform', 'linux2')
+    @mock.patch('os.path.getsize')
+    @mock.patch('eventlet.tpool.execute')
+    def test_copy(self, mock_execute, mock_getsize):
+        mock_execute.return_value = copyutils.STRATEGY_REFLINK
+        mock_getsize.return_value = 1024
+        fake_progress_callback = mock.MagicMock()
+
+        self._pathutils.copy('fake/src', 'fake/dest', fake_progress_callback)
+
+        mock_execute.assert_called_once_with(copyutils.copy_file, 'fake/src',
+                                             'fake/dest',
+                                             fake_progress_callback)
+
+    @mock.patch('sys.platform', 'linux2')
+    @mock.patch('eventlet.tpool.execute')
+    def test_copy_failure(self, mock_execute):
+        mock_execute.side_effect = OSError()
+
+        self.assertRaises(IOError, self._pathutils.copy, 'fake/src',
+                          'fake/dest')
+
+    @mock.patch('sys.platform', 'win32')
+    @mock.patch('nova.utils.execute')
+    def test_copy_win32(self, mock_execute):
+        mock_execute.return_value = ('', 0)
+
+        self._pathutils.copy('fake/src', 'fake/dest')
+
+        mock_execute.assert_called_once_with('cmd.exe', '/C', 'copy', '/Y',
+                                             'fake/src', 'fake/dest')
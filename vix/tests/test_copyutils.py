@@ -0,0 +1,161 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import mock
+import os
+import shutil
+import tempfile
+
+from vix import copyutils
+from vix.tests import base
+
+_CHUNK = 1024 * 1024
+
+
+class CopyUtilsTestCase(base.TestCase):
+    """Unit tests for the in-process file copies"""
+
+    def setUp(self):
+        super(CopyUtilsTestCase, self).setUp()
+        for name in ['_unsupported', '_stats']:
+            patcher = mock.patch.object(copyutils, name,
+                                        type(getattr(copyutils, name))())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self._tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tmpdir)
+        self._src = os.path.join(self._tmpdir, 'src.vmdk')
+        self._dest = os.path.join(self._tmpdir, 'dest.vmdk')
+
+        # Data, 2 MB of zeros, a 2 MB hole and data again
+        self._data = ('a' * _CHUNK + '\0' * 4 * _CHUNK + 'b' * 100)
+        with open(self._src, 'wb') as f:
+            f.write(self._data[:3 * _CHUNK])
+            f.seek(5 * _CHUNK)
+            f.write(self._data[5 * _CHUNK:])
+
+    def _read_dest(self):
+        with open(self._dest, 'rb') as f:
+            return f.read()
+
+    def _fail(self, err):
+        def fake_copy(src_fd, dest_fd, size, progress, chunk_size):
+            os.write(dest_fd, 'partial')
+            raise OSError(err, os.strerror(err))
+        return fake_copy
+
+    def _test_copy_file(self, strategies, expected_strategy):
+        with mock.patch.object(copyutils, '_STRATEGIES', strategies + [
+                (copyutils.STRATEGY_SPARSE_COPY, copyutils._sparse_copy)]):
+            response = copyutils.copy_file(self._src, self._dest)
+
+        self.assertEqual(response, expected_strategy)
+        self.assertEqual(self._read_dest(), self._data)
+        stats = copyutils.get_copy_stats()[expected_strategy]
+        self.assertEqual(stats['bytes'] + stats['skipped_bytes'],
+                         stats['count'] * len(self._data))
+        return stats
+
+    def test_copy_file(self):
+        response = copyutils.copy_file(self._src, self._dest)
+
+        self.assertIn(response, [copyutils.STRATEGY_REFLINK,
+                                 copyutils.STRATEGY_COPY_FILE_RANGE,
+                                 copyutils.STRATEGY_SPARSE_COPY])
+        self.assertEqual(self._read_dest(), self._data)
+
+    def test_copy_file_reflink(self):
+        self._test_copy_file(
+            [(copyutils.STRATEGY_REFLINK, copyutils._copy_file_range),
+             (copyutils.STRATEGY_COPY_FILE_RANGE, self._fail(errno.EIO))],
+            copyutils.STRATEGY_REFLINK)
+
+    def test_copy_file_range(self):
+        stats = self._test_copy_file(
+            [(copyutils.STRATEGY_REFLINK, self._fail(errno.EOPNOTSUPP)),
+             (copyutils.STRATEGY_COPY_FILE_RANGE,
+              copyutils._copy_file_range)],
+            copyutils.STRATEGY_COPY_FILE_RANGE)
+
+        self.assertEqual(stats['skipped_bytes'], 2 * _CHUNK)
+        self.assertLess(os.stat(self._dest).st_blocks * 512, 4 * _CHUNK)
+
+    def test_copy_file_sendfile(self):
+        stats = self._test_copy_file(
+            [(copyutils.STRATEGY_COPY_FILE_RANGE, self._fail(errno.EXDEV)),
+             (copyutils.STRATEGY_SENDFILE, copyutils._sendfile)],
+            copyutils.STRATEGY_SENDFILE)
+
+        self.assertEqual(stats['skipped_bytes'], 2 * _CHUNK)
+
+    @mock.patch.object(copyutils, '_CHUNK_SIZE', _CHUNK)
+    def test_copy_file_sparse(self):
+        stats = self._test_copy_file(
+            [(copyutils.STRATEGY_REFLINK, self._fail(errno.EOPNOTSUPP)),
+             (copyutils.STRATEGY_COPY_FILE_RANGE, self._fail(errno.EXDEV))],
+            copyutils.STRATEGY_SPARSE_COPY)
+
+        # The zeros in the data regions are skipped as well
+        self.assertEqual(stats['skipped_bytes'], 4 * _CHUNK)
+        self.assertLess(os.stat(self._dest).st_blocks * 512, 2 * _CHUNK)
+
+    def test_copy_file_remembers_unsupported_strategies(self):
+        reflink = mock.MagicMock(side_effect=self._fail(errno.EOPNOTSUPP))
+        for i in range(2):
+            self._test_copy_file(
+                [(copyutils.STRATEGY_REFLINK, reflink),
+                 (copyutils.STRATEGY_COPY_FILE_RANGE,
+                  copyutils._copy_file_range)],
+                copyutils.STRATEGY_COPY_FILE_RANGE)
+
+        self.assertEqual(reflink.call_count, 1)
+        self.assertEqual(copyutils.get_copy_stats()[
+            copyutils.STRATEGY_COPY_FILE_RANGE]['count'], 2)
+
+    @mock.patch.object(copyutils, '_PROGRESS_INTERVAL', _CHUNK)
+    @mock.patch.object(copyutils, '_CHUNK_SIZE', _CHUNK // 2)
+    def test_copy_file_progress(self):
+        progress_callback = mock.MagicMock()
+
+        with mock.patch.object(copyutils, '_STRATEGIES', [
+                (copyutils.STRATEGY_SPARSE_COPY, copyutils._sparse_copy)]):
+            copyutils.copy_file(self._src, self._dest, progress_callback)
+
+        reports = [args for (args, kwargs)
+                   in progress_callback.call_args_list]
+        self.assertEqual([done for (done, total, bps) in reports],
+                         [_CHUNK, 2 * _CHUNK, 3 * _CHUNK,
+                          5 * _CHUNK + 100])
+        self.assertEqual(set([total for (done, total, bps) in reports]),
+                         set([len(self._data)]))
+        self.assertTrue(reports[-1][2] > 0)
+
+    def test_get_data_extents(self):
+        with open(self._src, 'rb') as f:
+            extents = list(copyutils._get_data_extents(f.fileno(),
+                                                       len(self._data)))
+
+        self.assertEqual(extents, [(0, 3 * _CHUNK), (5 * _CHUNK, 100)])
+
+    def test_copy_file_error(self):
+        with mock.patch.object(copyutils, '_STRATEGIES', [
+                (copyutils.STRATEGY_REFLINK, self._fail(errno.EIO))]):
+            self.assertRaises(OSError, copyutils.copy_file, self._src,
+                              self._dest)
+        self.assertEqual(copyutils.get_copy_stats(), {})
@@ -17,9 +17,11 @@
 
 import mock
 import os
+import shutil
 import unittest
 import subprocess
 import sys
+import tempfile
 
 if sys.platform == 'win32':
     import _winreg
@@ -28,6 +30,7 @@ if sys.platform == 'win32':
 from vix import disk_manager
 from vix import vixutils
 from vix import utils
+from vix.tests import base
 
 
 class DiskManagerTestCase(unittest.TestCase):
@@ -268,3 +271,108 @@ class DiskManagerTestCase(unittest.TestCase):
 
     def test_resize_disku(self):
         self._test_resize_disk()
+
+    def _test_convert_disk(self, subformat):
+        self._disk_manager._exec_cmd = mock.MagicMock()
+
+        self._disk_manager.convert_disk("src_path", "dest_path",
+                                        disk_manager.DISK_TYPE_QCOW2,
+                                        disk_manager.DISK_TYPE_VMDK,
+                                        subformat)
+
+        fake_args = ["qemu-img", "convert", "-f", "qcow2", "-O", "vmdk"]
+        if subformat:
+            fake_args += ["-o", "subformat=%s" % subformat]
+        fake_args += ["src_path", "dest_path"]
+        self._disk_manager._exec_cmd.assert_called_once_with(fake_args)
+
+    def test_convert_disk(self):
+        self._test_convert_disk(None)
+
+    def test_convert_disk_with_subformat(self):
+        self._test_convert_disk(
+            disk_manager.VMDK_SUBFORMAT_MONOLITHIC_SPARSE)
+
+    def _patch_os(self):
+        base.restore_original_funcs(self)
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        return tmpdir
+
+    def _write_file(self, path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def test_get_parent_disk_path(self):
+        tmpdir = self._patch_os()
+        fake_disk_path = os.path.join(tmpdir, 'root.vmdk')
+        self._write_file(fake_disk_path, 'KDMV\0\0# Disk DescriptorFile\n'
+                         'parentFileNameHint="../_base/fake_id.vmdk"\n')
+
+        response = self._disk_manager.get_parent_disk_path(fake_disk_path)
+
+        self.assertEqual(response,
+                         os.path.join(tmpdir, '../_base/fake_id.vmdk'))
+
+    def test_get_parent_disk_path_standalone(self):
+        tmpdir = self._patch_os()
+        fake_disk_path = os.path.join(tmpdir, 'root.vmdk')
+        self._write_file(fake_disk_path, '# Disk DescriptorFile\n')
+
+        response = self._disk_manager.get_parent_disk_path(fake_disk_path)
+
+        self.assertIsNone(response)
+
+    def test_consolidate_disk_vdisk_man(self):
+        fake_vdisk_man = "disk_path_man"
+        self._disk_manager._get_vdisk_man_path = mock.MagicMock(
+            return_value=fake_vdisk_man)
+        self._disk_manager._exec_cmd = mock.MagicMock()
+
+        self._disk_manager._consolidate_disk_vdisk_man("src_path",
+                                                       "dest_path")
+
+        self._disk_manager._exec_cmd.assert_called_once_with(
+            [fake_vdisk_man, "-r", "src_path", "-t", "0", "dest_path"])
+
+    def _test_consolidate_disk(self, vdisk_man_exists):
+        self._disk_manager._check_vdisk_man_exists = mock.MagicMock(
+            return_value=vdisk_man_exists)
+        self._disk_manager._consolidate_disk_vdisk_man = mock.MagicMock()
+        self._disk_manager.convert_disk = mock.MagicMock()
+        self._disk_manager._copy_content_id = mock.MagicMock()
+
+        self._disk_manager.consolidate_disk("src_path", "dest_path")
+
+        if vdisk_man_exists:
+            self._disk_manager._consolidate_disk_vdisk_man.assert_called_with(
+                "src_path", "dest_path")
+            self.assertFalse(self._disk_manager.convert_disk.called)
+        else:
+            self._disk_manager.convert_disk.assert_called_once_with(
+                "src_path", "dest_path", disk_manager.DISK_TYPE_VMDK,
+                disk_manager.DISK_TYPE_VMDK,
+                disk_manager.VMDK_SUBFORMAT_MONOLITHIC_SPARSE)
+        self._disk_manager._copy_content_id.assert_called_once_with(
+            "src_path", "dest_path")
+
+    def test_consolidate_disk_vdisk_man_exists(self):
+        self._test_consolidate_disk(True)
+
+    def test_consolidate_disk_qemu(self):
+        self._test_consolidate_disk(False)
+
+    def test_copy_content_id(self):
+        tmpdir = self._patch_os()
+        fake_src_path = os.path.join(tmpdir, 'src.vmdk')
+        fake_dest_path = os.path.join(tmpdir, 'dest.vmdk')
+        self._write_file(fake_src_path, 'CID=0123abcd\nparentCID=ffffffff\n')
+        self._write_file(fake_dest_path,
+                         'KDMV\nCID=fffffffe\nparentCID=ffffffff\ndata')
+
+        self._disk_manager._copy_content_id(fake_src_path, fake_dest_path)
+
+        with open(fake_dest_path, 'rb') as f:
+            self.assertEqual(f.read(),
+                             'KDMV\nCID=0123abcd\nparentCID=ffffffff\ndata')
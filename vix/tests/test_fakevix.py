@@ -0,0 +1,207 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import ctypes
+import os
+import shutil
+import tempfile
+import unittest
+
+from vix import fakevix
+from vix import vixlib
+
+
+class FakeVixLibraryTestCase(unittest.TestCase):
+    """Unit tests for the fake Vix backend"""
+
+    def setUp(self):
+        self._lib = fakevix.FakeVixLibrary()
+        self._tmpdir = tempfile.mkdtemp()
+        self._vmx_path = os.path.join(self._tmpdir, 'vm', 'vm.vmx')
+        os.mkdir(os.path.dirname(self._vmx_path))
+        with open(self._vmx_path, 'wb') as f:
+            f.write('displayName = "vm"\nmemsize = "512"\n'
+                    'numvcpus = "2"\nscsi0:0.fileName = "vm.vmdk"\n')
+        self._host_handle = self._wait_handle(
+            self._lib.VixHost_Connect(
+                vixlib.VIX_API_VERSION,
+                vixlib.VIX_SERVICEPROVIDER_VMWARE_WORKSTATION,
+                None, 0, None, None, 0, vixlib.VIX_INVALID_HANDLE,
+                None, None))
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def _wait_handle(self, job_handle):
+        handle = vixlib.VixHandle()
+        err = self._lib.VixJob_Wait(job_handle,
+                                    vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE,
+                                    ctypes.byref(handle),
+                                    vixlib.VIX_PROPERTY_NONE)
+        self._lib.Vix_ReleaseHandle(job_handle)
+        self.assertEqual(err, vixlib.VIX_OK)
+        return handle.value
+
+    def _wait(self, job_handle):
+        err = self._lib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
+        self._lib.Vix_ReleaseHandle(job_handle)
+        return err
+
+    def _open_vm(self, vmx_path=None):
+        return self._wait_handle(self._lib.VixVM_Open(
+            self._host_handle, vmx_path or self._vmx_path, None, None))
+
+    def _get_power_state(self, vm_handle):
+        power_state = vixlib.VixPowerState()
+        err = self._lib.Vix_GetProperties(
+            vm_handle, vixlib.VIX_PROPERTY_VM_POWER_STATE,
+            ctypes.byref(power_state), vixlib.VIX_PROPERTY_NONE)
+        self.assertEqual(err, vixlib.VIX_OK)
+        return power_state.value
+
+    def test_open_vm_not_found(self):
+        job_handle = self._lib.VixVM_Open(self._host_handle,
+                                          os.path.join(self._tmpdir, 'x.vmx'),
+                                          None, None)
+        self.assertEqual(self._wait(job_handle), vixlib.VIX_E_FILE_NOT_FOUND)
+
+    def test_get_properties(self):
+        vm_handle = self._open_vm()
+        mem_size = ctypes.c_int()
+        num_vcpus = ctypes.c_int()
+        vmx_path = ctypes.c_char_p()
+
+        err = self._lib.Vix_GetProperties(
+            vm_handle, vixlib.VIX_PROPERTY_VM_MEMORY_SIZE,
+            ctypes.byref(mem_size), vixlib.VIX_PROPERTY_VM_NUM_VCPUS,
+            ctypes.byref(num_vcpus), vixlib.VIX_PROPERTY_VM_VMX_PATHNAME,
+            ctypes.byref(vmx_path), vixlib.VIX_PROPERTY_NONE)
+
+        self.assertEqual(err, vixlib.VIX_OK)
+        self.assertEqual(mem_size.value, 512)
+        self.assertEqual(num_vcpus.value, 2)
+        self.assertEqual(vmx_path.value, self._vmx_path)
+
+    def test_power_on_off(self):
+        vm_handle = self._open_vm()
+
+        self.assertEqual(self._wait(self._lib.VixVM_PowerOn(
+            vm_handle, 0, vixlib.VIX_INVALID_HANDLE, None, None)),
+            vixlib.VIX_OK)
+        self.assertEqual(self._get_power_state(self._open_vm()),
+                         vixlib.VIX_POWERSTATE_POWERED_ON)
+
+        self.assertEqual(self._wait(self._lib.VixVM_PowerOff(
+            vm_handle, 0, None, None)), vixlib.VIX_OK)
+        self.assertEqual(self._get_power_state(vm_handle),
+                         vixlib.VIX_POWERSTATE_POWERED_OFF)
+
+    def test_suspend_not_running(self):
+        vm_handle = self._open_vm()
+        self.assertEqual(self._wait(self._lib.VixVM_Suspend(
+            vm_handle, 0, None, None)), vixlib.VIX_E_VM_NOT_RUNNING)
+
+    def test_inject_failure(self):
+        vm_handle = self._open_vm()
+        self._lib.inject_failure('VixVM_PowerOn', vixlib.VIX_E_FAIL)
+
+        self.assertEqual(self._wait(self._lib.VixVM_PowerOn(
+            vm_handle, 0, vixlib.VIX_INVALID_HANDLE, None, None)),
+            vixlib.VIX_E_FAIL)
+        self.assertEqual(self._wait(self._lib.VixVM_PowerOn(
+            vm_handle, 0, vixlib.VIX_INVALID_HANDLE, None, None)),
+            vixlib.VIX_OK)
+
+    def test_job_latency(self):
+        self._lib.set_latency('VixVM_PowerOn', 60)
+        vm_handle = self._open_vm()
+        job_handle = self._lib.VixVM_PowerOn(
+            vm_handle, 0, vixlib.VIX_INVALID_HANDLE, None, None)
+
+        completed = ctypes.c_byte()
+        err = self._lib.VixJob_CheckCompletion(job_handle,
+                                               ctypes.byref(completed))
+
+        self.assertEqual(err, vixlib.VIX_OK)
+        self.assertFalse(completed.value)
+
+    def test_find_running_vms(self):
+        vm_handle = self._open_vm()
+        self._wait(self._lib.VixVM_PowerOn(
+            vm_handle, 0, vixlib.VIX_INVALID_HANDLE, None, None))
+        found = []
+
+        def callback(job_handle, event_type, more_event_info, client_data):
+            if event_type == vixlib.VIX_EVENTTYPE_FIND_ITEM:
+                location = ctypes.c_char_p()
+                self._lib.Vix_GetProperties(
+                    more_event_info, vixlib.VIX_PROPERTY_FOUND_ITEM_LOCATION,
+                    ctypes.byref(location), vixlib.VIX_PROPERTY_NONE)
+                found.append(location.value)
+
+        self.assertEqual(self._wait(self._lib.VixHost_FindItems(
+            self._host_handle, vixlib.VIX_FIND_RUNNING_VMS,
+            vixlib.VIX_INVALID_HANDLE, -1, callback, None)), vixlib.VIX_OK)
+        self.assertEqual(found, [self._vmx_path])
+
+    def test_linked_clone(self):
+        vm_handle = self._open_vm()
+        dest_path = os.path.join(self._tmpdir, 'clone', 'clone.vmx')
+
+        clone_handle = self._wait_handle(self._lib.VixVM_Clone(
+            vm_handle, vixlib.VIX_INVALID_HANDLE, vixlib.VIX_CLONETYPE_LINKED,
+            dest_path, 0, vixlib.VIX_INVALID_HANDLE, None, None))
+
+        self.assertTrue(clone_handle)
+        disk_path = os.path.join(self._tmpdir, 'clone', 'clone-cl1.vmdk')
+        with open(disk_path, 'rb') as f:
+            self.assertIn('parentFileNameHint', f.read())
+        with open(dest_path, 'rb') as f:
+            self.assertIn('scsi0:0.fileName = "clone-cl1.vmdk"', f.read())
+
+    def test_snapshot_tree(self):
+        vm_handle = self._open_vm()
+        root_handle = self._wait_handle(self._lib.VixVM_CreateSnapshot(
+            vm_handle, 'root', '', 0, vixlib.VIX_INVALID_HANDLE, None, None))
+        self._wait_handle(self._lib.VixVM_CreateSnapshot(
+            vm_handle, 'child', '', 0, vixlib.VIX_INVALID_HANDLE, None, None))
+
+        num_roots = ctypes.c_int()
+        self._lib.VixVM_GetNumRootSnapshots(vm_handle,
+                                            ctypes.byref(num_roots))
+        child_handle = vixlib.VixHandle()
+        err = self._lib.VixSnapshot_GetChild(root_handle, 0,
+                                             ctypes.byref(child_handle))
+        name = ctypes.c_char_p()
+        self._lib.Vix_GetProperties(
+            child_handle, vixlib.VIX_PROPERTY_SNAPSHOT_DISPLAYNAME,
+            ctypes.byref(name), vixlib.VIX_PROPERTY_NONE)
+
+        self.assertEqual(num_roots.value, 1)
+        self.assertEqual(err, vixlib.VIX_OK)
+        self.assertEqual(name.value, 'child')
+
+    def test_release_handle(self):
+        handles_count = self._lib.get_open_handles_count()
+        vm_handle = self._open_vm()
+        self._lib.Vix_AddRefHandle(vm_handle)
+
+        self._lib.Vix_ReleaseHandle(vm_handle)
+        self.assertEqual(self._lib.get_open_handles_count(),
+                         handles_count + 1)
+        self._lib.Vix_ReleaseHandle(vm_handle)
+        self.assertEqual(self._lib.get_open_handles_count(), handles_count)
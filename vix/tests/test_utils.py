@@ -0,0 +1,67 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+from vix import utils
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    """Unit tests for the LRU cache"""
+
+    def setUp(self):
+        self._cache = utils.LRUCache(2)
+
+    def test_get_missing(self):
+        self.assertIsNone(self._cache.get('fake_key'))
+        self.assertEqual(self._cache.get('fake_key', 1), 1)
+
+    def test_put_evicts_least_recently_used(self):
+        self.assertEqual(self._cache.put('key1', 1), [])
+        self.assertEqual(self._cache.put('key2', 2), [])
+        self._cache.get('key1')
+
+        response = self._cache.put('key3', 3)
+
+        self.assertEqual(response, [2])
+        self.assertIsNone(self._cache.get('key2'))
+        self.assertEqual(self._cache.get('key1'), 1)
+        self.assertEqual(self._cache.get('key3'), 3)
+
+    def test_put_replaces_value(self):
+        self._cache.put('key1', 1)
+
+        response = self._cache.put('key1', 2)
+
+        self.assertEqual(response, [1])
+        self.assertEqual(len(self._cache), 1)
+        self.assertEqual(self._cache.get('key1'), 2)
+
+    def test_pop(self):
+        self._cache.put('key1', 1)
+
+        self.assertEqual(self._cache.pop('key1'), 1)
+        self.assertIsNone(self._cache.pop('key1'))
+
+    def test_clear(self):
+        self._cache.put('key1', 1)
+        self._cache.put('key2', 2)
+
+        response = self._cache.clear()
+
+        self.assertEqual(sorted(response), [1, 2])
+        self.assertEqual(len(self._cache), 0)
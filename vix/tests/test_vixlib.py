@@ -0,0 +1,87 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import unittest
+
+from vix import vixlib
+
+
+class VixLibTestCase(unittest.TestCase):
+    """Unit tests for the Vix library loading"""
+
+    def setUp(self):
+        self._vixpath = vixlib.vixpath
+        self._backend = vixlib._backend
+        vixlib._backend = None
+
+    def tearDown(self):
+        vixlib.vixpath = self._vixpath
+        vixlib._backend = self._backend
+
+    @mock.patch('ctypes.CDLL')
+    def test_function_bound_on_first_call(self, mock_cdll):
+        fake_lib = mock_cdll.return_value
+
+        response = vixlib.Vix_GetErrorText(1, None)
+
+        mock_cdll.assert_called_once_with(vixlib.vixpath)
+        fake_lib.Vix_GetErrorText.assert_called_once_with(1, None)
+        self.assertEqual(fake_lib.Vix_GetErrorText.restype,
+                         vixlib.Vix_GetErrorText.restype)
+        self.assertEqual(fake_lib.Vix_GetErrorText.argtypes,
+                         vixlib.Vix_GetErrorText.argtypes)
+        self.assertEqual(response, fake_lib.Vix_GetErrorText.return_value)
+
+    @mock.patch('ctypes.CDLL')
+    def test_library_loaded_once(self, mock_cdll):
+        vixlib.Vix_GetErrorText(1, None)
+        vixlib.Vix_ReleaseHandle(1)
+
+        self.assertEqual(mock_cdll.call_count, 1)
+
+    @mock.patch('ctypes.CDLL')
+    def test_load_library_failure(self, mock_cdll):
+        mock_cdll.side_effect = OSError()
+
+        self.assertRaises(IOError, vixlib.Vix_ReleaseHandle, 1)
+
+    @mock.patch('ctypes.CDLL')
+    def test_set_library_path(self, mock_cdll):
+        fake_path = 'fake/libvix.so'
+        vixlib.Vix_ReleaseHandle(1)
+
+        vixlib.set_library_path(fake_path)
+        vixlib.Vix_ReleaseHandle(1)
+
+        mock_cdll.assert_called_with(fake_path)
+        self.assertEqual(mock_cdll.call_count, 2)
+
+    @mock.patch('ctypes.CDLL')
+    def test_unknown_function(self, mock_cdll):
+        lib = vixlib._VixLibrary(vixlib.vixpath)
+
+        self.assertFalse(hasattr(lib, 'Vix_Unknown'))
+        self.assertIsNone(getattr(lib, 'Vix_Unknown', None))
+
+    def test_set_backend(self):
+        fake_backend = mock.MagicMock()
+        vixlib.set_backend(fake_backend)
+
+        vixlib.Vix_ReleaseHandle(1)
+
+        fake_backend.Vix_ReleaseHandle.assert_called_once_with(1)
@@ -40,6 +40,18 @@ class VixUtilsTestCase(unittest.TestCase):
         self.assertRaises(utils.VixException, vixutils._check_job_err_code,
                           fake_err)
 
+    @mock.patch('eventlet.tpool.execute')
+    def test_job_wait(self, mock_execute):
+        fake_job_handle = mock.MagicMock()
+
+        response = vixutils._job_wait(fake_job_handle,
+                                      vixlib.VIX_PROPERTY_NONE)
+
+        mock_execute.assert_called_once_with(vixlib.VixJob_Wait,
+                                             fake_job_handle,
+                                             vixlib.VIX_PROPERTY_NONE)
+        self.assertEqual(response, mock_execute.return_value)
+
     def test_load_config_file_values(self):
         fake_path = 'fake/path'
         match_mock = mock.MagicMock()
@@ -169,18 +181,16 @@ class VixUtilsTestCase(unittest.TestCase):
             fake_path, r"^(%s\s*=\s*)(.*)$" % fake_name,
             "\\1\"%s\"" % fake_value)
 
-    def test_get_vmx_value(self):
+    @mock.patch('vix.vmx.load_cached')
+    def test_get_vmx_value(self, mock_load_cached):
         fake_path = 'fake/path'
         fake_name = 'fake_name'
-        pattern = r"^%s\s*=\s*\"(.*)\"$" % fake_name
-        fake_value = mock.MagicMock()
 
-        utils.get_text = mock.MagicMock()
-        utils.get_text.return_value = fake_value
         response = vixutils.get_vmx_value(fake_path, fake_name)
-        utils.get_text.assert_called_with(fake_path,
-                                          pattern)
-        self.assertEqual(response, fake_value[0])
+
+        mock_load_cached.assert_called_once_with(fake_path)
+        mock_load_cached.return_value.get.assert_called_once_with(fake_name)
+        self.assertEqual(response, mock_load_cached.return_value.get())
 
     @mock.patch('vix.vixutils.get_vmx_value')
     def _test_get_vix_host_type(self, mock_get_vmx_value,
@@ -18,29 +18,153 @@
 import ctypes
 import mock
 import os
-import re
 import unittest
 import shutil
 import sys
+import tempfile
 import time
 
 if sys.platform == 'win32':
     import _winreg
-    import win32api
 
+from vix import utils
 from vix import vixutils
 from vix import vixlib
+from vix import vmx
+from vix.tests import base
 
 
 class VixUtilsTestCase(unittest.TestCase):
     """Unit tests for utility class"""
 
+    # Replaced without being restored by some of the tests
+    _ctypes_funcs = dict([(name, getattr(ctypes, name)) for name in
+                          ['byref', 'c_int', 'c_char_p']])
+    _vix_handle = vixlib.VixHandle
+
     def setUp(self):
         self.ctypes_handle = mock.MagicMock()
         self._VixVM = vixutils.VixVM(self.ctypes_handle)
         self._VixSnapshot = vixutils.VixSnapshot(self.ctypes_handle)
         self._VixConnection = vixutils.VixConnection()
 
+    ########### TESTING VixJob CLASS ###########
+    @mock.patch('vix.vixutils._check_job_err_code')
+    def _test_job_done(self, mock_check_job_err_code, completed):
+        fake_job_handle = mock.MagicMock()
+        fake_completed = mock.MagicMock()
+        fake_completed.value = completed
+        ctypes.c_byte = mock.MagicMock(return_value=fake_completed)
+        ctypes.byref = mock.MagicMock()
+        vixlib.VixJob_CheckCompletion = mock.MagicMock(return_value=None)
+        vixlib.VixJob_Wait = mock.MagicMock(return_value=None)
+        vixlib.Vix_ReleaseHandle = mock.MagicMock()
+        job = vixutils.VixJob(fake_job_handle)
+
+        response = job.done()
+
+        vixlib.VixJob_CheckCompletion.assert_called_once_with(
+            fake_job_handle, ctypes.byref.return_value)
+        self.assertEqual(response, completed)
+        if completed:
+            vixlib.VixJob_Wait.assert_called_once_with(
+                fake_job_handle, vixlib.VIX_PROPERTY_NONE)
+            vixlib.Vix_ReleaseHandle.assert_called_once_with(fake_job_handle)
+        else:
+            self.assertFalse(vixlib.VixJob_Wait.called)
+
+    def test_job_done_completed(self):
+        self._test_job_done(completed=True)
+
+    def test_job_done_not_completed(self):
+        self._test_job_done(completed=False)
+
+    @mock.patch('vix.vixutils._job_wait')
+    def test_job_result_handle(self, mock_job_wait):
+        fake_job_handle = mock.MagicMock()
+        fake_handle = mock.MagicMock()
+        fake_result_type = mock.MagicMock()
+        vixlib.VixHandle = mock.MagicMock(return_value=fake_handle)
+        ctypes.byref = mock.MagicMock()
+        vixlib.Vix_ReleaseHandle = mock.MagicMock()
+        mock_job_wait.return_value = None
+        job = vixutils.VixJob(fake_job_handle,
+                              vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE,
+                              fake_result_type)
+
+        response = job.result()
+
+        mock_job_wait.assert_called_once_with(
+            fake_job_handle, vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE,
+            ctypes.byref.return_value, vixlib.VIX_PROPERTY_NONE)
+        ctypes.byref.assert_called_once_with(fake_handle)
+        fake_result_type.assert_called_once_with(fake_handle)
+        self.assertEqual(response, fake_result_type.return_value)
+
+    @mock.patch('vix.vixutils._job_wait')
+    def test_job_result_error(self, mock_job_wait):
+        fake_job_handle = mock.MagicMock()
+        vixlib.Vix_ReleaseHandle = mock.MagicMock()
+        vixlib.Vix_GetErrorText = mock.MagicMock()
+        mock_job_wait.return_value = vixlib.VIX_E_FAIL
+        job = vixutils.VixJob(fake_job_handle)
+
+        self.assertRaises(utils.VixException, job.result)
+        vixlib.Vix_ReleaseHandle.assert_called_once_with(fake_job_handle)
+        self.assertRaises(utils.VixException, job.result)
+        self.assertEqual(mock_job_wait.call_count, 1)
+
+    @mock.patch('time.sleep')
+    def test_wait_for_jobs(self, mock_sleep):
+        fake_job1 = mock.MagicMock()
+        fake_job1.done.side_effect = [False, True]
+        fake_job2 = mock.MagicMock()
+        fake_job2.done.return_value = True
+
+        response = vixutils.wait_for_jobs([fake_job1, fake_job2])
+
+        self.assertEqual(fake_job1.done.call_count, 2)
+        self.assertEqual(fake_job2.done.call_count, 1)
+        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertEqual(response, [fake_job1.result.return_value,
+                                    fake_job2.result.return_value])
+
+    @mock.patch('time.sleep')
+    @mock.patch('time.time')
+    def test_wait_for_jobs_timeout(self, mock_time, mock_sleep):
+        fake_job = mock.MagicMock()
+        fake_job.done.return_value = False
+        mock_time.side_effect = [0, 1, 11]
+
+        self.assertRaises(utils.VixException, vixutils.wait_for_jobs,
+                          [fake_job], 10)
+        self.assertFalse(fake_job.result.called)
+        fake_job.close.assert_called_once_with()
+
+    @mock.patch('time.sleep')
+    def test_wait_for_jobs_polling_error(self, mock_sleep):
+        fake_job1 = mock.MagicMock()
+        fake_job1.done.return_value = True
+        fake_job2 = mock.MagicMock()
+        fake_job2.done.side_effect = utils.VixException
+        fake_job3 = mock.MagicMock()
+        fake_job3.done.return_value = False
+
+        self.assertRaises(utils.VixException, vixutils.wait_for_jobs,
+                          [fake_job1, fake_job2, fake_job3])
+        for fake_job in [fake_job1, fake_job2, fake_job3]:
+            fake_job.close.assert_called_once_with()
+
+    def test_job_close(self):
+        fake_job_handle = mock.MagicMock()
+        vixlib.Vix_ReleaseHandle = mock.MagicMock()
+        job = vixutils.VixJob(fake_job_handle)
+
+        job.close()
+        job.close()
+
+        vixlib.Vix_ReleaseHandle.assert_called_once_with(fake_job_handle)
+
     ########### TESTING VixVM CLASS ###########
     def test_close_VixVM(self):
         vixlib.Vix_ReleaseHandle = mock.MagicMock()
@@ -69,6 +193,36 @@ class VixUtilsTestCase(unittest.TestCase):
         ctypes.byref.assert_called_once()
         mock_check_job_err_code.assert_called_once_with(None)
 
+    @mock.patch('vix.vixutils._check_job_err_code')
+    def test_get_properties(self, mock_check_job_err_code):
+        fake_mem_size = mock.MagicMock(value=512)
+        fake_guest_os = mock.MagicMock(value='rhel6-64')
+        fake_is_running = mock.MagicMock(value=1)
+        ctypes.c_int = mock.MagicMock(return_value=fake_mem_size)
+        ctypes.c_char_p = mock.MagicMock(return_value=fake_guest_os)
+        ctypes.c_byte = mock.MagicMock(return_value=fake_is_running)
+        ctypes.byref = mock.MagicMock(side_effect=lambda obj: obj)
+        vixlib.Vix_GetProperties = mock.MagicMock(return_value=None)
+        vixlib.Vix_FreeBuffer = mock.MagicMock()
+
+        response = self._VixVM.get_properties(
+            [vixlib.VIX_PROPERTY_VM_MEMORY_SIZE,
+             vixlib.VIX_PROPERTY_VM_GUESTOS,
+             vixlib.VIX_PROPERTY_VM_IS_RUNNING])
+
+        vixlib.Vix_GetProperties.assert_called_once_with(
+            self._VixVM._vm_handle,
+            vixlib.VIX_PROPERTY_VM_MEMORY_SIZE, fake_mem_size,
+            vixlib.VIX_PROPERTY_VM_GUESTOS, fake_guest_os,
+            vixlib.VIX_PROPERTY_VM_IS_RUNNING, fake_is_running,
+            vixlib.VIX_PROPERTY_NONE)
+        mock_check_job_err_code.assert_called_once_with(None)
+        vixlib.Vix_FreeBuffer.assert_called_once_with(fake_guest_os)
+        self.assertEqual(response.mem_size_mb, 512)
+        self.assertEqual(response.guest_os, 'rhel6-64')
+        self.assertTrue(response.is_running)
+        self.assertIsNone(response.power_state)
+
     @mock.patch('vix.vixutils._check_job_err_code')
     def _test_power_on(self, show_gui, mock_check_job_err_code):
         fake_job_handle = mock.MagicMock()
@@ -376,6 +530,153 @@ class VixUtilsTestCase(unittest.TestCase):
         mock_check_job_err_code.assert_called_once_with(None)
         fake_snapshot.close.assert_called_once()
 
+    def _test_get_named_snapshot(self, err):
+        fake_snapshot_handle = mock.MagicMock()
+        vixlib.VixHandle = mock.MagicMock(return_value=fake_snapshot_handle)
+        ctypes.byref = mock.MagicMock()
+        vixlib.VixVM_GetNamedSnapshot = mock.MagicMock(return_value=err)
+
+        response = self._VixVM.get_named_snapshot('fake_name')
+
+        vixlib.VixVM_GetNamedSnapshot.assert_called_once_with(
+            self._VixVM._vm_handle, 'fake_name',
+            ctypes.byref(fake_snapshot_handle))
+        return (response, fake_snapshot_handle)
+
+    def test_get_named_snapshot(self):
+        (response, fake_snapshot_handle) = self._test_get_named_snapshot(
+            vixlib.VIX_OK)
+
+        self.assertIsInstance(response, vixutils.VixSnapshot)
+        self.assertEqual(response._snapshot_handle, fake_snapshot_handle)
+
+    def test_get_named_snapshot_not_found(self):
+        (response, fake_snapshot_handle) = self._test_get_named_snapshot(
+            vixlib.VIX_E_SNAPSHOT_NOTFOUND)
+
+        self.assertIsNone(response)
+
+    @mock.patch('vix.vixutils._check_job_err_code')
+    def test_get_named_snapshot_failure(self, mock_check_job_err_code):
+        mock_check_job_err_code.side_effect = utils.VixException
+
+        self.assertRaises(utils.VixException, self._test_get_named_snapshot,
+                          vixlib.VIX_E_FAIL)
+
+    def _patch_ctypes(self):
+        for (name, func) in self._ctypes_funcs.items():
+            patcher = mock.patch.object(ctypes, name, func)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(vixlib, 'VixHandle', self._vix_handle)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _set_output(self, value):
+        def set_output(*args):
+            args[-1]._obj.value = value
+            return vixlib.VIX_OK
+        return set_output
+
+    def _test_revert_to_snapshot(self, show_gui):
+        fake_snapshot = mock.MagicMock()
+        vixlib.VixVM_RevertToSnapshot = mock.MagicMock()
+        vixlib.VixJob_Wait = mock.MagicMock(return_value=vixlib.VIX_OK)
+        vixlib.Vix_ReleaseHandle = mock.MagicMock()
+
+        self._VixVM.revert_to_snapshot(fake_snapshot, show_gui)
+
+        if show_gui:
+            options = vixlib.VIX_VMPOWEROP_LAUNCH_GUI
+        else:
+            options = vixlib.VIX_VMPOWEROP_NORMAL
+        vixlib.VixVM_RevertToSnapshot.assert_called_once_with(
+            self._VixVM._vm_handle, fake_snapshot._snapshot_handle, options,
+            vixlib.VIX_INVALID_HANDLE, None, None)
+        vixlib.VixJob_Wait.assert_called_once_with(
+            vixlib.VixVM_RevertToSnapshot.return_value,
+            vixlib.VIX_PROPERTY_NONE)
+
+    def test_revert_to_snapshot(self):
+        self._test_revert_to_snapshot(show_gui=False)
+
+    def test_revert_to_snapshot_show_gui(self):
+        self._test_revert_to_snapshot(show_gui=True)
+
+    def test_get_root_snapshots(self):
+        self._patch_ctypes()
+        vixlib.VixVM_GetNumRootSnapshots = mock.MagicMock(
+            side_effect=self._set_output(2))
+        vixlib.VixVM_GetRootSnapshot = mock.MagicMock(
+            side_effect=self._set_output(42))
+
+        response = self._VixVM.get_root_snapshots()
+
+        self.assertEqual([s._snapshot_handle.value for s in response],
+                         [42, 42])
+        self.assertEqual([c[0][1] for c in
+                          vixlib.VixVM_GetRootSnapshot.call_args_list],
+                         [0, 1])
+
+    def test_get_children(self):
+        self._patch_ctypes()
+        vixlib.VixSnapshot_GetNumChildren = mock.MagicMock(
+            side_effect=self._set_output(1))
+        vixlib.VixSnapshot_GetChild = mock.MagicMock(
+            side_effect=self._set_output(42))
+
+        response = self._VixSnapshot.get_children()
+
+        self.assertEqual([s._snapshot_handle.value for s in response], [42])
+        vixlib.VixSnapshot_GetChild.assert_called_once_with(
+            self.ctypes_handle, 0, mock.ANY)
+
+    def test_get_info(self):
+        self._patch_ctypes()
+
+        def get_properties(handle, *args):
+            values = {vixlib.VIX_PROPERTY_SNAPSHOT_DISPLAYNAME: 'fake_name',
+                      vixlib.VIX_PROPERTY_SNAPSHOT_DESCRIPTION: 'fake_desc',
+                      vixlib.VIX_PROPERTY_SNAPSHOT_POWERSTATE: 2}
+            for i in range(0, len(args) - 1, 2):
+                args[i + 1]._obj.value = values[args[i]]
+            return vixlib.VIX_OK
+
+        vixlib.Vix_GetProperties = mock.MagicMock(side_effect=get_properties)
+        vixlib.Vix_FreeBuffer = mock.MagicMock()
+
+        response = self._VixSnapshot.get_info()
+
+        self.assertEqual(response, ('fake_name', 'fake_desc', 2))
+        self.assertEqual(vixlib.Vix_FreeBuffer.call_count, 2)
+
+    def test_get_snapshot_tree(self):
+        child = mock.MagicMock()
+        child.get_info.return_value = ('child', '', 2)
+        child.get_children.return_value = []
+        root = mock.MagicMock()
+        root.get_info.return_value = ('root', 'fake_desc', 8)
+        root.get_children.return_value = [child]
+        self._VixVM.get_root_snapshots = mock.MagicMock(return_value=[root])
+
+        response = self._VixVM.get_snapshot_tree()
+
+        self.assertEqual(response, [vixutils.VixSnapshotInfo(
+            'root', 'fake_desc', 8,
+            [vixutils.VixSnapshotInfo('child', '', 2, [])])])
+        root.close.assert_called_once_with()
+        child.close.assert_called_once_with()
+
+    def test_get_snapshot_tree_failure(self):
+        roots = [mock.MagicMock(), mock.MagicMock()]
+        roots[0].get_info.side_effect = utils.VixException
+        self._VixVM.get_root_snapshots = mock.MagicMock(return_value=roots)
+
+        self.assertRaises(utils.VixException, self._VixVM.get_snapshot_tree)
+
+        for root in roots:
+            root.close.assert_called_once_with()
+
     @mock.patch('vix.vixutils._check_job_err_code')
     def test_get_vmx_path(self, mock_check_job_err_code):
         fake_vmx_path = mock.MagicMock()
@@ -445,6 +746,34 @@ class VixUtilsTestCase(unittest.TestCase):
     def test_unregister_vm_and_delete_files_no_destroy_disks(self):
         self._test_unregister_vm_and_delete_files(destroy_disks=False)
 
+    @mock.patch('vix.vixutils.wait_for_jobs')
+    @mock.patch('vix.vixutils.VixConnection.delete_vm_files')
+    @mock.patch('vix.vixutils.VixConnection.unregister_vms')
+    @mock.patch('vix.vixutils.VixConnection.open_vm')
+    def test_unregister_vms_and_delete_files(self, mock_open_vm,
+                                             mock_unregister_vms,
+                                             mock_delete_vm_files,
+                                             mock_wait_for_jobs):
+        fake_paths = ['fake/path1', 'fake/path2']
+        mock_vm_off = mock.MagicMock()
+        mock_vm_off.get_power_state.return_value = (
+            vixlib.VIX_POWERSTATE_POWERED_OFF)
+        mock_vm_on = mock.MagicMock()
+        mock_vm_on.get_power_state.return_value = (
+            vixlib.VIX_POWERSTATE_POWERED_ON)
+        mock_open_vm.side_effect = [mock_vm_off, mock_vm_on]
+
+        self._VixConnection.unregister_vms_and_delete_files(fake_paths)
+
+        self.assertFalse(mock_vm_off.power_off_async.called)
+        mock_wait_for_jobs.assert_called_once_with(
+            [mock_vm_on.power_off_async.return_value])
+        self.assertTrue(mock_vm_off.close.called)
+        self.assertTrue(mock_vm_on.close.called)
+        mock_unregister_vms.assert_called_once_with(fake_paths)
+        self.assertEqual(mock_delete_vm_files.call_args_list,
+                         [mock.call(p) for p in fake_paths])
+
     @mock.patch('vix.vixutils._check_job_err_code')
     @mock.patch('vix.vixutils.get_vix_host_type')
     def test_connect(self, mock_get_vix_host_type, mock_check_job_err_code):
@@ -500,6 +829,53 @@ class VixUtilsTestCase(unittest.TestCase):
         mock_check_job_err_code.assert_called_with(None)
         self.assertIsInstance(response, vixutils.VixVM)
 
+    @mock.patch('vix.vixutils.VixConnection.open_vm_async')
+    def _open_cached_vms(self, vmx_paths, mock_open_vm_async):
+        fake_vm_handles = [mock.MagicMock() for vmx_path in vmx_paths]
+        mock_open_vm_async.return_value.result.side_effect = [
+            vixutils.VixVM(vm_handle) for vm_handle in fake_vm_handles]
+        vixlib.Vix_AddRefHandle = mock.MagicMock()
+        vixlib.Vix_ReleaseHandle = mock.MagicMock()
+
+        vms = [self._VixConnection.open_vm(vmx_path)
+               for vmx_path in vmx_paths]
+        return (vms, fake_vm_handles, mock_open_vm_async)
+
+    @mock.patch('vix.vixutils._get_vm_cache_key', lambda vmx_path: vmx_path)
+    def test_open_vm_cached(self):
+        self._VixConnection = vixutils.VixConnection(vm_cache_size=2)
+        fake_path = 'fake/path'
+
+        (vms, fake_vm_handles,
+         mock_open_vm_async) = self._open_cached_vms([fake_path, fake_path])
+
+        mock_open_vm_async.assert_called_once_with(fake_path)
+        self.assertEqual(vixlib.Vix_AddRefHandle.call_count, 2)
+        self.assertEqual(vms[1]._vm_handle, fake_vm_handles[0])
+        self.assertFalse(vixlib.Vix_ReleaseHandle.called)
+
+    @mock.patch('vix.vixutils._get_vm_cache_key', lambda vmx_path: vmx_path)
+    def test_open_vm_cache_eviction(self):
+        self._VixConnection = vixutils.VixConnection(vm_cache_size=1)
+
+        (vms, fake_vm_handles,
+         mock_open_vm_async) = self._open_cached_vms(['fake/path1',
+                                                      'fake/path2'])
+
+        vixlib.Vix_ReleaseHandle.assert_called_once_with(fake_vm_handles[0])
+
+    @mock.patch('vix.vixutils._get_vm_cache_key', lambda vmx_path: vmx_path)
+    def test_invalidate_vm(self):
+        self._VixConnection = vixutils.VixConnection(vm_cache_size=1)
+        fake_path = 'fake/path'
+        (vms, fake_vm_handles,
+         mock_open_vm_async) = self._open_cached_vms([fake_path])
+
+        self._VixConnection.invalidate_vm(fake_path)
+
+        vixlib.Vix_ReleaseHandle.assert_called_once_with(fake_vm_handles[0])
+        self.assertEqual(len(self._VixConnection._vm_cache), 0)
+
     def test_create_vm(self):
         fake_path = 'fake/path'
         display_name = 'fake_name'
@@ -548,9 +924,29 @@ class VixUtilsTestCase(unittest.TestCase):
         os.path.exists.assert_called_with('fake_dir')
         os.makedirs.assert_called_with('fake_dir')
 
-    @mock.patch('vix.vixutils.set_vmx_value')
-    @mock.patch('vix.vixutils.remove_vmx_value')
-    def test_update_vm(self, remove_vmx_value, set_vmx_value):
+    def test_get_vmx_template(self):
+        self._VixConnection._get_nested_hypervisor_config = mock.MagicMock()
+        self._VixConnection._get_nested_hypervisor_config.return_value = {
+            'vhv.enable': 'TRUE'}
+
+        response = self._VixConnection._get_vmx_template(10, 'fake_os', True,
+                                                         False)
+
+        self.assertIs(self._VixConnection._get_vmx_template(10, 'fake_os',
+                                                            True, False),
+                      response)
+        self.assertIsNot(self._VixConnection._get_vmx_template(10, 'fake_os',
+                                                               True, True),
+                         response)
+        self.assertEqual(
+            self._VixConnection._get_nested_hypervisor_config.call_count, 2)
+        self.assertEqual(response._keys,
+                         set([k.lower() for k in vixutils._VMX_STATIC_CONFIG] +
+                             ['virtualhw.version', 'guestos',
+                              'floppy0.present', 'vhv.enable']))
+
+    @mock.patch('vix.vmx.VmxFile.load')
+    def test_update_vm(self, mock_load):
         fake_path = 'fake/path'
         display_name = 'fake_name'
         guest_os = 'guest_os'
@@ -606,9 +1002,12 @@ class VixUtilsTestCase(unittest.TestCase):
         self._VixConnection._get_vnc_config.assert_called_with(vnc_enabled,
                                                                vnc_port)
 
-        remove_vmx_value.assert_called_with(
-            fake_path, r"ethernet[\d]+\.[a-zA-Z]+")
-        self.assertEqual(set_vmx_value.call_count, 15)
+        mock_load.assert_called_once_with(fake_path)
+        fake_vmx_file = mock_load.return_value
+        fake_vmx_file.remove_matching.assert_called_once_with(
+            r"ethernet[\d]+\.[a-zA-Z]+")
+        self.assertEqual(len(fake_vmx_file.update.call_args[0][0]), 15)
+        fake_vmx_file.save.assert_called_once_with()
 
     def test_get_vnc_config(self):
         vnc_enabled = True
@@ -715,49 +1114,40 @@ class VixUtilsTestCase(unittest.TestCase):
         mock_check_job_err_code.assert_called_with(None)
 
     @mock.patch('vix.vixutils._get_player_preferences_file_path')
-    @mock.patch('vix.vixutils._check_job_err_code')
-    def _test_unregister_vm_local(self, mock_check_job_err_code,
-                                  mock_get_player_preferences_file_path,
-                                  platform):
-        fake_path = 'fake/path'
-        pref_file_path = 'fake_file'
-        other_fake_path = 'other/fake/path'
-        fake_vmx_path_norm = 'fake/vmx/path'
-        some_object = mock.Mock()
-
-        sys.platform = mock.MagicMock()
-        sys.platform.return_value = platform
+    def test_unregister_vms_local_preferences_file(
+            self, mock_get_player_preferences_file_path):
+        base.restore_original_funcs(self)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        pref_file_path = os.path.join(tmpdir, 'preferences')
+        with open(pref_file_path, 'wb') as f:
+            f.write('pref.mruVM0.filename = "/vms/vm0.vmx"\n'
+                    'pref.mruVM0.displayName = "vm0"\n'
+                    'pref.mruVM1.filename = "/vms/vm1.vmx"\n'
+                    'pref.mruVM1.displayName = "vm1"\n'
+                    'pref.mruVM2.filename = "/vms/vm2.vmx"\n'
+                    'pref.mruVM2.displayName = "vm2"\n'
+                    'pref.mruVM3.filename = "/vms/vm3.vmx"\n')
         mock_get_player_preferences_file_path.return_value = pref_file_path
-        os.path.exists = mock.MagicMock()
-        os.path.exists.return_value = True
-        win32api.GetLongPathName = mock.MagicMock()
-        win32api.GetLongPathName.return_value = fake_path
-        os.path.abspath = mock.MagicMock()
-        os.path.abspath.return_value = other_fake_path
-        os.path.normcase = mock.MagicMock()
-        os.path.normcase.return_value = fake_vmx_path_norm
-        re.match = mock.MagicMock()
-        re.match.return_value = some_object
-
-        with mock.patch('vix.vixutils.open', mock.mock_open(read_data=''),
-                        create=True) as m:
-            print m.mock_calls
-            self._VixConnection._unregister_vm_local(fake_path)
-            m.assert_called_with(pref_file_path, 'r')
 
-        if platform == 'win32':
-            win32api.GetLongPathName.assert_called_with(fake_path)
-            self.assertEqual(os.path.exists.call_count, 2)
-        else:
-            os.path.exists.assert_called_once()
-        os.path.abspath.assert_called_with(fake_path)
-        os.path.normcase.assert_called_with(other_fake_path)
+        with mock.patch.object(sys, 'platform', 'linux2'):
+            with mock.patch('vix.vmx.VmxFile.save',
+                            side_effect=vmx.VmxFile.save,
+                            autospec=True) as mock_save:
+                self._VixConnection._unregister_vms_local(['/vms/vm0.vmx',
+                                                           '/vms/vm2.vmx'])
+
+        self.assertEqual(mock_save.call_count, 1)
+        pref_file = vmx.PreferencesFile.load(pref_file_path)
+        self.assertEqual(pref_file.get_mru_vm_paths(),
+                         {0: '/vms/vm1.vmx', 1: '/vms/vm3.vmx'})
+        self.assertEqual(pref_file.get('pref.mruVM0.displayName'), 'vm1')
 
-    def _test_unregister_vm_local_platform_windows(self):
-        self._test_unregister_vm_local(platform='win32')
+    @mock.patch('vix.vixutils.VixConnection._unregister_vms_local')
+    def test_unregister_vm_local(self, mock_unregister_vms_local):
+        self._VixConnection._unregister_vm_local('fake/path')
 
-    def test_unregister_vm_local_other_platform(self):
-        self._test_unregister_vm_local(platform='linux')
+        mock_unregister_vms_local.assert_called_with(['fake/path'])
 
     @mock.patch('vix.vixutils._check_job_err_code')
     def test_unregister_vm_server(self, mock_check_job_err_code):
@@ -799,6 +1189,35 @@ class VixUtilsTestCase(unittest.TestCase):
         else:
             mock_unregister_vm_server.assert_called_with(fake_path)
 
+    @mock.patch('vix.vixutils.VixConnection._unregister_vm_server')
+    @mock.patch('vix.vixutils.VixConnection._unregister_vms_local')
+    @mock.patch('vix.vixutils.VixConnection.invalidate_vm')
+    @mock.patch('vix.vixutils.get_vix_host_type')
+    def _test_unregister_vms(self, mock_get_vix_host_type,
+                             mock_invalidate_vm, mock_unregister_vms_local,
+                             mock_unregister_vm_server, vmware):
+        fake_paths = ['fake/path1', 'fake/path2']
+        mock_get_vix_host_type.return_value = vmware
+
+        self._VixConnection.unregister_vms(fake_paths)
+
+        self.assertEqual(mock_invalidate_vm.call_count, 2)
+        if vmware in [vixutils.VIX_VMWARE_PLAYER,
+                      vixutils.VIX_VMWARE_WORKSTATION]:
+            mock_unregister_vms_local.assert_called_once_with(fake_paths)
+            self.assertFalse(mock_unregister_vm_server.called)
+        else:
+            self.assertEqual(mock_unregister_vm_server.call_args_list,
+                             [mock.call(p) for p in fake_paths])
+            self.assertFalse(mock_unregister_vms_local.called)
+
+    def test_unregister_vms_local(self):
+        self._test_unregister_vms(vmware=vixutils.VIX_VMWARE_WORKSTATION)
+
+    def test_unregister_vms_server(self):
+        self._test_unregister_vms(
+            vmware=vixlib.VIX_SERVICEPROVIDER_VMWARE_VI_SERVER)
+
     def test_unregister_vm_VMWARE_WORKSTATION(self):
         self._test_unregister_vm(vmware=3)
 
@@ -942,6 +1361,56 @@ class VixUtilsTestCase(unittest.TestCase):
     def test_clone_vm_linked_clone_false(self):
         self._test_clone_vm(linked_clone=False)
 
+    def test_clone_vm_async_from_snapshot(self):
+        fake_vm = mock.MagicMock()
+        fake_snapshot = mock.MagicMock()
+        fake_dest_vmx_path = 'fake_dest_path'
+        vixlib.VixVM_Clone = mock.MagicMock()
+
+        response = self._VixConnection.clone_vm_async(fake_vm,
+                                                      fake_dest_vmx_path,
+                                                      True, fake_snapshot)
+
+        vixlib.VixVM_Clone.assert_called_once_with(
+            fake_vm._vm_handle, fake_snapshot._snapshot_handle,
+            vixlib.VIX_CLONETYPE_LINKED, fake_dest_vmx_path, 0,
+            vixlib.VIX_INVALID_HANDLE, None, None)
+        self.assertIsInstance(response, vixutils.VixJob)
+
+    def test_clone_vm_from_snapshot(self):
+        fake_vm = mock.MagicMock()
+        fake_snapshot = fake_vm.get_named_snapshot.return_value
+        self._VixConnection.open_vm = mock.MagicMock()
+        self._VixConnection.open_vm.return_value.__enter__.return_value = (
+            fake_vm)
+        self._VixConnection.clone_vm_async = mock.MagicMock()
+
+        response = self._VixConnection.clone_vm('fake_src_path',
+                                                'fake_dest_path', True,
+                                                'fake_snapshot_name')
+
+        fake_vm.get_named_snapshot.assert_called_once_with(
+            'fake_snapshot_name')
+        self._VixConnection.clone_vm_async.assert_called_once_with(
+            fake_vm, 'fake_dest_path', True, fake_snapshot)
+        fake_snapshot.__exit__.assert_called_once_with(None, None, None)
+        self.assertEqual(
+            response,
+            self._VixConnection.clone_vm_async.return_value.result())
+
+    def test_clone_vm_from_missing_snapshot(self):
+        fake_vm = mock.MagicMock()
+        fake_vm.get_named_snapshot.return_value = None
+        self._VixConnection.open_vm = mock.MagicMock()
+        self._VixConnection.open_vm.return_value.__enter__.return_value = (
+            fake_vm)
+        self._VixConnection.clone_vm_async = mock.MagicMock()
+
+        self.assertRaises(utils.VixException, self._VixConnection.clone_vm,
+                          'fake_src_path', 'fake_dest_path', True,
+                          'fake_snapshot_name')
+        self.assertFalse(self._VixConnection.clone_vm_async.called)
+
     @mock.patch('vix.vixutils._check_job_err_code')
     def test_get_software_version(self, mock_check_job_err_code):
         version = mock.MagicMock()
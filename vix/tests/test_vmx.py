@@ -0,0 +1,173 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from vix import vmx
+
+_FAKE_VMX = ('.encoding = "UTF-8"\r\n'
+             '# comment\r\n'
+             'displayName = "fake"\r\n'
+             'ethernet0.present = "TRUE"\r\n'
+             'ethernet0.address = "00:50:56:00:00:01"\r\n'
+             'memsize = "512"\r\n')
+
+
+class VmxFileTestCase(unittest.TestCase):
+    """Unit tests for the VMX file model"""
+
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._path = os.path.join(self._tmpdir, 'fake.vmx')
+        with open(self._path, 'wb') as f:
+            f.write(_FAKE_VMX)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def _read(self):
+        with open(self._path, 'rb') as f:
+            return f.read()
+
+    def test_load(self):
+        vmx_file = vmx.VmxFile.load(self._path)
+
+        self.assertEqual(vmx_file.get('DISPLAYNAME'), 'fake')
+        self.assertTrue('memSize' in vmx_file)
+        self.assertIsNone(vmx_file.get('fake_key'))
+        self.assertEqual([k for (k, v) in vmx_file.items()],
+                         ['.encoding', 'displayName', 'ethernet0.present',
+                          'ethernet0.address', 'memsize'])
+
+    def test_set(self):
+        vmx_file = vmx.VmxFile.load(self._path)
+
+        vmx_file.set('MemSize', 1024)
+        vmx_file.set('numvcpus', 2)
+
+        self.assertEqual(vmx_file.items()[-2:],
+                         [('memsize', '1024'), ('numvcpus', '2')])
+
+    def test_remove_matching(self):
+        vmx_file = vmx.VmxFile.load(self._path)
+
+        vmx_file.remove_matching(r"ethernet[\d]+\.[a-zA-Z]+")
+        vmx_file.remove('displayname')
+
+        self.assertEqual([k for (k, v) in vmx_file.items()],
+                         ['.encoding', 'memsize'])
+        self.assertFalse('ethernet0.present' in vmx_file)
+
+    def test_save(self):
+        vmx_file = vmx.VmxFile.load(self._path)
+        vmx_file.set('memsize', 1024)
+
+        vmx_file.save()
+
+        self.assertEqual(self._read(), os.linesep.join(
+            ['.encoding = "UTF-8"', '# comment', 'displayName = "fake"',
+             'ethernet0.present = "TRUE"',
+             'ethernet0.address = "00:50:56:00:00:01"',
+             'memsize = "1024"']) + os.linesep)
+        self.assertEqual(os.listdir(self._tmpdir), ['fake.vmx'])
+
+    @mock.patch('os.rename')
+    def test_save_failure(self, mock_rename):
+        mock_rename.side_effect = OSError()
+        vmx_file = vmx.VmxFile.load(self._path)
+        vmx_file.set('memsize', 1024)
+
+        self.assertRaises(OSError, vmx_file.save)
+        self.assertEqual(self._read(), _FAKE_VMX)
+        self.assertEqual(os.listdir(self._tmpdir), ['fake.vmx'])
+
+    def test_load_cached(self):
+        vmx_file = vmx.load_cached(self._path)
+
+        self.assertIs(vmx.load_cached(self._path), vmx_file)
+        with open(self._path, 'ab') as f:
+            f.write('numvcpus = "2"\r\n')
+        vmx_file_changed = vmx.load_cached(self._path)
+
+        self.assertIsNot(vmx_file_changed, vmx_file)
+        self.assertEqual(vmx_file_changed.get('numvcpus'), '2')
+
+    def test_save_invalidates_cache(self):
+        vmx.load_cached(self._path)
+        cache_key = vmx._get_cache_key(self._path)
+        self.assertIsNotNone(vmx._cache.get(cache_key))
+
+        vmx.VmxFile.load(self._path).save()
+
+        self.assertIsNone(vmx._cache.get(cache_key))
+
+
+class VmxTemplateTestCase(unittest.TestCase):
+    """Unit tests for the pre-rendered VMX templates"""
+
+    def setUp(self):
+        self._template = vmx.VmxTemplate([('config.version', '8'),
+                                          ('floppy0.present', 'FALSE')])
+
+    def test_render(self):
+        response = self._template.render({'memsize': '512'})
+
+        self.assertEqual(response, os.linesep.join(
+            ['.encoding = "UTF-8"', 'config.version = "8"',
+             'floppy0.present = "FALSE"', 'memsize = "512"']) + os.linesep)
+        self.assertEqual(response.count('.encoding'), 1)
+
+    def test_render_overrides_template_entries(self):
+        response = self._template.render({'Floppy0.Present': 'TRUE'})
+
+        self.assertEqual(response, os.linesep.join(
+            ['.encoding = "UTF-8"', 'config.version = "8"',
+             'Floppy0.Present = "TRUE"']) + os.linesep)
+        self.assertEqual(self._template.render({}).count('FALSE'), 1)
+
+
+class PreferencesFileTestCase(unittest.TestCase):
+    """Unit tests for the preferences MRU list"""
+
+    def setUp(self):
+        self._pref_file = vmx.PreferencesFile('fake_path')
+        for (k, v) in [('pref.mruVM0.filename', '/vm0.vmx'),
+                       ('pref.mruVM0.displayName', 'vm0'),
+                       ('fake.key', 'fake_value'),
+                       ('pref.mruVM1.filename', '/vm1.vmx'),
+                       ('pref.mruVM2.filename', '/vm2.vmx'),
+                       ('pref.mruVM2.displayName', 'vm2')]:
+            self._pref_file.set(k, v)
+
+    def test_get_mru_vm_paths(self):
+        self.assertEqual(self._pref_file.get_mru_vm_paths(),
+                         {0: '/vm0.vmx', 1: '/vm1.vmx', 2: '/vm2.vmx'})
+
+    def test_remove_mru_vms(self):
+        self._pref_file.remove_mru_vms([0, 1])
+
+        self.assertEqual(self._pref_file.items(),
+                         [('fake.key', 'fake_value'),
+                          ('pref.mruVM0.filename', '/vm2.vmx'),
+                          ('pref.mruVM0.displayName', 'vm2')])
+        self.assertEqual(self._pref_file.get('pref.mruvm0.displayname'),
+                         'vm2')
+        self.assertFalse('pref.mruVM2.filename' in self._pref_file)
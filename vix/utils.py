@@ -15,12 +15,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import multiprocessing
+import os
 import psutil
 import re
+import shutil
 import socket
+import sys
+import tempfile
+import threading
 
 from nova import exception
+from nova.openstack.common import excutils
 
 
 class VixException(exception.NovaException):
@@ -88,3 +95,70 @@ def replace_text(file_name, pattern, replacement):
         with open(file_name, 'w') as f:
             f.writelines(lines)
     return found
+
+
+def write_file_atomic(path, data):
+    """Writes data to a temporary file in the same directory, renamed over
+    the target path, so readers never see a partially written file.
+    """
+    (fd, tmp_path) = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        if sys.platform == 'win32' and os.path.exists(path):
+            # os.rename does not replace existing files on Windows
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except Exception:
+        with excutils.save_and_reraise_exception():
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class LRUCache(object):
+    """Thread safe cache holding up to max_size items.
+
+    When the cache is full, the least recently used items are evicted and
+    returned by put() to let the caller release them.
+    """
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._items = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            # Move the item to the most recently used position
+            value = self._items.pop(key)
+            self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        evicted = []
+        with self._lock:
+            old_value = self._items.pop(key, None)
+            if old_value is not None and old_value is not value:
+                evicted.append(old_value)
+            self._items[key] = value
+            while len(self._items) > self._max_size:
+                evicted.append(self._items.popitem(last=False)[1])
+        return evicted
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            values = self._items.values()
+            self._items.clear()
+            return values
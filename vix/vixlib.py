@@ -28,11 +28,6 @@ elif sys.platform == 'win32':
 else:
     vixpath = 'libvix.so'
 
-try:
-    vix = ctypes.CDLL(vixpath)
-except Exception:
-    raise IOError(_('Cannot load Vix: %s') % vixpath)
-
 VixHandle = ctypes.c_int
 VixHandleType = ctypes.c_int
 VixError = ctypes.c_uint64
@@ -446,375 +441,387 @@ VIX_INSTALLTOOLS_MOUNT_TOOLS_INSTALLER = 0x00
 VIX_INSTALLTOOLS_AUTO_UPGRADE = 0x01
 VIX_INSTALLTOOLS_RETURN_IMMEDIATELY = 0x02
 
-vix.Vix_GetErrorText.restype = ctypes.c_char_p
-vix.Vix_GetErrorText.argtypes = [VixError, ctypes.c_char_p]
-Vix_GetErrorText = vix.Vix_GetErrorText
-
-vix.Vix_ReleaseHandle.restype = None
-vix.Vix_ReleaseHandle.argtypes = [VixHandle]
-Vix_ReleaseHandle = vix.Vix_ReleaseHandle
-
-vix.Vix_AddRefHandle.restype = None
-vix.Vix_AddRefHandle.argtypes = [VixHandle]
-Vix_AddRefHandle = vix.Vix_AddRefHandle
-
-vix.Vix_GetHandleType.restype = VixHandleType
-vix.Vix_GetHandleType.argtypes = [VixHandle]
-vix.Vix_GetProperties.restype = VixError
-
-vix.Vix_GetProperties.argtypes = [VixHandle, VixPropertyID]
-vix.Vix_GetPropertyType.restype = VixError
-Vix_GetProperties = vix.Vix_GetProperties
-
-vix.Vix_GetPropertyType.argtypes = [VixHandle, VixPropertyID,
-                                    ctypes.POINTER(VixPropertyType)]
-vix.Vix_FreeBuffer.restype = None
-vix.Vix_FreeBuffer.argtypes = [ctypes.c_void_p]
-Vix_FreeBuffer = vix.Vix_FreeBuffer
-
-vix.VixHost_Connect.restype = VixHandle
-vix.VixHost_Connect.argtypes = [ctypes.c_int, VixServiceProvider,
-                                ctypes.c_char_p, ctypes.c_int,
-                                ctypes.c_char_p, ctypes.c_char_p,
-                                VixHostOptions, VixHandle,
-                                ctypes.POINTER(VixEventProc),
-                                ctypes.c_void_p]
-VixHost_Connect = vix.VixHost_Connect
-
-vix.VixHost_Disconnect.restype = None
-vix.VixHost_Disconnect.argtypes = [VixHandle]
-VixHost_Disconnect = vix.VixHost_Disconnect
-
-vix.VixHost_RegisterVM.restype = VixHandle
-vix.VixHost_RegisterVM.argtypes = [VixHandle, ctypes.c_char_p,
+_backend = None
+_functions = {}
+
+
+class _VixFunction(object):
+    """Forwards the calls to the function with the same name exported by
+    the current backend.
+    """
+    def __init__(self, name, restype, argtypes):
+        self.name = name
+        self.restype = restype
+        self.argtypes = argtypes
+        _functions[name] = self
+
+    def __call__(self, *args):
+        return getattr(_get_backend(), self.name)(*args)
+
+
+Vix_GetErrorText = _VixFunction('Vix_GetErrorText', ctypes.c_char_p,
+                                [VixError, ctypes.c_char_p])
+
+Vix_ReleaseHandle = _VixFunction('Vix_ReleaseHandle', None,
+                                 [VixHandle])
+
+Vix_AddRefHandle = _VixFunction('Vix_AddRefHandle', None,
+                                [VixHandle])
+
+Vix_GetHandleType = _VixFunction('Vix_GetHandleType', VixHandleType,
+                                 [VixHandle])
+
+Vix_GetProperties = _VixFunction('Vix_GetProperties', VixError,
+                                 [VixHandle, VixPropertyID])
+
+Vix_GetPropertyType = _VixFunction('Vix_GetPropertyType', VixError,
+                                   [VixHandle, VixPropertyID,
+                                    ctypes.POINTER(VixPropertyType)])
+
+Vix_FreeBuffer = _VixFunction('Vix_FreeBuffer', None,
+                              [ctypes.c_void_p])
+
+VixHost_Connect = _VixFunction('VixHost_Connect', VixHandle,
+                               [ctypes.c_int, VixServiceProvider,
+                                ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p,
+                                ctypes.c_char_p, VixHostOptions, VixHandle,
+                                ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixHost_Disconnect = _VixFunction('VixHost_Disconnect', None,
+                                  [VixHandle])
+
+VixHost_RegisterVM = _VixFunction('VixHost_RegisterVM', VixHandle,
+                                  [VixHandle, ctypes.c_char_p,
                                    ctypes.POINTER(VixEventProc),
-                                   ctypes.c_void_p]
-VixHost_RegisterVM = vix.VixHost_RegisterVM
+                                   ctypes.c_void_p])
 
-vix.VixHost_UnregisterVM.restype = VixHandle
-vix.VixHost_UnregisterVM.argtypes = [VixHandle, ctypes.c_char_p,
+VixHost_UnregisterVM = _VixFunction('VixHost_UnregisterVM', VixHandle,
+                                    [VixHandle, ctypes.c_char_p,
                                      ctypes.POINTER(VixEventProc),
-                                     ctypes.c_void_p]
-VixHost_UnregisterVM = vix.VixHost_UnregisterVM
+                                     ctypes.c_void_p])
 
-vix.VixHost_FindItems.restype = VixHandle
-vix.VixHost_FindItems.argtypes = [VixHandle, VixFindItemType, VixHandle,
+VixHost_FindItems = _VixFunction('VixHost_FindItems', VixHandle,
+                                 [VixHandle, VixFindItemType, VixHandle,
                                   ctypes.c_int32, VixEventProc,
-                                  ctypes.c_void_p]
-VixHost_FindItems = vix.VixHost_FindItems
+                                  ctypes.c_void_p])
 
-vix.VixHost_OpenVM.restype = VixHandle
-vix.VixHost_OpenVM.argtypes = [VixHandle, ctypes.c_char_p, VixVMOpenOptions,
+VixHost_OpenVM = _VixFunction('VixHost_OpenVM', VixHandle,
+                              [VixHandle, ctypes.c_char_p, VixVMOpenOptions,
                                VixHandle, ctypes.POINTER(VixEventProc),
-                               ctypes.c_void_p]
-
-vix.VixPropertyList_AllocPropertyList.restype = VixError
-vix.VixPropertyList_AllocPropertyList.argtypes = [VixHandle,
-                                                  ctypes.POINTER(VixHandle),
-                                                  ctypes.c_int]
-vix.VixVM_Open.restype = VixHandle
-vix.VixVM_Open.argtypes = [VixHandle, ctypes.c_char_p,
-                           ctypes.POINTER(VixEventProc), ctypes.c_void_p]
-VixVM_Open = vix.VixVM_Open
-
-vix.VixVM_PowerOn.restype = VixHandle
-vix.VixVM_PowerOn.argtypes = [VixHandle, VixVMPowerOpOptions,
-                              VixHandle, ctypes.POINTER(VixEventProc),
-                              ctypes.c_void_p]
-VixVM_PowerOn = vix.VixVM_PowerOn
-
-vix.VixVM_PowerOff.restype = VixHandle
-vix.VixVM_PowerOff.argtypes = [VixHandle, VixVMPowerOpOptions,
-                               ctypes.POINTER(VixEventProc),
-                               ctypes.c_void_p]
-VixVM_PowerOff = vix.VixVM_PowerOff
-
-vix.VixVM_Reset.restype = VixHandle
-vix.VixVM_Reset.argtypes = [VixHandle, VixVMPowerOpOptions,
-                            ctypes.POINTER(VixEventProc),
-                            ctypes.c_void_p]
-VixVM_Reset = vix.VixVM_Reset
-
-vix.VixVM_Suspend.restype = VixHandle
-vix.VixVM_Suspend.argtypes = [VixHandle, VixVMPowerOpOptions,
-                              ctypes.POINTER(VixEventProc),
-                              ctypes.c_void_p]
-VixVM_Suspend = vix.VixVM_Suspend
-
-vix.VixVM_Pause.restype = VixHandle
-vix.VixVM_Pause.argtypes = [VixHandle, ctypes.c_int, VixHandle,
-                            ctypes.POINTER(VixEventProc),
-                            ctypes.c_void_p]
-VixVM_Pause = vix.VixVM_Pause
-
-vix.VixVM_Unpause.restype = VixHandle
-vix.VixVM_Unpause.argtypes = [VixHandle, ctypes.c_int,
-                              VixHandle, ctypes.POINTER(VixEventProc),
-                              ctypes.c_void_p]
-VixVM_Unpause = vix.VixVM_Unpause
-
-vix.VixVM_Delete.restype = VixHandle
-vix.VixVM_Delete.argtypes = [VixHandle, VixVMDeleteOptions,
-                             ctypes.POINTER(VixEventProc),
-                             ctypes.c_void_p]
-VixVM_Delete = vix.VixVM_Delete
-
-vix.VixVM_BeginRecording.restype = VixHandle
-vix.VixVM_BeginRecording.argtypes = [VixHandle, ctypes.c_char_p,
-                                     ctypes.c_char_p, ctypes.c_int,
-                                     VixHandle, ctypes.POINTER(VixEventProc),
-                                     ctypes.c_void_p]
+                               ctypes.c_void_p])
 
-vix.VixVM_EndRecording.restype = VixHandle
-vix.VixVM_EndRecording.argtypes = [VixHandle, ctypes.c_int,
-                                   VixHandle, ctypes.POINTER(VixEventProc),
-                                   ctypes.c_void_p]
+VixPropertyList_AllocPropertyList = _VixFunction(
+    'VixPropertyList_AllocPropertyList', VixError,
+    [VixHandle, ctypes.POINTER(VixHandle), ctypes.c_int])
 
-vix.VixVM_BeginReplay.restype = VixHandle
-vix.VixVM_BeginReplay.argtypes = [VixHandle, VixHandle, ctypes.c_int,
-                                  VixHandle, ctypes.POINTER(VixEventProc),
-                                  ctypes.c_void_p]
-
-vix.VixVM_EndReplay.restype = VixHandle
-vix.VixVM_EndReplay.argtypes = [VixHandle, ctypes.c_int,
-                                VixHandle, ctypes.POINTER(VixEventProc),
-                                ctypes.c_void_p]
-
-vix.VixVM_WaitForToolsInGuest.restype = VixHandle
-vix.VixVM_WaitForToolsInGuest.argtypes = [VixHandle, ctypes.c_int,
-                                          ctypes.POINTER(VixEventProc),
-                                          ctypes.c_void_p]
-VixVM_WaitForToolsInGuest = vix.VixVM_WaitForToolsInGuest
-
-vix.VixVM_LoginInGuest.restype = VixHandle
-vix.VixVM_LoginInGuest.argtypes = [VixHandle, ctypes.c_char_p,
-                                   ctypes.c_char_p, ctypes.c_int,
+VixVM_Open = _VixFunction('VixVM_Open', VixHandle,
+                          [VixHandle, ctypes.c_char_p,
+                           ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_PowerOn = _VixFunction('VixVM_PowerOn', VixHandle,
+                             [VixHandle, VixVMPowerOpOptions, VixHandle,
+                              ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_PowerOff = _VixFunction('VixVM_PowerOff', VixHandle,
+                              [VixHandle, VixVMPowerOpOptions,
+                               ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_Reset = _VixFunction('VixVM_Reset', VixHandle,
+                           [VixHandle, VixVMPowerOpOptions,
+                            ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_Suspend = _VixFunction('VixVM_Suspend', VixHandle,
+                             [VixHandle, VixVMPowerOpOptions,
+                              ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_Pause = _VixFunction('VixVM_Pause', VixHandle,
+                           [VixHandle, ctypes.c_int, VixHandle,
+                            ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_Unpause = _VixFunction('VixVM_Unpause', VixHandle,
+                             [VixHandle, ctypes.c_int, VixHandle,
+                              ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_Delete = _VixFunction('VixVM_Delete', VixHandle,
+                            [VixHandle, VixVMDeleteOptions,
+                             ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_BeginRecording = _VixFunction('VixVM_BeginRecording', VixHandle,
+                                    [VixHandle, ctypes.c_char_p,
+                                     ctypes.c_char_p, ctypes.c_int, VixHandle,
+                                     ctypes.POINTER(VixEventProc),
+                                     ctypes.c_void_p])
+
+VixVM_EndRecording = _VixFunction('VixVM_EndRecording', VixHandle,
+                                  [VixHandle, ctypes.c_int, VixHandle,
                                    ctypes.POINTER(VixEventProc),
-                                   ctypes.c_void_p]
+                                   ctypes.c_void_p])
+
+VixVM_BeginReplay = _VixFunction('VixVM_BeginReplay', VixHandle,
+                                 [VixHandle, VixHandle, ctypes.c_int,
+                                  VixHandle, ctypes.POINTER(VixEventProc),
+                                  ctypes.c_void_p])
+
+VixVM_EndReplay = _VixFunction('VixVM_EndReplay', VixHandle,
+                               [VixHandle, ctypes.c_int, VixHandle,
+                                ctypes.POINTER(VixEventProc), ctypes.c_void_p])
 
-vix.VixVM_LogoutFromGuest.restype = VixHandle
-vix.VixVM_LogoutFromGuest.argtypes = [VixHandle, ctypes.POINTER(VixEventProc),
-                                      ctypes.c_void_p]
+VixVM_WaitForToolsInGuest = _VixFunction(
+    'VixVM_WaitForToolsInGuest', VixHandle,
+    [VixHandle, ctypes.c_int, ctypes.POINTER(VixEventProc), ctypes.c_void_p])
 
-vix.VixVM_RunProgramInGuest.restype = VixHandle
-vix.VixVM_RunProgramInGuest.argtypes = [VixHandle, ctypes.c_char_p,
+VixVM_LoginInGuest = _VixFunction('VixVM_LoginInGuest', VixHandle,
+                                  [VixHandle, ctypes.c_char_p, ctypes.c_char_p,
+                                   ctypes.c_int, ctypes.POINTER(VixEventProc),
+                                   ctypes.c_void_p])
+
+VixVM_LogoutFromGuest = _VixFunction('VixVM_LogoutFromGuest', VixHandle,
+                                     [VixHandle, ctypes.POINTER(VixEventProc),
+                                      ctypes.c_void_p])
+
+VixVM_RunProgramInGuest = _VixFunction('VixVM_RunProgramInGuest', VixHandle,
+                                       [VixHandle, ctypes.c_char_p,
                                         ctypes.c_char_p, VixRunProgramOptions,
                                         VixHandle,
                                         ctypes.POINTER(VixEventProc),
-                                        ctypes.c_void_p]
+                                        ctypes.c_void_p])
 
-vix.VixVM_ListProcessesInGuest.restype = VixHandle
-vix.VixVM_ListProcessesInGuest.argtypes = [VixHandle, ctypes.c_int,
-                                           ctypes.POINTER(VixEventProc),
-                                           ctypes.c_void_p]
+VixVM_ListProcessesInGuest = _VixFunction(
+    'VixVM_ListProcessesInGuest', VixHandle,
+    [VixHandle, ctypes.c_int, ctypes.POINTER(VixEventProc), ctypes.c_void_p])
 
-vix.VixVM_KillProcessInGuest.restype = VixHandle
-vix.VixVM_KillProcessInGuest.argtypes = [VixHandle, ctypes.c_uint64,
+VixVM_KillProcessInGuest = _VixFunction('VixVM_KillProcessInGuest', VixHandle,
+                                        [VixHandle, ctypes.c_uint64,
                                          ctypes.c_int,
                                          ctypes.POINTER(VixEventProc),
-                                         ctypes.c_void_p]
+                                         ctypes.c_void_p])
 
-vix.VixVM_RunScriptInGuest.restype = VixHandle
-vix.VixVM_RunScriptInGuest.argtypes = [VixHandle, ctypes.c_char_p,
+VixVM_RunScriptInGuest = _VixFunction('VixVM_RunScriptInGuest', VixHandle,
+                                      [VixHandle, ctypes.c_char_p,
                                        ctypes.c_char_p, VixRunProgramOptions,
                                        VixHandle, ctypes.POINTER(VixEventProc),
-                                       ctypes.c_void_p]
-
-vix.VixVM_CopyFileFromHostToGuest.restype = VixHandle
-vix.VixVM_CopyFileFromHostToGuest.argtypes = [VixHandle, ctypes.c_char_p,
-                                              ctypes.c_char_p, ctypes.c_int,
-                                              VixHandle,
-                                              ctypes.POINTER(VixEventProc),
-                                              ctypes.c_void_p]
-
-vix.VixVM_CopyFileFromGuestToHost.restype = VixHandle
-vix.VixVM_CopyFileFromGuestToHost.argtypes = [VixHandle, ctypes.c_char_p,
-                                              ctypes.c_char_p, ctypes.c_int,
-                                              VixHandle,
-                                              ctypes.POINTER(VixEventProc),
-                                              ctypes.c_void_p]
-
-vix.VixVM_DeleteFileInGuest.restype = VixHandle
-vix.VixVM_DeleteFileInGuest.argtypes = [VixHandle, ctypes.c_char_p,
+                                       ctypes.c_void_p])
+
+VixVM_CopyFileFromHostToGuest = _VixFunction(
+    'VixVM_CopyFileFromHostToGuest', VixHandle,
+    [VixHandle, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, VixHandle,
+     ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_CopyFileFromGuestToHost = _VixFunction(
+    'VixVM_CopyFileFromGuestToHost', VixHandle,
+    [VixHandle, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, VixHandle,
+     ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_DeleteFileInGuest = _VixFunction('VixVM_DeleteFileInGuest', VixHandle,
+                                       [VixHandle, ctypes.c_char_p,
                                         ctypes.POINTER(VixEventProc),
-                                        ctypes.c_void_p]
+                                        ctypes.c_void_p])
 
-vix.VixVM_FileExistsInGuest.restype = VixHandle
-vix.VixVM_FileExistsInGuest.argtypes = [VixHandle, ctypes.c_char_p,
+VixVM_FileExistsInGuest = _VixFunction('VixVM_FileExistsInGuest', VixHandle,
+                                       [VixHandle, ctypes.c_char_p,
                                         ctypes.POINTER(VixEventProc),
-                                        ctypes.c_void_p]
+                                        ctypes.c_void_p])
 
-vix.VixVM_RenameFileInGuest.restype = VixHandle
-vix.VixVM_RenameFileInGuest.argtypes = [VixHandle, ctypes.c_char_p,
+VixVM_RenameFileInGuest = _VixFunction('VixVM_RenameFileInGuest', VixHandle,
+                                       [VixHandle, ctypes.c_char_p,
                                         ctypes.c_char_p, ctypes.c_int,
                                         VixHandle,
                                         ctypes.POINTER(VixEventProc),
-                                        ctypes.c_void_p]
+                                        ctypes.c_void_p])
 
-vix.VixVM_CreateTempFileInGuest.restype = VixHandle
-vix.VixVM_CreateTempFileInGuest.argtypes = [VixHandle,
-                                            ctypes.c_int, VixHandle,
-                                            ctypes.POINTER(VixEventProc),
-                                            ctypes.c_void_p]
+VixVM_CreateTempFileInGuest = _VixFunction(
+    'VixVM_CreateTempFileInGuest', VixHandle,
+    [VixHandle, ctypes.c_int, VixHandle, ctypes.POINTER(VixEventProc),
+     ctypes.c_void_p])
 
-vix.VixVM_GetFileInfoInGuest.restype = VixHandle
-vix.VixVM_GetFileInfoInGuest.argtypes = [VixHandle, ctypes.c_char_p,
+VixVM_GetFileInfoInGuest = _VixFunction('VixVM_GetFileInfoInGuest', VixHandle,
+                                        [VixHandle, ctypes.c_char_p,
                                          ctypes.POINTER(VixEventProc),
-                                         ctypes.c_void_p]
-
-vix.VixVM_ListDirectoryInGuest.restype = VixHandle
-vix.VixVM_ListDirectoryInGuest.argtypes = [VixHandle, ctypes.c_char_p,
-                                           ctypes.c_int,
-                                           ctypes.POINTER(VixEventProc),
-                                           ctypes.c_void_p]
-
-vix.VixVM_CreateDirectoryInGuest.restype = VixHandle
-vix.VixVM_CreateDirectoryInGuest.argtypes = [VixHandle, ctypes.c_char_p,
-                                             VixHandle,
-                                             ctypes.POINTER(VixEventProc),
-                                             ctypes.c_void_p]
-
-vix.VixVM_DeleteDirectoryInGuest.restype = VixHandle
-vix.VixVM_DeleteDirectoryInGuest.argtypes = [VixHandle, ctypes.c_char_p,
-                                             ctypes.c_int,
-                                             ctypes.POINTER(VixEventProc),
-                                             ctypes.c_void_p]
-
-vix.VixVM_DirectoryExistsInGuest.restype = VixHandle
-vix.VixVM_DirectoryExistsInGuest.argtypes = [VixHandle, ctypes.c_char_p,
-                                             ctypes.POINTER(VixEventProc),
-                                             ctypes.c_void_p]
-
-vix.VixVM_ReadVariable.restype = VixHandle
-vix.VixVM_ReadVariable.argtypes = [VixHandle, ctypes.c_int, ctypes.c_char_p,
+                                         ctypes.c_void_p])
+
+VixVM_ListDirectoryInGuest = _VixFunction(
+    'VixVM_ListDirectoryInGuest', VixHandle,
+    [VixHandle, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(VixEventProc),
+     ctypes.c_void_p])
+
+VixVM_CreateDirectoryInGuest = _VixFunction(
+    'VixVM_CreateDirectoryInGuest', VixHandle,
+    [VixHandle, ctypes.c_char_p, VixHandle, ctypes.POINTER(VixEventProc),
+     ctypes.c_void_p])
+
+VixVM_DeleteDirectoryInGuest = _VixFunction(
+    'VixVM_DeleteDirectoryInGuest', VixHandle,
+    [VixHandle, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(VixEventProc),
+     ctypes.c_void_p])
+
+VixVM_DirectoryExistsInGuest = _VixFunction(
+    'VixVM_DirectoryExistsInGuest', VixHandle,
+    [VixHandle, ctypes.c_char_p, ctypes.POINTER(VixEventProc),
+     ctypes.c_void_p])
+
+VixVM_ReadVariable = _VixFunction('VixVM_ReadVariable', VixHandle,
+                                  [VixHandle, ctypes.c_int, ctypes.c_char_p,
                                    ctypes.c_int, ctypes.POINTER(VixEventProc),
-                                   ctypes.c_void_p]
-VixVM_ReadVariable = vix.VixVM_ReadVariable
+                                   ctypes.c_void_p])
 
-vix.VixVM_WriteVariable.restype = VixHandle
-vix.VixVM_WriteVariable.argtypes = [VixHandle, ctypes.c_int, ctypes.c_char_p,
+VixVM_WriteVariable = _VixFunction('VixVM_WriteVariable', VixHandle,
+                                   [VixHandle, ctypes.c_int, ctypes.c_char_p,
                                     ctypes.c_char_p, ctypes.c_int,
                                     ctypes.POINTER(VixEventProc),
-                                    ctypes.c_void_p]
+                                    ctypes.c_void_p])
 
-vix.VixVM_GetNumRootSnapshots.restype = VixError
-vix.VixVM_GetNumRootSnapshots.argtypes = [VixHandle,
-                                          ctypes.POINTER(ctypes.c_int)]
+VixVM_GetNumRootSnapshots = _VixFunction('VixVM_GetNumRootSnapshots', VixError,
+                                         [VixHandle,
+                                          ctypes.POINTER(ctypes.c_int)])
 
-vix.VixVM_GetRootSnapshot.restype = VixError
-vix.VixVM_GetRootSnapshot.argtypes = [VixHandle, ctypes.c_int,
-                                      ctypes.POINTER(VixHandle)]
+VixVM_GetRootSnapshot = _VixFunction('VixVM_GetRootSnapshot', VixError,
+                                     [VixHandle, ctypes.c_int,
+                                      ctypes.POINTER(VixHandle)])
 
-vix.VixVM_GetCurrentSnapshot.restype = VixError
-vix.VixVM_GetCurrentSnapshot.argtypes = [VixHandle, ctypes.POINTER(VixHandle)]
+VixVM_GetCurrentSnapshot = _VixFunction('VixVM_GetCurrentSnapshot', VixError,
+                                        [VixHandle, ctypes.POINTER(VixHandle)])
 
-vix.VixVM_GetNamedSnapshot.restype = VixError
-vix.VixVM_GetNamedSnapshot.argtypes = [VixHandle, ctypes.c_char_p,
-                                       ctypes.POINTER(VixHandle)]
+VixVM_GetNamedSnapshot = _VixFunction('VixVM_GetNamedSnapshot', VixError,
+                                      [VixHandle, ctypes.c_char_p,
+                                       ctypes.POINTER(VixHandle)])
 
-vix.VixVM_RemoveSnapshot.restype = VixHandle
-vix.VixVM_RemoveSnapshot.argtypes = [VixHandle, VixHandle,
+VixVM_RemoveSnapshot = _VixFunction('VixVM_RemoveSnapshot', VixHandle,
+                                    [VixHandle, VixHandle,
                                      VixRemoveSnapshotOptions,
                                      ctypes.POINTER(VixEventProc),
-                                     ctypes.c_void_p]
-VixVM_RemoveSnapshot = vix.VixVM_RemoveSnapshot
+                                     ctypes.c_void_p])
 
-vix.VixVM_RevertToSnapshot.restype = VixHandle
-vix.VixVM_RevertToSnapshot.argtypes = [VixHandle, VixHandle,
+VixVM_RevertToSnapshot = _VixFunction('VixVM_RevertToSnapshot', VixHandle,
+                                      [VixHandle, VixHandle,
                                        VixVMPowerOpOptions, VixHandle,
                                        ctypes.POINTER(VixEventProc),
-                                       ctypes.c_void_p]
+                                       ctypes.c_void_p])
 
-vix.VixVM_CreateSnapshot.restype = VixHandle
-vix.VixVM_CreateSnapshot.argtypes = [VixHandle, ctypes.c_char_p,
+VixVM_CreateSnapshot = _VixFunction('VixVM_CreateSnapshot', VixHandle,
+                                    [VixHandle, ctypes.c_char_p,
                                      ctypes.c_char_p, VixCreateSnapshotOptions,
                                      VixHandle, ctypes.POINTER(VixEventProc),
-                                     ctypes.c_void_p]
-VixVM_CreateSnapshot = vix.VixVM_CreateSnapshot
-
-vix.VixVM_EnableSharedFolders.restype = VixHandle
-vix.VixVM_EnableSharedFolders.argtypes = [VixHandle, ctypes.c_byte,
-                                          ctypes.c_int,
-                                          ctypes.POINTER(VixEventProc),
-                                          ctypes.c_void_p]
-
-vix.VixVM_GetNumSharedFolders.restype = VixHandle
-vix.VixVM_GetNumSharedFolders.argtypes = [VixHandle,
-                                          ctypes.POINTER(VixEventProc),
-                                          ctypes.c_void_p]
-
-vix.VixVM_GetSharedFolderState.restype = VixHandle
-vix.VixVM_GetSharedFolderState.argtypes = [VixHandle, ctypes.c_int,
-                                           ctypes.POINTER(VixEventProc),
-                                           ctypes.c_void_p]
-
-vix.VixVM_SetSharedFolderState.restype = VixHandle
-vix.VixVM_SetSharedFolderState.argtypes = [VixHandle, ctypes.c_char_p,
-                                           ctypes.c_char_p,
-                                           VixMsgSharedFolderOptions,
-                                           ctypes.POINTER(VixEventProc),
-                                           ctypes.c_void_p]
-
-vix.VixVM_AddSharedFolder.restype = VixHandle
-vix.VixVM_AddSharedFolder.argtypes = [VixHandle, ctypes.c_char_p,
+                                     ctypes.c_void_p])
+
+VixVM_EnableSharedFolders = _VixFunction(
+    'VixVM_EnableSharedFolders', VixHandle,
+    [VixHandle, ctypes.c_byte, ctypes.c_int, ctypes.POINTER(VixEventProc),
+     ctypes.c_void_p])
+
+VixVM_GetNumSharedFolders = _VixFunction(
+    'VixVM_GetNumSharedFolders', VixHandle,
+    [VixHandle, ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_GetSharedFolderState = _VixFunction(
+    'VixVM_GetSharedFolderState', VixHandle,
+    [VixHandle, ctypes.c_int, ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_SetSharedFolderState = _VixFunction(
+    'VixVM_SetSharedFolderState', VixHandle,
+    [VixHandle, ctypes.c_char_p, ctypes.c_char_p, VixMsgSharedFolderOptions,
+     ctypes.POINTER(VixEventProc), ctypes.c_void_p])
+
+VixVM_AddSharedFolder = _VixFunction('VixVM_AddSharedFolder', VixHandle,
+                                     [VixHandle, ctypes.c_char_p,
                                       ctypes.c_char_p,
                                       VixMsgSharedFolderOptions,
                                       ctypes.POINTER(VixEventProc),
-                                      ctypes.c_void_p]
+                                      ctypes.c_void_p])
 
-vix.VixVM_RemoveSharedFolder.restype = VixHandle
-vix.VixVM_RemoveSharedFolder.argtypes = [VixHandle, ctypes.c_char_p,
+VixVM_RemoveSharedFolder = _VixFunction('VixVM_RemoveSharedFolder', VixHandle,
+                                        [VixHandle, ctypes.c_char_p,
                                          ctypes.c_int,
                                          ctypes.POINTER(VixEventProc),
-                                         ctypes.c_void_p]
+                                         ctypes.c_void_p])
 
-vix.VixVM_CaptureScreenImage.restype = VixHandle
-vix.VixVM_CaptureScreenImage.argtypes = [VixHandle, ctypes.c_int,
-                                         VixHandle,
+VixVM_CaptureScreenImage = _VixFunction('VixVM_CaptureScreenImage', VixHandle,
+                                        [VixHandle, ctypes.c_int, VixHandle,
                                          ctypes.POINTER(VixEventProc),
-                                         ctypes.c_void_p]
-
-vix.VixVM_Clone.restype = VixHandle
-vix.VixVM_Clone.argtypes = [VixHandle, VixHandle, VixCloneType,
-                            ctypes.c_char_p, ctypes.c_int,
-                            VixHandle, ctypes.POINTER(VixEventProc),
-                            ctypes.c_void_p]
-VixVM_Clone = vix.VixVM_Clone
-
-vix.VixVM_UpgradeVirtualHardware.restype = VixHandle
-vix.VixVM_UpgradeVirtualHardware.argtypes = [VixHandle, ctypes.c_int,
-                                             ctypes.POINTER(VixEventProc),
-                                             ctypes.c_void_p]
-
-vix.VixVM_InstallTools.restype = VixHandle
-vix.VixVM_InstallTools.argtypes = [VixHandle, ctypes.c_int, ctypes.c_char_p,
-                                   ctypes.POINTER(VixEventProc),
-                                   ctypes.c_void_p]
+                                         ctypes.c_void_p])
 
-vix.VixJob_Wait.restype = VixError
-vix.VixJob_Wait.argtypes = [VixHandle, VixPropertyID]
-VixJob_Wait = vix.VixJob_Wait
+VixVM_Clone = _VixFunction('VixVM_Clone', VixHandle,
+                           [VixHandle, VixHandle, VixCloneType,
+                            ctypes.c_char_p, ctypes.c_int, VixHandle,
+                            ctypes.POINTER(VixEventProc), ctypes.c_void_p])
 
-vix.VixJob_CheckCompletion.restype = VixError
-vix.VixJob_CheckCompletion.argtypes = [VixHandle,
-                                       ctypes.POINTER(ctypes.c_byte)]
+VixVM_UpgradeVirtualHardware = _VixFunction(
+    'VixVM_UpgradeVirtualHardware', VixHandle,
+    [VixHandle, ctypes.c_int, ctypes.POINTER(VixEventProc), ctypes.c_void_p])
 
-vix.VixJob_GetError.restype = VixError
-vix.VixJob_GetError.argtypes = [VixHandle]
-
-vix.VixJob_GetNumProperties.restype = ctypes.c_int
-vix.VixJob_GetNumProperties.argtypes = [VixHandle, ctypes.c_int]
-
-vix.VixJob_GetNthProperties.restype = VixError
-vix.VixJob_GetNthProperties.argtypes = [VixHandle, ctypes.c_int, ctypes.c_int]
-
-vix.VixSnapshot_GetNumChildren.restype = VixError
-vix.VixSnapshot_GetNumChildren.argtypes = [VixHandle,
-                                           ctypes.POINTER(ctypes.c_int)]
-
-vix.VixSnapshot_GetChild.restype = VixError
-vix.VixSnapshot_GetChild.argtypes = [VixHandle, ctypes.c_int,
-                                     ctypes.POINTER(VixHandle)]
-
-vix.VixSnapshot_GetParent.restype = VixError
-vix.VixSnapshot_GetParent.argtypes = [VixHandle, ctypes.POINTER(VixHandle)]
+VixVM_InstallTools = _VixFunction('VixVM_InstallTools', VixHandle,
+                                  [VixHandle, ctypes.c_int, ctypes.c_char_p,
+                                   ctypes.POINTER(VixEventProc),
+                                   ctypes.c_void_p])
+
+VixJob_Wait = _VixFunction('VixJob_Wait', VixError,
+                           [VixHandle, VixPropertyID])
+
+VixJob_CheckCompletion = _VixFunction('VixJob_CheckCompletion', VixError,
+                                      [VixHandle,
+                                       ctypes.POINTER(ctypes.c_byte)])
+
+VixJob_GetError = _VixFunction('VixJob_GetError', VixError,
+                               [VixHandle])
+
+VixJob_GetNumProperties = _VixFunction('VixJob_GetNumProperties', ctypes.c_int,
+                                       [VixHandle, ctypes.c_int])
+
+VixJob_GetNthProperties = _VixFunction('VixJob_GetNthProperties', VixError,
+                                       [VixHandle, ctypes.c_int, ctypes.c_int])
+
+VixSnapshot_GetNumChildren = _VixFunction(
+    'VixSnapshot_GetNumChildren', VixError,
+    [VixHandle, ctypes.POINTER(ctypes.c_int)])
+
+VixSnapshot_GetChild = _VixFunction('VixSnapshot_GetChild', VixError,
+                                    [VixHandle, ctypes.c_int,
+                                     ctypes.POINTER(VixHandle)])
+
+VixSnapshot_GetParent = _VixFunction('VixSnapshot_GetParent', VixError,
+                                     [VixHandle, ctypes.POINTER(VixHandle)])
+
+
+class _VixLibrary(object):
+    """Binds the functions exported by the Vix shared library on first use.
+    """
+    def __init__(self, path):
+        try:
+            self._lib = ctypes.CDLL(path)
+        except OSError:
+            raise IOError(_('Cannot load Vix: %s') % path)
+
+    def __getattr__(self, name):
+        func = _functions.get(name)
+        if func is None:
+            raise AttributeError(name)
+        lib_func = getattr(self._lib, name)
+        lib_func.restype = func.restype
+        lib_func.argtypes = func.argtypes
+        setattr(self, name, lib_func)
+        return lib_func
+
+
+def _get_backend():
+    global _backend
+    # The library is loaded by the first Vix call, a failure is reported
+    # to the caller and retried on the next call
+    if _backend is None:
+        _backend = _VixLibrary(vixpath)
+    return _backend
+
+
+def set_library_path(path):
+    """Sets the path of the Vix shared library, loaded on first use."""
+    global vixpath
+    global _backend
+    vixpath = path
+    if isinstance(_backend, _VixLibrary):
+        _backend = None
+
+
+def set_backend(backend):
+    """Replaces the Vix shared library with a different implementation
+    of the same functions, e.g. the simulator in vix.fakevix.
+    """
+    global _backend
+    _backend = backend
@@ -15,20 +15,25 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import ctypes
 import os
 import re
 import shutil
 import sys
+import threading
 import time
 
 if sys.platform == 'win32':
     import _winreg
     import win32api
 
+from eventlet import tpool
 from nova.openstack.common.gettextutils import _
+from nova import utils as nova_utils
 from vix import vixlib
 from vix import utils
+from vix import vmx
 
 VIX_VMWARE_WORKSTATION = vixlib.VIX_SERVICEPROVIDER_VMWARE_WORKSTATION
 VIX_VMWARE_PLAYER = vixlib.VIX_SERVICEPROVIDER_VMWARE_PLAYER
@@ -39,6 +44,66 @@ SUPPORTS_NESTED_VIRT_EPT = 2
 NETWORK_NAT = "__nat__"
 NETWORK_HOST_ONLY = "__host_only__"
 
+_PROPERTY_TYPE_INTEGER = 1
+_PROPERTY_TYPE_STRING = 2
+_PROPERTY_TYPE_BOOL = 3
+
+_VMX_STATIC_CONFIG = collections.OrderedDict([
+    ("config.version", "8"),
+    ("pciBridge0.present", "TRUE"),
+    ("pciBridge4.present", "TRUE"),
+    ("pciBridge4.virtualDev", "pcieRootPort"),
+    ("pciBridge4.functions", "8"),
+    ("pciBridge5.present", "TRUE"),
+    ("pciBridge5.virtualDev", "pcieRootPort"),
+    ("pciBridge5.functions", "8"),
+    ("pciBridge6.present", "TRUE"),
+    ("pciBridge6.virtualDev", "pcieRootPort"),
+    ("pciBridge6.functions", "8"),
+    ("pciBridge7.present", "TRUE"),
+    ("pciBridge7.virtualDev", "pcieRootPort"),
+    ("pciBridge7.functions", "8"),
+    ("vmci0.present", "TRUE"),
+    ("hpet0.present", "TRUE"),
+    ("virtualHW.productCompatibility", "hosted"),
+    ("powerType.powerOff", "soft"),
+    ("powerType.powerOn", "hard"),
+    ("powerType.suspend", "hard"),
+    ("powerType.reset", "soft"),
+    ("disk.EnableUUID", "TRUE"),
+    ("cleanShutdown", "FALSE"),
+    ("replay.supported", "FALSE"),
+    ("softPowerOff", "FALSE"),
+    ("tools.syncTime", "FALSE"),
+    ("hard-disk.hostBuffer", "disabled"),
+])
+
+_VM_PROPERTIES = collections.OrderedDict([
+    (vixlib.VIX_PROPERTY_VM_POWER_STATE,
+     ("power_state", _PROPERTY_TYPE_INTEGER)),
+    (vixlib.VIX_PROPERTY_VM_TOOLS_STATE,
+     ("tools_state", _PROPERTY_TYPE_INTEGER)),
+    (vixlib.VIX_PROPERTY_VM_IS_RUNNING,
+     ("is_running", _PROPERTY_TYPE_BOOL)),
+    (vixlib.VIX_PROPERTY_VM_NUM_VCPUS,
+     ("num_vcpus", _PROPERTY_TYPE_INTEGER)),
+    (vixlib.VIX_PROPERTY_VM_MEMORY_SIZE,
+     ("mem_size_mb", _PROPERTY_TYPE_INTEGER)),
+    (vixlib.VIX_PROPERTY_VM_GUESTOS,
+     ("guest_os", _PROPERTY_TYPE_STRING)),
+    (vixlib.VIX_PROPERTY_VM_NAME,
+     ("name", _PROPERTY_TYPE_STRING)),
+    (vixlib.VIX_PROPERTY_VM_VMX_PATHNAME,
+     ("vmx_path", _PROPERTY_TYPE_STRING)),
+])
+
+VixVMProperties = collections.namedtuple(
+    'VixVMProperties', (prop[0] for prop in _VM_PROPERTIES.values()))
+
+# Node of the snapshot tree of a VM, children is a list of nodes
+VixSnapshotInfo = collections.namedtuple(
+    'VixSnapshotInfo', ['name', 'description', 'power_state', 'children'])
+
 
 def _check_job_err_code(err):
     if err:
@@ -46,6 +111,21 @@ def _check_job_err_code(err):
         raise utils.VixException(msg)
 
 
+def _get_error_code(err):
+    # The error code is in the lowest 16 bits of a VixError
+    return err & 0xFFFF
+
+
+def _job_wait(job_handle, *args):
+    # VixJob_Wait blocks the calling OS thread until the job completes.
+    # Run it in the native thread pool to avoid stalling the eventlet hub.
+    return tpool.execute(vixlib.VixJob_Wait, job_handle, *args)
+
+
+def _get_vm_cache_key(vmx_path):
+    return os.path.normcase(os.path.abspath(vmx_path))
+
+
 def load_config_file_values(path):
     config = {}
     with open(path, 'rb') as f:
@@ -132,6 +212,7 @@ def get_vix_host_type():
 
 def remove_vmx_value(vmx_path, name):
     utils.remove_lines(vmx_path, r"^%s\s*=\s*.*$" % name)
+    vmx.invalidate(vmx_path)
 
 
 def set_vmx_value(vmx_path, name, value):
@@ -141,12 +222,111 @@ def set_vmx_value(vmx_path, name, value):
         with open(vmx_path, "ab") as f:
             f.write("%(name)s = \"%(value)s\"" %
                     {'name': name, 'value': value} + os.linesep)
+    vmx.invalidate(vmx_path)
 
 
 def get_vmx_value(vmx_path, name):
-    value = utils.get_text(vmx_path, r"^%s\s*=\s*\"(.*)\"$" % name)
-    if value:
-        return value[0]
+    return vmx.load_cached(vmx_path).get(name)
+
+
+class VixJob(object):
+    """Future for the result of an asynchronous Vix job.
+
+    The job handle is released when the job completes, so result() must
+    be called on each job, directly or through wait_for_jobs().
+    """
+    def __init__(self, job_handle, result_prop_id=None, result_type=None):
+        self._job_handle = job_handle
+        self._result_prop_id = result_prop_id
+        self._result_type = result_type
+        self._done = False
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        if not self._done:
+            completed = ctypes.c_byte()
+            err = vixlib.VixJob_CheckCompletion(self._job_handle,
+                                                ctypes.byref(completed))
+            _check_job_err_code(err)
+            if completed.value:
+                # The job completed, VixJob_Wait does not block
+                self._complete(vixlib.VixJob_Wait)
+        return self._done
+
+    def close(self):
+        """Releases the handle of a job whose result is no longer needed.
+        The job must not be used afterwards.
+        """
+        if self._job_handle:
+            vixlib.Vix_ReleaseHandle(self._job_handle)
+            self._job_handle = None
+
+    def result(self):
+        if not self._done:
+            self._complete(_job_wait)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def _complete(self, job_wait):
+        if self._result_prop_id is None:
+            err = job_wait(self._job_handle, vixlib.VIX_PROPERTY_NONE)
+        else:
+            if (self._result_prop_id ==
+                    vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE):
+                value = vixlib.VixHandle()
+            else:
+                value = ctypes.c_char_p()
+            err = job_wait(self._job_handle,
+                           self._result_prop_id,
+                           ctypes.byref(value),
+                           vixlib.VIX_PROPERTY_NONE)
+        vixlib.Vix_ReleaseHandle(self._job_handle)
+        self._job_handle = None
+        self._done = True
+
+        try:
+            _check_job_err_code(err)
+
+            if (self._result_prop_id ==
+                    vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE):
+                self._result = value
+            elif self._result_prop_id is not None:
+                self._result = value.value
+                vixlib.Vix_FreeBuffer(value)
+
+            if self._result_type:
+                self._result = self._result_type(self._result)
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+
+def wait_for_jobs(jobs, timeout_seconds=-1, poll_interval=0.1):
+    """Waits for all the given jobs to complete and returns their results.
+
+    Jobs are polled with VixJob_CheckCompletion, so operations started on
+    multiple VMs run concurrently on the host. If any job failed, the
+    exception of the first failed job is raised.
+    """
+    start = time.time()
+
+    pending_jobs = list(jobs)
+    try:
+        while pending_jobs:
+            pending_jobs = [job for job in pending_jobs if not job.done()]
+            if pending_jobs:
+                if (timeout_seconds >= 0 and
+                        time.time() - start > timeout_seconds):
+                    raise utils.VixException(_("Timeout exceeded: %d") %
+                                             timeout_seconds)
+                time.sleep(poll_interval)
+    finally:
+        # Jobs still pending after a timeout or a polling error
+        for job in pending_jobs:
+            job.close()
+
+    return [job.result() for job in jobs]
 
 
 class VixVM(object):
@@ -165,16 +345,44 @@ class VixVM(object):
             vixlib.Vix_ReleaseHandle(self._vm_handle)
             self._vm_handle = None
 
-    def get_power_state(self):
-        power_state = ctypes.c_int()
-        err = vixlib.Vix_GetProperties(self._vm_handle,
-                                       vixlib.VIX_PROPERTY_VM_POWER_STATE,
-                                       ctypes.byref(power_state),
-                                       vixlib.VIX_PROPERTY_NONE)
+    def get_properties(self, prop_ids):
+        """Returns the given VM properties, retrieved with a single
+        Vix_GetProperties call. Properties not requested are None.
+        """
+        values = []
+        args = []
+        for prop_id in prop_ids:
+            prop_type = _VM_PROPERTIES[prop_id][1]
+            if prop_type == _PROPERTY_TYPE_STRING:
+                value = ctypes.c_char_p()
+            elif prop_type == _PROPERTY_TYPE_BOOL:
+                value = ctypes.c_byte()
+            else:
+                value = ctypes.c_int()
+            values.append(value)
+            args += [prop_id, ctypes.byref(value)]
+
+        err = vixlib.Vix_GetProperties(self._vm_handle, *(args +
+                                       [vixlib.VIX_PROPERTY_NONE]))
         _check_job_err_code(err)
-        return power_state.value
 
-    def power_on(self, show_gui=True):
+        properties = dict.fromkeys(VixVMProperties._fields)
+        for prop_id, value in zip(prop_ids, values):
+            (name, prop_type) = _VM_PROPERTIES[prop_id]
+            if prop_type == _PROPERTY_TYPE_STRING:
+                properties[name] = value.value
+                vixlib.Vix_FreeBuffer(value)
+            elif prop_type == _PROPERTY_TYPE_BOOL:
+                properties[name] = bool(value.value)
+            else:
+                properties[name] = value.value
+        return VixVMProperties(**properties)
+
+    def get_power_state(self):
+        return self.get_properties(
+            [vixlib.VIX_PROPERTY_VM_POWER_STATE]).power_state
+
+    def power_on_async(self, show_gui=True):
         if show_gui:
             options = vixlib.VIX_VMPOWEROP_LAUNCH_GUI
         else:
@@ -184,34 +392,38 @@ class VixVM(object):
                                           options,
                                           vixlib.VIX_INVALID_HANDLE,
                                           None, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
-        vixlib.Vix_ReleaseHandle(job_handle)
-        _check_job_err_code(err)
+        return VixJob(job_handle)
 
-    def pause(self):
+    def power_on(self, show_gui=True):
+        self.power_on_async(show_gui).result()
+
+    def pause_async(self):
         job_handle = vixlib.VixVM_Pause(self._vm_handle,
                                         0, vixlib.VIX_INVALID_HANDLE,
                                         None, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
-        vixlib.Vix_ReleaseHandle(job_handle)
-        _check_job_err_code(err)
+        return VixJob(job_handle)
 
-    def unpause(self):
+    def pause(self):
+        self.pause_async().result()
+
+    def unpause_async(self):
         job_handle = vixlib.VixVM_Unpause(self._vm_handle,
                                           0, vixlib.VIX_INVALID_HANDLE,
                                           None, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
-        vixlib.Vix_ReleaseHandle(job_handle)
-        _check_job_err_code(err)
+        return VixJob(job_handle)
 
-    def suspend(self):
+    def unpause(self):
+        self.unpause_async().result()
+
+    def suspend_async(self):
         job_handle = vixlib.VixVM_Suspend(self._vm_handle,
                                           0, None, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
-        vixlib.Vix_ReleaseHandle(job_handle)
-        _check_job_err_code(err)
+        return VixJob(job_handle)
 
-    def reboot(self, soft=False):
+    def suspend(self):
+        self.suspend_async().result()
+
+    def reboot_async(self, soft=False):
         if soft:
             power_op = vixlib.VIX_VMPOWEROP_FROM_GUEST
         else:
@@ -219,11 +431,12 @@ class VixVM(object):
 
         job_handle = vixlib.VixVM_Reset(self._vm_handle, power_op,
                                         None, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
-        vixlib.Vix_ReleaseHandle(job_handle)
-        _check_job_err_code(err)
+        return VixJob(job_handle)
 
-    def power_off(self, soft=False):
+    def reboot(self, soft=False):
+        self.reboot_async(soft).result()
+
+    def power_off_async(self, soft=False):
         if soft:
             power_op = vixlib.VIX_VMPOWEROP_FROM_GUEST
         else:
@@ -231,17 +444,19 @@ class VixVM(object):
 
         job_handle = vixlib.VixVM_PowerOff(self._vm_handle, power_op,
                                            None, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
-        vixlib.Vix_ReleaseHandle(job_handle)
-        _check_job_err_code(err)
+        return VixJob(job_handle)
 
-    def wait_for_tools_in_guest(self, timeout_seconds=600):
+    def power_off(self, soft=False):
+        self.power_off_async(soft).result()
+
+    def wait_for_tools_in_guest_async(self, timeout_seconds=600):
         job_handle = vixlib.VixVM_WaitForToolsInGuest(self._vm_handle,
                                                       timeout_seconds,
                                                       None, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
-        vixlib.Vix_ReleaseHandle(job_handle)
-        _check_job_err_code(err)
+        return VixJob(job_handle)
+
+    def wait_for_tools_in_guest(self, timeout_seconds=600):
+        self.wait_for_tools_in_guest_async(timeout_seconds).result()
 
     def get_guest_ip_address(self, timeout_seconds=600):
         start = time.time()
@@ -254,7 +469,7 @@ class VixVM(object):
                 self._vm_handle, vixlib.VIX_VM_GUEST_VARIABLE,
                 "ip", 0, None, None)
             read_value = ctypes.c_char_p()
-            err = vixlib.VixJob_Wait(
+            err = _job_wait(
                 job_handle,
                 vixlib.VIX_PROPERTY_JOB_RESULT_VM_VARIABLE_STRING,
                 ctypes.byref(read_value),
@@ -283,14 +498,14 @@ class VixVM(object):
 
         job_handle = vixlib.VixVM_Delete(self._vm_handle, delete_options,
                                          None, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
+        err = _job_wait(job_handle, vixlib.VIX_PROPERTY_NONE)
         vixlib.Vix_ReleaseHandle(job_handle)
         _check_job_err_code(err)
 
         self.close()
 
-    def create_snapshot(self, include_memory=False, name=None,
-                        description=None):
+    def create_snapshot_async(self, include_memory=False, name=None,
+                              description=None):
         if include_memory:
             options = vixlib.VIX_SNAPSHOT_INCLUDE_MEMORY
         else:
@@ -300,38 +515,94 @@ class VixVM(object):
                                                  name, description, options,
                                                  vixlib.VIX_INVALID_HANDLE,
                                                  None, None)
-        snapshot_handle = vixlib.VixHandle()
-        err = vixlib.VixJob_Wait(job_handle,
-                                 vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE,
-                                 ctypes.byref(snapshot_handle),
-                                 vixlib.VIX_PROPERTY_NONE)
-        vixlib.Vix_ReleaseHandle(job_handle)
-        _check_job_err_code(err)
+        return VixJob(job_handle, vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE,
+                      VixSnapshot)
 
-        return VixSnapshot(snapshot_handle)
+    def create_snapshot(self, include_memory=False, name=None,
+                        description=None):
+        return self.create_snapshot_async(include_memory, name,
+                                          description).result()
 
-    def remove_snapshot(self, snapshot):
+    def remove_snapshot_async(self, snapshot):
         job_handle = vixlib.VixVM_RemoveSnapshot(self._vm_handle,
                                                  snapshot._snapshot_handle,
                                                  0, None, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
-        _check_job_err_code(err)
+        return VixJob(job_handle)
 
+    def remove_snapshot(self, snapshot):
+        self.remove_snapshot_async(snapshot).result()
         snapshot.close()
 
-    def get_vmx_path(self):
-        if not self._vmx_path:
-            vmx_path = ctypes.c_char_p()
-            err = vixlib.Vix_GetProperties(
-                self._vm_handle,
-                vixlib.VIX_PROPERTY_VM_VMX_PATHNAME,
-                ctypes.byref(vmx_path),
-                vixlib.VIX_PROPERTY_NONE)
-            _check_job_err_code(err)
+    def revert_to_snapshot_async(self, snapshot, show_gui=True):
+        if show_gui:
+            options = vixlib.VIX_VMPOWEROP_LAUNCH_GUI
+        else:
+            options = vixlib.VIX_VMPOWEROP_NORMAL
+
+        job_handle = vixlib.VixVM_RevertToSnapshot(self._vm_handle,
+                                                   snapshot._snapshot_handle,
+                                                   options,
+                                                   vixlib.VIX_INVALID_HANDLE,
+                                                   None, None)
+        return VixJob(job_handle)
+
+    def revert_to_snapshot(self, snapshot, show_gui=True):
+        """Reverts the VM to the snapshot, including its power state if the
+        snapshot includes the memory state.
+        """
+        self.revert_to_snapshot_async(snapshot, show_gui).result()
+
+    def get_root_snapshots(self):
+        num_snapshots = ctypes.c_int()
+        err = vixlib.VixVM_GetNumRootSnapshots(self._vm_handle,
+                                               ctypes.byref(num_snapshots))
+        _check_job_err_code(err)
 
-            self._vmx_path = vmx_path.value
-            vixlib.Vix_FreeBuffer(vmx_path)
+        snapshots = []
+        for i in range(num_snapshots.value):
+            snapshot_handle = vixlib.VixHandle()
+            err = vixlib.VixVM_GetRootSnapshot(self._vm_handle, i,
+                                               ctypes.byref(snapshot_handle))
+            _check_job_err_code(err)
+            snapshots.append(VixSnapshot(snapshot_handle))
+        return snapshots
+
+    def get_snapshot_tree(self):
+        """Returns the snapshots of the VM as a list of VixSnapshotInfo
+        trees, one for each root snapshot. The snapshot handles are
+        released during the walk.
+        """
+        def walk(snapshots):
+            nodes = []
+            try:
+                for snapshot in snapshots:
+                    (name, description, power_state) = snapshot.get_info()
+                    children = walk(snapshot.get_children())
+                    nodes.append(VixSnapshotInfo(name, description,
+                                                 power_state, children))
+            finally:
+                for snapshot in snapshots:
+                    snapshot.close()
+            return nodes
+
+        return walk(self.get_root_snapshots())
+
+    def get_named_snapshot(self, name):
+        """Returns the snapshot with the given name, or None if the VM has
+        no such snapshot.
+        """
+        snapshot_handle = vixlib.VixHandle()
+        err = vixlib.VixVM_GetNamedSnapshot(self._vm_handle, name,
+                                            ctypes.byref(snapshot_handle))
+        if err and _get_error_code(err) == vixlib.VIX_E_SNAPSHOT_NOTFOUND:
+            return None
+        _check_job_err_code(err)
+        return VixSnapshot(snapshot_handle)
 
+    def get_vmx_path(self):
+        if not self._vmx_path:
+            self._vmx_path = self.get_properties(
+                [vixlib.VIX_PROPERTY_VM_VMX_PATHNAME]).vmx_path
         return self._vmx_path
 
     def get_vnc_settings(self):
@@ -365,13 +636,61 @@ class VixSnapshot(object):
             vixlib.Vix_ReleaseHandle(self._snapshot_handle)
             self._snapshot_handle = None
 
+    def get_info(self):
+        """Returns the name, description and power state of the snapshot.
+        """
+        name = ctypes.c_char_p()
+        description = ctypes.c_char_p()
+        power_state = ctypes.c_int()
+        err = vixlib.Vix_GetProperties(
+            self._snapshot_handle,
+            vixlib.VIX_PROPERTY_SNAPSHOT_DISPLAYNAME, ctypes.byref(name),
+            vixlib.VIX_PROPERTY_SNAPSHOT_DESCRIPTION,
+            ctypes.byref(description),
+            vixlib.VIX_PROPERTY_SNAPSHOT_POWERSTATE,
+            ctypes.byref(power_state),
+            vixlib.VIX_PROPERTY_NONE)
+        _check_job_err_code(err)
+
+        info = (name.value, description.value, power_state.value)
+        vixlib.Vix_FreeBuffer(name)
+        vixlib.Vix_FreeBuffer(description)
+        return info
+
+    def get_children(self):
+        num_children = ctypes.c_int()
+        err = vixlib.VixSnapshot_GetNumChildren(self._snapshot_handle,
+                                                ctypes.byref(num_children))
+        _check_job_err_code(err)
+
+        children = []
+        for i in range(num_children.value):
+            child_handle = vixlib.VixHandle()
+            err = vixlib.VixSnapshot_GetChild(self._snapshot_handle, i,
+                                              ctypes.byref(child_handle))
+            _check_job_err_code(err)
+            children.append(VixSnapshot(child_handle))
+        return children
+
 
 class VixConnection(object):
-    def __init__(self):
+    def __init__(self, vm_cache_size=0):
         self._host_handle = None
         self._software_version = None
         self._host_type = None
 
+        # Open VM handles, keyed by the normalized vmx path. The cache
+        # holds a reference on each handle, released on eviction
+        if vm_cache_size > 0:
+            self._vm_cache = utils.LRUCache(vm_cache_size)
+        else:
+            self._vm_cache = None
+        self._vm_cache_lock = threading.Lock()
+
+        # Pre-rendered static VMX content, keyed by hardware version, guest
+        # OS and device profile
+        self._vmx_templates = {}
+
     def __enter__(self):
         self.connect()
         return self
@@ -387,6 +706,25 @@ class VixConnection(object):
         if destroy_disks:
             self.delete_vm_files(vmx_path)
 
+    def unregister_vms_and_delete_files(self, vmx_paths, destroy_disks=True):
+        vms = []
+        try:
+            jobs = []
+            for vmx_path in vmx_paths:
+                vm = self.open_vm(vmx_path)
+                vms.append(vm)
+                if vm.get_power_state() != vixlib.VIX_POWERSTATE_POWERED_OFF:
+                    jobs.append(vm.power_off_async())
+            wait_for_jobs(jobs)
+        finally:
+            for vm in vms:
+                vm.close()
+
+        self.unregister_vms(vmx_paths)
+        if destroy_disks:
+            for vmx_path in vmx_paths:
+                self.delete_vm_files(vmx_path)
+
     def connect(self):
         job_handle = vixlib.VixHost_Connect(vixlib.VIX_API_VERSION,
                                             get_vix_host_type(),
@@ -395,26 +733,50 @@ class VixConnection(object):
                                             None, None)
 
         host_handle = vixlib.VixHandle()
-        err = vixlib.VixJob_Wait(job_handle,
-                                 vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE,
-                                 ctypes.byref(host_handle),
-                                 vixlib.VIX_PROPERTY_NONE)
+        err = _job_wait(job_handle,
+                        vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE,
+                        ctypes.byref(host_handle),
+                        vixlib.VIX_PROPERTY_NONE)
         vixlib.Vix_ReleaseHandle(job_handle)
         _check_job_err_code(err)
 
         self._host_handle = host_handle
 
-    def open_vm(self, vmx_path):
+    def open_vm_async(self, vmx_path):
         job_handle = vixlib.VixVM_Open(self._host_handle, vmx_path, None, None)
-        vm_handle = vixlib.VixHandle()
-        err = vixlib.VixJob_Wait(job_handle,
-                                 vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE,
-                                 ctypes.byref(vm_handle),
-                                 vixlib.VIX_PROPERTY_NONE)
-        vixlib.Vix_ReleaseHandle(job_handle)
-        _check_job_err_code(err)
+        return VixJob(job_handle, vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE, VixVM)
 
-        return VixVM(vm_handle)
+    def open_vm(self, vmx_path):
+        if self._vm_cache is None:
+            return self.open_vm_async(vmx_path).result()
+
+        key = _get_vm_cache_key(vmx_path)
+        with self._vm_cache_lock:
+            vm_handle = self._vm_cache.get(key)
+            if vm_handle:
+                vixlib.Vix_AddRefHandle(vm_handle)
+                return VixVM(vm_handle)
+
+        vm = self.open_vm_async(vmx_path).result()
+
+        with self._vm_cache_lock:
+            vixlib.Vix_AddRefHandle(vm._vm_handle)
+            for evicted_handle in self._vm_cache.put(key, vm._vm_handle):
+                vixlib.Vix_ReleaseHandle(evicted_handle)
+        return vm
+
+    def invalidate_vm(self, vmx_path):
+        if self._vm_cache is not None:
+            with self._vm_cache_lock:
+                vm_handle = self._vm_cache.pop(_get_vm_cache_key(vmx_path))
+                if vm_handle:
+                    vixlib.Vix_ReleaseHandle(vm_handle)
+
+    def _clear_vm_cache(self):
+        if self._vm_cache is not None:
+            with self._vm_cache_lock:
+                for vm_handle in self._vm_cache.clear():
+                    vixlib.Vix_ReleaseHandle(vm_handle)
 
     def create_vm(self, vmx_path,
                   display_name,
@@ -433,43 +795,15 @@ class VixConnection(object):
                   vnc_port=None,
                   additional_config=None):
 
-        config = {
-            "config.version": "8",
-            "pciBridge0.present": "TRUE",
-            "pciBridge4.present": "TRUE",
-            "pciBridge4.virtualDev": "pcieRootPort",
-            "pciBridge4.functions": "8",
-            "pciBridge5.present": "TRUE",
-            "pciBridge5.virtualDev": "pcieRootPort",
-            "pciBridge5.functions": "8",
-            "pciBridge6.present": "TRUE",
-            "pciBridge6.virtualDev": "pcieRootPort",
-            "pciBridge6.functions": "8",
-            "pciBridge7.present": "TRUE",
-            "pciBridge7.virtualDev": "pcieRootPort",
-            "pciBridge7.functions": "8",
-            "vmci0.present": "TRUE",
-            "hpet0.present": "TRUE",
-            "virtualHW.productCompatibility": "hosted",
-            "powerType.powerOff": "soft",
-            "powerType.powerOn": "hard",
-            "powerType.suspend": "hard",
-            "powerType.reset": "soft",
-            "disk.EnableUUID": "TRUE",
-            "cleanShutdown": "FALSE",
-            "replay.supported": "FALSE",
-            "softPowerOff": "FALSE",
-            "tools.syncTime": "FALSE",
-            "hard-disk.hostBuffer": "disabled",
-            "floppy0.present": "FALSE"
-        }
-
-        config["virtualHW.version"] = str(virtual_hw_version)
+        template = self._get_vmx_template(virtual_hw_version, guest_os,
+                                          nested_hypervisor,
+                                          floppy_path is not None)
+
+        config = collections.OrderedDict()
         config["displayName"] = display_name
         config["numvcpus"] = str(num_vcpus)
         config["cpuid.coresPerSocket"] = str(cores_per_socket)
         config["memsize"] = str(mem_size_mb)
-        config["guestOS"] = guest_os
         config["bios.bootOrder"] = boot_order
 
         if disk_paths:
@@ -484,22 +818,20 @@ class VixConnection(object):
         if networks:
             config.update(self._get_networks_config(networks))
 
-        if nested_hypervisor:
-            config.update(self._get_nested_hypervisor_config())
-
         config.update(self._get_vnc_config(vnc_enabled, vnc_port))
 
         if additional_config:
             config.update(additional_config)
 
+        vmx_data = template.render(config)
+
         vmx_dir = os.path.dirname(vmx_path)
         if not os.path.exists(vmx_dir):
             os.makedirs(vmx_dir)
 
         with open(vmx_path, 'wb') as f:
-            for k, v in config.items():
-                f.write('.encoding = "UTF-8"' + os.linesep)
-                f.write('%(k)s = "%(v)s"' % {'k': k, 'v': v} + os.linesep)
+            f.write(vmx_data)
+        vmx.invalidate(vmx_path)
 
     def update_vm(self, vmx_path,
                   display_name=None,
@@ -560,11 +892,11 @@ class VixConnection(object):
         if additional_config:
             config.update(additional_config)
 
+        vmx_file = vmx.VmxFile.load(vmx_path)
         if networks is not None:
-            remove_vmx_value(vmx_path, r"ethernet[\d]+\.[a-zA-Z]+")
-
-        for (k, v) in config.items():
-            set_vmx_value(vmx_path, k, v)
+            vmx_file.remove_matching(r"ethernet[\d]+\.[a-zA-Z]+")
+        vmx_file.update(config)
+        vmx_file.save()
 
     def _get_vnc_config(self, vnc_enabled, vnc_port):
         config = {}
@@ -620,6 +952,23 @@ class VixConnection(object):
 
         return config
 
+    def _get_vmx_template(self, virtual_hw_version, guest_os,
+                          nested_hypervisor, floppy):
+        key = (str(virtual_hw_version), guest_os, bool(nested_hypervisor),
+               bool(floppy))
+        template = self._vmx_templates.get(key)
+        if not template:
+            config = _VMX_STATIC_CONFIG.items()
+            config.append(("virtualHW.version", str(virtual_hw_version)))
+            config.append(("guestOS", guest_os))
+            if not floppy:
+                config.append(("floppy0.present", "FALSE"))
+            if nested_hypervisor:
+                config += self._get_nested_hypervisor_config().items()
+            template = vmx.VmxTemplate(config)
+            self._vmx_templates[key] = template
+        return template
+
     def _get_floppy_config(self, floppy_path):
         config = {}
         config["floppy0.present"] = "TRUE"
@@ -659,11 +1008,14 @@ class VixConnection(object):
     def register_vm(self, vmx_path):
         job_handle = vixlib.VixHost_RegisterVM(self._host_handle, vmx_path,
                                                None, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
+        err = _job_wait(job_handle, vixlib.VIX_PROPERTY_NONE)
         vixlib.Vix_ReleaseHandle(job_handle)
         _check_job_err_code(err)
 
     def _unregister_vm_local(self, vmx_path):
+        self._unregister_vms_local([vmx_path])
+
+    def _unregister_vms_local(self, vmx_paths):
         #TODO: VM UI settings are not stored in
         # ~/Library/Preferences/VMware Fusion/preferences
         # Look for possible alternatives
@@ -671,62 +1023,57 @@ class VixConnection(object):
             return
 
         pref_file_path = _get_player_preferences_file_path()
+        if not os.path.exists(pref_file_path):
+            return
 
-        if os.path.exists(pref_file_path):
-            with open(pref_file_path, 'r') as f:
-                lines = f.readlines()
-
+        vmx_paths_norm = set()
+        for vmx_path in vmx_paths:
             if sys.platform == 'win32' and os.path.exists(vmx_path):
-                vmx_path_norm = win32api.GetLongPathName(vmx_path)
-            else:
-                vmx_path_norm = vmx_path
-            vmx_path_norm = os.path.normcase(os.path.abspath(vmx_path_norm))
-
-            index = -1
-            for s in lines:
-                m = re.match(r'^pref.mruVM(\d+)\.filename\s*=\s*"(.*)"(\r)?$',
-                             s)
-                if m:
-                    path = os.path.normcase(os.path.abspath(m.group(2)))
-                    if vmx_path_norm == path:
-                        index = int(m.group(1))
-                        break
-
-            if index >= 0:
-                new_lines = []
-                for s in lines:
-                    m = re.match(r'^pref.mruVM(\d+)\.([a-zA-Z]+)\s*=' +
-                                 r'\s*"(.+)"(\r)?$', s)
-                    if not m:
-                        new_lines.append(s)
-                    else:
-                        i = int(m.group(1))
-                        if i < index:
-                            new_lines.append(s)
-                        elif i > index:
-                            new_lines.append('pref.mruVM%(i)s.%(k)s = "%(v)s"'
-                                             % {"i": i - 1,
-                                                "k": m.group(2),
-                                                'v': m.group(3)} + os.linesep)
-
-                with open(pref_file_path, 'w') as f:
-                    for s in new_lines:
-                        f.write(s)
+                vmx_path = win32api.GetLongPathName(vmx_path)
+            vmx_paths_norm.add(os.path.normcase(os.path.abspath(vmx_path)))
+
+        # Serializes the concurrent updates done by the driver, the file
+        # is still rewritten atomically to protect the readers
+        @nova_utils.synchronized('vix-preferences', external=True)
+        def remove_mru_vms():
+            pref_file = vmx.PreferencesFile.load(pref_file_path)
+            indexes = []
+            for (index, path) in pref_file.get_mru_vm_paths().items():
+                if os.path.normcase(os.path.abspath(path)) in vmx_paths_norm:
+                    indexes.append(index)
+            if indexes:
+                pref_file.remove_mru_vms(indexes)
+                pref_file.save()
+        remove_mru_vms()
 
     def _unregister_vm_server(self, vmx_path):
         job_handle = vixlib.VixHost_UnregisterVM(self._host_handle, vmx_path,
                                                  None, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
+        err = _job_wait(job_handle, vixlib.VIX_PROPERTY_NONE)
         vixlib.Vix_ReleaseHandle(job_handle)
         _check_job_err_code(err)
 
     def unregister_vm(self, vmx_path):
+        self.invalidate_vm(vmx_path)
         if get_vix_host_type() in [VIX_VMWARE_PLAYER, VIX_VMWARE_WORKSTATION]:
             self._unregister_vm_local(vmx_path)
         else:
             self._unregister_vm_server(vmx_path)
 
+    def unregister_vms(self, vmx_paths):
+        """Unregisters the given VMs, updating the preferences file once on
+        Workstation and Player.
+        """
+        for vmx_path in vmx_paths:
+            self.invalidate_vm(vmx_path)
+        if get_vix_host_type() in [VIX_VMWARE_PLAYER, VIX_VMWARE_WORKSTATION]:
+            self._unregister_vms_local(vmx_paths)
+        else:
+            for vmx_path in vmx_paths:
+                self._unregister_vm_server(vmx_path)
+
     def disconnect(self):
+        self._clear_vm_cache()
         if self._host_handle:
             vixlib.VixHost_Disconnect(self._host_handle)
             self._host_handle = None
@@ -735,6 +1082,8 @@ class VixConnection(object):
         return os.path.exists(vmx_path)
 
     def delete_vm_files(self, vmx_path):
+        self.invalidate_vm(vmx_path)
+        vmx.invalidate(vmx_path)
         vmx_dir = os.path.dirname(vmx_path)
         if os.path.exists(vmx_dir):
             shutil.rmtree(vmx_dir)
@@ -763,7 +1112,7 @@ class VixConnection(object):
                                               vixlib.VIX_FIND_RUNNING_VMS,
                                               vixlib.VIX_INVALID_HANDLE,
                                               -1, cb, None)
-        err = vixlib.VixJob_Wait(job_handle, vixlib.VIX_PROPERTY_NONE)
+        err = _job_wait(job_handle, vixlib.VIX_PROPERTY_NONE)
         vixlib.Vix_ReleaseHandle(job_handle)
         _check_job_err_code(err)
 
@@ -782,29 +1131,47 @@ class VixConnection(object):
         # TODO: match with HW capabilities as well
         return SUPPORTS_NESTED_VIRT_VMX | SUPPORTS_NESTED_VIRT_EPT
 
-    def clone_vm(self, src_vmx_path, dest_vmx_path, linked_clone=False):
+    def clone_vm_async(self, vm, dest_vmx_path, linked_clone=False,
+                       snapshot=None):
         if linked_clone:
             clone_type = vixlib.VIX_CLONETYPE_LINKED
         else:
             clone_type = vixlib.VIX_CLONETYPE_FULL
 
-        with self.open_vm(src_vmx_path) as vm:
-            job_handle = vixlib.VixVM_Clone(vm._vm_handle,
-                                            vixlib.VIX_INVALID_HANDLE,
-                                            clone_type,
-                                            dest_vmx_path,
-                                            0, vixlib.VIX_INVALID_HANDLE,
-                                            None, None)
-
-            cloned_vm_handle = vixlib.VixHandle()
-            err = vixlib.VixJob_Wait(job_handle,
-                                     vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE,
-                                     ctypes.byref(cloned_vm_handle),
-                                     vixlib.VIX_PROPERTY_NONE)
-            vixlib.Vix_ReleaseHandle(job_handle)
-            _check_job_err_code(err)
+        if snapshot:
+            snapshot_handle = snapshot._snapshot_handle
+        else:
+            snapshot_handle = vixlib.VIX_INVALID_HANDLE
 
-            return VixVM(cloned_vm_handle)
+        job_handle = vixlib.VixVM_Clone(vm._vm_handle,
+                                        snapshot_handle,
+                                        clone_type,
+                                        dest_vmx_path,
+                                        0, vixlib.VIX_INVALID_HANDLE,
+                                        None, None)
+        return VixJob(job_handle, vixlib.VIX_PROPERTY_JOB_RESULT_HANDLE,
+                      VixVM)
+
+    def clone_vm(self, src_vmx_path, dest_vmx_path, linked_clone=False,
+                 snapshot_name=None):
+        """Clones the current state of the VM, or the state of the given
+        snapshot. Clones of a snapshot including the memory state start in
+        the power state of the snapshot.
+        """
+        with self.open_vm(src_vmx_path) as vm:
+            if not snapshot_name:
+                return self.clone_vm_async(vm, dest_vmx_path,
+                                           linked_clone).result()
+
+            snapshot = vm.get_named_snapshot(snapshot_name)
+            if not snapshot:
+                raise utils.VixException(
+                    _("Snapshot %(snapshot_name)s not found for VM "
+                      "%(vmx_path)s") % {'snapshot_name': snapshot_name,
+                                         'vmx_path': src_vmx_path})
+            with snapshot:
+                return self.clone_vm_async(vm, dest_vmx_path, linked_clone,
+                                           snapshot).result()
 
     def get_software_version(self):
         if not self._software_version:
@@ -0,0 +1,230 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import os
+import re
+
+from vix import utils
+
+_VALUE_REGEX = re.compile(r'^([^\s=]+)\s*=\s*"(.*)"(\r)?$')
+
+_MRU_VM_REGEX = re.compile(r'^pref\.mruVM(\d+)\.(.+)$', re.IGNORECASE)
+
+_CACHE_SIZE = 256
+
+# Parsed files, keyed by normalized path and validated with the file
+# modification time, size and inode
+_cache = utils.LRUCache(_CACHE_SIZE)
+
+
+def _get_cache_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def load_cached(path):
+    """Returns the parsed file, parsing it again only if it changed since
+    the last call. The returned object is shared and must not be modified.
+    """
+    st = os.stat(path)
+    stamp = (st.st_mtime, st.st_size, st.st_ino)
+
+    key = _get_cache_key(path)
+    cached = _cache.get(key)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    vmx_file = VmxFile.load(path)
+    _cache.put(key, (stamp, vmx_file))
+    return vmx_file
+
+
+def invalidate(path):
+    _cache.pop(_get_cache_key(path))
+
+
+def _format_entry(name, value):
+    return '%(k)s = "%(v)s"' % {'k': name, 'v': value}
+
+
+def _join_lines(lines):
+    if not lines:
+        return ''
+    return os.linesep.join(lines) + os.linesep
+
+
+class VmxFile(object):
+    """VMX or VMSD configuration file.
+
+    The file is parsed once, edited in memory and written back with a
+    single atomic save(). Keys are case insensitive and the original order
+    of the entries is preserved, including lines that are not key / value
+    pairs.
+    """
+    def __init__(self, path):
+        self._path = path
+        # Each entry is a [key, value] list, or [None, line] for lines
+        # that are not key / value pairs
+        self._entries = []
+        self._index = {}
+
+    @classmethod
+    def load(cls, path):
+        vmx_file = cls(path)
+        with open(path, 'rb') as f:
+            for s in f.readlines():
+                s = s.rstrip('\r\n')
+                m = _VALUE_REGEX.match(s)
+                if m:
+                    vmx_file._append(m.group(1), m.group(2))
+                else:
+                    vmx_file._entries.append([None, s])
+        return vmx_file
+
+    @property
+    def path(self):
+        return self._path
+
+    def _append(self, name, value):
+        entry = [name, value]
+        self._entries.append(entry)
+        self._index[name.lower()] = entry
+
+    def __contains__(self, name):
+        return name.lower() in self._index
+
+    def get(self, name, default=None):
+        entry = self._index.get(name.lower())
+        if entry:
+            return entry[1]
+        return default
+
+    def set(self, name, value):
+        value = str(value)
+        entry = self._index.get(name.lower())
+        if entry:
+            entry[1] = value
+        else:
+            self._append(name, value)
+
+    def update(self, config):
+        for (name, value) in config.items():
+            self.set(name, value)
+
+    def remove(self, name):
+        self.remove_matching(re.escape(name))
+
+    def remove_matching(self, pattern):
+        """Removes the entries whose whole key matches the given regex."""
+        regex = re.compile(r'^(%s)$' % pattern, re.IGNORECASE)
+        entries = []
+        for entry in self._entries:
+            if entry[0] is not None and regex.match(entry[0]):
+                if self._index.get(entry[0].lower()) is entry:
+                    del self._index[entry[0].lower()]
+            else:
+                entries.append(entry)
+        self._entries = entries
+
+    def items(self):
+        return [(k, v) for (k, v) in self._entries if k is not None]
+
+    def to_string(self):
+        lines = []
+        for (name, value) in self._entries:
+            if name is None:
+                lines.append(value)
+            else:
+                lines.append(_format_entry(name, value))
+        return _join_lines(lines)
+
+    def save(self, path=None):
+        """Writes the file atomically, optionally to a new path."""
+        if path:
+            self._path = path
+
+        utils.write_file_atomic(self._path, self.to_string())
+        invalidate(self._path)
+
+
+class PreferencesFile(VmxFile):
+    """VMware Workstation / Player preferences file, including the list of
+    the most recently used (MRU) virtual machines.
+    """
+    def get_mru_vm_paths(self):
+        """Returns the vmx paths in the MRU list, keyed by index."""
+        paths = {}
+        for (name, value) in self.items():
+            m = _MRU_VM_REGEX.match(name)
+            if m and m.group(2).lower() == 'filename':
+                paths[int(m.group(1))] = value
+        return paths
+
+    def remove_mru_vms(self, indexes):
+        """Removes the given MRU entries in a single pass, renumbering the
+        following ones to keep the list contiguous.
+        """
+        removed = sorted(set(indexes))
+        if not removed:
+            return
+
+        entries = []
+        self._index = {}
+        for entry in self._entries:
+            if entry[0] is not None:
+                m = _MRU_VM_REGEX.match(entry[0])
+                if m:
+                    i = int(m.group(1))
+                    shift = bisect.bisect_left(removed, i)
+                    if shift < len(removed) and removed[shift] == i:
+                        continue
+                    if shift:
+                        entry[0] = 'pref.mruVM%(i)d.%(k)s' % {
+                            'i': i - shift, 'k': m.group(2)}
+                self._index[entry[0].lower()] = entry
+            entries.append(entry)
+        self._entries = entries
+
+
+class VmxTemplate(object):
+    """Static part of a VMX file, rendered once and shared by the files
+    with the same hardware configuration.
+    """
+    def __init__(self, config):
+        self._lines = [(name.lower(), _format_entry(name, value))
+                       for (name, value) in config]
+        self._keys = set([name for (name, line) in self._lines])
+        self._text = self._render_static(set())
+
+    def _render_static(self, excluded_keys):
+        return _join_lines(['.encoding = "UTF-8"'] +
+                           [line for (name, line) in self._lines
+                            if name not in excluded_keys])
+
+    def render(self, config):
+        """Returns the VMX file content, with the template entries followed
+        by the given ones. Entries in config replace the template ones with
+        the same key.
+        """
+        overridden_keys = self._keys.intersection(
+            [name.lower() for name in config])
+        if overridden_keys:
+            text = self._render_static(overridden_keys)
+        else:
+            text = self._text
+        return text + _join_lines([_format_entry(name, value)
+                                   for (name, value) in config.items()])